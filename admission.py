@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Web 接口的准入控制
+每个接口限制同时处理的请求数，超出的请求进入有界等待队列；
+队列按客户端轮转出队（一个客户端的突发请求不会挡住其他人），短请求优先。
+预计等待时间超过上限、队列已满或单个客户端排队过多时立即拒绝（503 / 429），
+并按实测的处理时间给出 Retry-After，过载时 p99 延迟有上限而不是全部超时。
+
+用法:
+    admission = AdmissionController("upload-audio", max_concurrency=4, max_queue=32, max_wait=5)
+    async with admission.slot(client_id(request), PRIORITY_HIGH):
+        ...
+"""
+
+import os
+import math
+import time
+import asyncio
+import contextlib
+from collections import OrderedDict, deque
+from metrics import counter, gauge, histogram
+
+ADMISSION_PER_CLIENT_QUEUE = int(os.getenv("ADMISSION_PER_CLIENT_QUEUE", "4"))  # 单个客户端最多排队的请求数，超出返回 429
+ADMISSION_PRIORITY_BURST = int(os.getenv("ADMISSION_PRIORITY_BURST", "3"))  # 普通请求等待时，最多连续放行的优先请求数
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "")  # 区分客户端的请求头（如 X-Forwarded-For），为空时用来源地址
+
+PRIORITY_HIGH = 0  # 短音频、短文本
+PRIORITY_NORMAL = 1
+
+SERVICE_TIME_ALPHA = 0.2  # 处理时间滑动平均的权重
+
+ADMISSION_REJECTED = counter("diyvoice_admission_rejected_total", "准入控制拒绝的请求数", ["endpoint", "reason"])
+ADMISSION_WAIT_SECONDS = histogram("diyvoice_admission_wait_seconds", "请求在准入队列中的等待时间（秒）", ["endpoint"])
+ADMISSION_QUEUED = gauge("diyvoice_admission_queued", "准入队列中等待的请求数", ["endpoint"])
+ADMISSION_IN_FLIGHT = gauge("diyvoice_admission_in_flight", "已放行、正在处理的请求数", ["endpoint"])
+
+
+class AdmissionRejected(Exception):
+    """请求被拒绝，status 为 429 或 503，retry_after 为建议的重试间隔（秒）"""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def headers(self):
+        return {"Retry-After": str(self.retry_after)}
+
+
+def client_id(request):
+    """请求所属的客户端"""
+    if ADMISSION_CLIENT_HEADER:
+        value = request.headers.get(ADMISSION_CLIENT_HEADER)
+        if value:
+            return value.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class _Waiter:
+    __slots__ = ("future", "client", "priority", "enqueued")
+
+    def __init__(self, client, priority):
+        self.future = asyncio.get_running_loop().create_future()
+        self.client = client
+        self.priority = priority
+        self.enqueued = time.monotonic()
+
+
+class AdmissionController:
+    """单个接口的准入控制（在事件循环线程中使用）
+
+    max_concurrency 为 0 时不限制；max_wait 是请求最多排队的秒数，
+    预计等待（排在前面的请求数 × 平均处理时间 / 并发数）超过它的请求直接拒绝。
+    """
+
+    def __init__(self, name, max_concurrency, max_queue, max_wait, per_client_queue=ADMISSION_PER_CLIENT_QUEUE,
+                 priority_burst=ADMISSION_PRIORITY_BURST, initial_service_time=1.0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.per_client_queue = per_client_queue
+        self.priority_burst = priority_burst
+        self.service_time = initial_service_time
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {}
+        self._levels = (OrderedDict(), OrderedDict())  # 按优先级，客户端 -> 等待队列
+        self._client_queued = {}
+        self._burst = 0
+        ADMISSION_QUEUED.labels(name).set_function(lambda: self.queued)
+        ADMISSION_IN_FLIGHT.labels(name).set_function(lambda: self.in_flight)
+
+    def estimated_wait(self):
+        """新请求的预计排队时间（秒）"""
+        if self.max_concurrency <= 0 or (self.in_flight < self.max_concurrency and not self.queued):
+            return 0.0
+        return (self.queued + 1) * self.service_time / self.max_concurrency
+
+    def retry_after(self):
+        return max(1, math.ceil(self.estimated_wait()))
+
+    def _reject(self, status, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        ADMISSION_REJECTED.labels(self.name, reason).inc()
+        raise AdmissionRejected(status, reason, self.retry_after())
+
+    async def acquire(self, client, priority=PRIORITY_NORMAL):
+        """等待放行，被拒绝时抛出 AdmissionRejected"""
+        if self.max_concurrency <= 0:
+            return
+        if self.in_flight < self.max_concurrency and not self.queued:
+            self._admit(0.0)
+            return
+        if self.queued >= self.max_queue:
+            self._reject(503, "queue_full")
+        if self._client_queued.get(client, 0) >= self.per_client_queue:
+            self._reject(429, "client_limit")
+        if self.estimated_wait() > self.max_wait:
+            self._reject(503, "overloaded")
+
+        waiter = self._enqueue(client, priority)
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            # 客户端断开：已放行则归还名额，否则移出队列
+            if waiter.future.done():
+                self._finish()
+            else:
+                waiter.future.cancel()
+                self._dequeue(waiter)
+            raise
+        if not waiter.future.done():
+            waiter.future.cancel()
+            self._dequeue(waiter)
+            self._reject(503, "timeout")
+
+    def release(self, started):
+        """处理结束，记录处理时间并放行下一个请求"""
+        if self.max_concurrency <= 0:
+            return
+        elapsed = time.monotonic() - started
+        self.service_time += SERVICE_TIME_ALPHA * (elapsed - self.service_time)
+        self._finish()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, client, priority=PRIORITY_NORMAL):
+        await self.acquire(client, priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    def _admit(self, waited):
+        self.in_flight += 1
+        self.admitted += 1
+        ADMISSION_WAIT_SECONDS.labels(self.name).observe(waited)
+
+    def _finish(self):
+        self.in_flight -= 1
+        while self.in_flight < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            if waiter.future.done():
+                continue
+            self._admit(time.monotonic() - waiter.enqueued)
+            waiter.future.set_result(None)
+
+    def _enqueue(self, client, priority):
+        waiter = _Waiter(client, priority)
+        self._levels[priority].setdefault(client, deque()).append(waiter)
+        self._client_queued[client] = self._client_queued.get(client, 0) + 1
+        self.queued += 1
+        return waiter
+
+    def _dequeue(self, waiter):
+        level = self._levels[waiter.priority]
+        waiters = level.get(waiter.client)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del level[waiter.client]
+        self._forget(waiter)
+
+    def _forget(self, waiter):
+        self.queued -= 1
+        remaining = self._client_queued[waiter.client] - 1
+        if remaining:
+            self._client_queued[waiter.client] = remaining
+        else:
+            del self._client_queued[waiter.client]
+
+    def _next_waiter(self):
+        """优先级高的先出队（普通请求等待时最多连续 priority_burst 个），同一级别内按客户端轮转"""
+        high, normal = self._levels
+        if high and (not normal or self._burst < self.priority_burst):
+            level = high
+            self._burst += 1
+        elif normal:
+            level = normal
+            self._burst = 0
+        else:
+            return None
+        client, waiters = next(iter(level.items()))
+        waiter = waiters.popleft()
+        if waiters:
+            level.move_to_end(client)
+        else:
+            del level[client]
+        self._forget(waiter)
+        return waiter
+
+    def stats(self):
+        return {
+            "endpoint": self.name,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_wait": self.max_wait,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "service_time": round(self.service_time, 3),
+            "estimated_wait": round(self.estimated_wait(), 3),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
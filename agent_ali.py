@@ -13,9 +13,7 @@
 
 import os
 from openai import OpenAI
-import base64
-import numpy as np
-import soundfile as sf
+from omni_decoder import OmniDecoder, WavStreamWriter
 
 client = OpenAI(
     # 若没有配置环境变量，请用阿里云百炼API Key将下行替换为：api_key="sk-xxx",
@@ -34,21 +32,18 @@ completion = client.chat.completions.create(
     stream_options={"include_usage": True},
 )
 
-# 方式1: 待生成结束后再进行解码
-audio_string = ""
+# 方式1: 边接收边解码并写入 WAV 文件（base64 按4字节边界增量解码，不拼接整段字符串）
+writer = WavStreamWriter("audio_assistant_py.wav", rate=24000)
+decoder = OmniDecoder(on_audio=writer.write)
 for chunk in completion:
-    if chunk.choices:
-        if hasattr(chunk.choices[0].delta, "audio"):
-            try:
-                audio_string += chunk.choices[0].delta.audio["data"]
-            except Exception as e:
-                print(chunk.choices[0].delta.audio["transcript"])
-    else:
-        print(chunk.usage)
-
-wav_bytes = base64.b64decode(audio_string)
-audio_np = np.frombuffer(wav_bytes, dtype=np.int16)
-sf.write("audio_assistant_py.wav", audio_np, samplerate=24000)
+    for kind, value in decoder.feed(chunk):
+        if kind == "transcript":
+            print(value, end="", flush=True)
+        elif kind == "usage":
+            print()
+            print(value)
+decoder.finish()
+writer.close()
 
 # 方式2: 边生成边解码(使用方式2请将方式1的代码进行注释)
 # # 初始化 PyAudio
@@ -61,17 +56,12 @@ sf.write("audio_assistant_py.wav", audio_np, samplerate=24000)
 #                 rate=24000,
 #                 output=True)
 
+# decoder = OmniDecoder(on_audio=stream.write)
 # for chunk in completion:
-#     if chunk.choices:
-#         if hasattr(chunk.choices[0].delta, "audio"):
-#             try:
-#                 audio_string = chunk.choices[0].delta.audio["data"]
-#                 wav_bytes = base64.b64decode(audio_string)
-#                 audio_np = np.frombuffer(wav_bytes, dtype=np.int16)
-#                 # 直接播放音频数据
-#                 stream.write(audio_np.tobytes())
-#             except Exception as e:
-#                 print(chunk.choices[0].delta.audio["transcript"])
+#     for kind, value in decoder.feed(chunk):
+#         if kind == "transcript":
+#             print(value, end="", flush=True)
+# decoder.finish()
 
 # time.sleep(0.8)
 # # 清理资源
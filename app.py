@@ -1,120 +1,622 @@
-from fastapi import FastAPI, File, UploadFile, Request, Response
+from fastapi import FastAPI, File, UploadFile, Request, Response, WebSocket, WebSocketDisconnect
 import os
-from openai import OpenAI
-import base64
+import json
+import time
+import asyncio
+from contextlib import aclosing
+import httpx
+from openai import AsyncOpenAI
 import io
 from pydub import AudioSegment
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
-from faster_whisper import WhisperModel
-import shutil
-import os
-from datetime import datetime
 import numpy as np
 import soundfile as sf
+from asr_pool import ASRWorkerPool, QueueFullError
+from admission import AdmissionController, AdmissionRejected, client_id, PRIORITY_HIGH, PRIORITY_NORMAL
+from asr_model import load_model, ASR_LOAD_MODE, ASR_SERVER_SOCKET
+from asr_cascade import ASR_CASCADE, cascade_stats
+from decoding_policy import entry_policy
+from metrics import (
+    CONTENT_TYPE, VAD_TRIGGERS, RECORDING_SECONDS, LLM_ERRORS, CONVERSATION_TURNS,
+    gauge, observe_llm, render as render_metrics,
+)
+from tts_cache import TTSCache, cache_key, TTS_MODEL, TTS_VOICE, TTS_FORMAT
+from artifact_store import ArtifactStore, parse_range
+from vad import create_vad, Endpointer
+from audio_io import StreamResampler
+from streaming_asr import IncrementalTranscriber
+from omni_decoder import OmniDecoder
 
 app = FastAPI()
 templates = Jinja2Templates(directory="templates")
 
-# 添加静态文件服务，使llmanswer目录可被访问
-from fastapi.staticfiles import StaticFiles
-app.mount("/diyvoice/llmanswer", StaticFiles(directory="diyvoice/llmanswer"), name="llmanswer")
+# 回复音频保存在内存中，通过 /diyvoice/audio/{id} 访问
+ARTIFACT_MAX_MB = int(os.getenv("ARTIFACT_MAX_MB", "64"))  # 内存中回复音频的总大小上限
+ARTIFACT_TTL_SECONDS = float(os.getenv("ARTIFACT_TTL_SECONDS", "300"))  # 回复音频保留时间
+ARTIFACT_RELEASED_TTL_SECONDS = float(os.getenv("ARTIFACT_RELEASED_TTL_SECONDS", "30"))  # 客户端释放后的保留时间
+ARTIFACT_REAP_INTERVAL = float(os.getenv("ARTIFACT_REAP_INTERVAL", "10"))  # 后台清理间隔（秒）
+
+artifact_store = ArtifactStore(
+    max_bytes=ARTIFACT_MAX_MB * 1024 * 1024,
+    ttl=ARTIFACT_TTL_SECONDS,
+    released_ttl=ARTIFACT_RELEASED_TTL_SECONDS,
+)
+
+
+async def reap_artifacts():
+    while True:
+        await asyncio.sleep(ARTIFACT_REAP_INTERVAL)
+        removed = artifact_store.reap()
+        if removed:
+            print(f"已清理过期回复音频：{removed} 个")
+
+
+@app.on_event("startup")
+async def start_artifact_reaper():
+    app.state.artifact_reaper = asyncio.create_task(reap_artifacts())
+
+
+@app.on_event("shutdown")
+async def stop_artifact_reaper():
+    app.state.artifact_reaper.cancel()
+
+# 识别任务池配置
+ASR_REPLICAS = int(os.getenv("ASR_REPLICAS", "1"))  # 模型副本数
+ASR_POOL_MODE = os.getenv("ASR_POOL_MODE", "thread")  # thread 或 process
+ASR_QUEUE_SIZE = int(os.getenv("ASR_QUEUE_SIZE", "32"))  # 等待中的识别任务上限
+ASR_BATCH_SIZE = int(os.getenv("ASR_BATCH_SIZE", "1"))  # 大于1时合并并发的短音频批量推理
+ASR_BATCH_WINDOW_MS = int(os.getenv("ASR_BATCH_WINDOW_MS", "50"))  # 凑批等待时间
+
+
+# 解码策略：上传和最终结果用 ASR_POLICY_WEB，WebSocket 中间结果用 ASR_POLICY_PARTIAL
+WEB_POLICY = entry_policy("web")
+PARTIAL_POLICY = entry_policy("partial")
+
+
+def load_whisper_model():
+    """加载 FastWhisper 模型，规格由 WHISPER_MODEL_SIZE、WHISPER_COMPUTE_TYPE 等环境变量配置（见 asr_model.py）"""
+    return load_model()
+
+
+asr_pool = ASRWorkerPool(
+    load_whisper_model,
+    replicas=ASR_REPLICAS,
+    mode=ASR_POOL_MODE,
+    max_queue=ASR_QUEUE_SIZE,
+    # 使用识别模型服务时由服务端合并推理，本地不再凑批
+    batch_size=1 if ASR_SERVER_SOCKET else ASR_BATCH_SIZE,
+    batch_window=ASR_BATCH_WINDOW_MS / 1000,
+    transcribe_options={"policy": WEB_POLICY},
+)
+
+
+@app.on_event("startup")
+async def start_asr_pool():
+    # lazy 模式下首个识别请求到来时才加载模型，uvicorn --reload 重启不再每次加载
+    if ASR_LOAD_MODE == "lazy":
+        return
+    asr_pool.start()
+    if ASR_LOAD_MODE == "eager":
+        await asyncio.to_thread(asr_pool.wait_ready)
+
+
+@app.on_event("shutdown")
+def stop_asr_pool():
+    asr_pool.shutdown()
+
+
+# 百炼API客户端配置，DASHSCOPE_BASE_URL 可指向 mock_dashscope.py 做压测
+DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY", "xMJKMQQmFiv4G4HyouBnXI764sq8BttpC8848E7DD8F911ED9A5512FBC092A79E")
+DASHSCOPE_BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))  # 连接池最大连接数
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))  # 保持的空闲长连接数
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))  # 空闲长连接保留时间（秒）
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))  # 建立连接超时（秒）
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "30"))  # 两个数据块之间的最长等待（秒）
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "120"))  # 单次请求总超时（秒）
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # 建立请求失败时的重试次数
+
+# 所有请求共用一个异步客户端，复用TLS连接
+llm_client = None
+
+# 相同文本的TTS结果直接从缓存返回
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "1") == "1"
+tts_cache = TTSCache() if TTS_CACHE_ENABLED else None
+
+
+@app.on_event("startup")
+def create_llm_client():
+    global llm_client
+    timeout = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+    llm_client = AsyncOpenAI(
+        api_key=DASHSCOPE_API_KEY,
+        base_url=DASHSCOPE_BASE_URL,
+        max_retries=LLM_MAX_RETRIES,
+        timeout=timeout,
+        http_client=httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+        ),
+    )
+
 
-# 加载 FastWhisper 模型（可选择 base、small、medium 等）
-# model = WhisperModel("large-v3", device="cuda", compute_type="int8_float16")
-model = WhisperModel("medium", device="cpu", compute_type="int8")
+@app.on_event("shutdown")
+async def close_llm_client():
+    if llm_client:
+        await llm_client.close()
+
+
+async def iter_omni_events(text, decoder=None):
+    """流式请求 qwen-omni，逐个产出 ("audio", PCM字节)、("transcript", 文本)、("text", 文本) 或 ("usage", 用量)
+
+    decoder 为 OmniDecoder（见 omni_decoder.py），需要完整音频时传入保留音频的解码器，结束后从中取出。
+    无论正常结束、出错、被取消还是提前关闭，都会关闭流式响应，把连接还给共享连接池；
+    调用方应通过 contextlib.aclosing 使用，保证提前退出时生成器也被关闭
+    """
+    timings = {"request": time.monotonic()}
+    if decoder is None:
+        decoder = OmniDecoder(keep_audio=False, timeout=LLM_REQUEST_TIMEOUT)
+    decoder.timings = timings
+    completion = await llm_client.chat.completions.create(
+        model=TTS_MODEL,
+        messages=[{"role": "user", "content": text}],
+        modalities=["text","audio"],
+        audio={"voice": TTS_VOICE, "format": TTS_FORMAT},
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+
+    try:
+        async for chunk in completion:
+            for event in decoder.feed(chunk):
+                yield event
+    finally:
+        await completion.close()
+    decoder.finish()
+    observe_llm("web", timings, decoder.audio_bytes)
+
+
+async def request_omni_audio(text):
+    """流式请求 qwen-omni 并返回完整的 PCM 音频"""
+    decoder = OmniDecoder(timeout=LLM_REQUEST_TIMEOUT)
+    async with aclosing(iter_omni_events(text, decoder)) as events:
+        async for kind, value in events:
+            if kind == "usage":
+                print(value)
+    if decoder.transcript:
+        print(decoder.transcript)
+    return decoder.audio()
+
+ASR_SAMPLE_RATE = 16000
+# 原始PCM上传的内容类型：audio/pcm 为小端16位，audio/L16 按RFC 2586为大端16位
+# 可带参数 rate（默认16000）和 channels（默认1），例如 audio/pcm;rate=48000
+RAW_PCM_TYPES = {"audio/pcm": "<i2", "audio/l16": ">i2"}
+
+
+def parse_content_type(content_type):
+    """拆分内容类型和参数"""
+    parts = [part.strip() for part in (content_type or "").split(";")]
+    params = {}
+    for part in parts[1:]:
+        if "=" in part:
+            name, value = part.split("=", 1)
+            params[name.strip().lower()] = value.strip().strip('"')
+    return parts[0].lower(), params
+
+
+def pcm16_to_float32(data, dtype="<i2", rate=ASR_SAMPLE_RATE, channels=1):
+    """16位PCM字节转为 16kHz 单声道 float32 数组"""
+    samples = np.frombuffer(data, dtype=dtype, count=len(data) // (2 * channels) * channels)
+    audio = samples.astype(np.float32)
+    audio *= 1.0 / 32768.0
+    if channels > 1:
+        audio = audio.reshape(-1, channels).mean(axis=1)
+    if rate != ASR_SAMPLE_RATE and len(audio):
+        target = np.arange(int(len(audio) * ASR_SAMPLE_RATE / rate)) * (rate / ASR_SAMPLE_RATE)
+        audio = np.interp(target, np.arange(len(audio)), audio).astype(np.float32)
+    return audio
+
+
+def decode_upload(data, content_type):
+    """上传内容转为识别任务的输入
+
+    原始PCM直接转换为数组；WebM/Opus 等容器格式包装为内存文件，由识别任务池在工作线程中解码。
+    采样率或声道数不合法时抛出 ValueError
+    """
+    media_type, params = parse_content_type(content_type)
+    if media_type in RAW_PCM_TYPES:
+        rate = int(params.get("rate", ASR_SAMPLE_RATE))
+        channels = int(params.get("channels", 1))
+        if rate <= 0:
+            raise ValueError(f"采样率必须大于0: {rate}")
+        if channels < 1:
+            raise ValueError(f"声道数必须至少为1: {channels}")
+        return pcm16_to_float32(data, RAW_PCM_TYPES[media_type], rate=rate, channels=channels)
+    return io.BytesIO(data)
+
+# 准入控制：每个接口同时处理的请求数和等待队列（见 admission.py），并发数为 0 表示不限制
+ADMISSION_ASR_CONCURRENCY = int(os.getenv("ADMISSION_ASR_CONCURRENCY", str(2 * ASR_REPLICAS * max(ASR_BATCH_SIZE, 1))))
+ADMISSION_ASR_QUEUE = int(os.getenv("ADMISSION_ASR_QUEUE", "32"))  # 识别请求的等待队列长度
+ADMISSION_ASR_MAX_WAIT = float(os.getenv("ADMISSION_ASR_MAX_WAIT", "5"))  # 识别请求最长排队时间（秒）
+ADMISSION_TTS_CONCURRENCY = int(os.getenv("ADMISSION_TTS_CONCURRENCY", "16"))  # 同时进行的上游语音生成请求数
+ADMISSION_TTS_QUEUE = int(os.getenv("ADMISSION_TTS_QUEUE", "64"))
+ADMISSION_TTS_MAX_WAIT = float(os.getenv("ADMISSION_TTS_MAX_WAIT", "10"))
+ADMISSION_SHORT_SECONDS = float(os.getenv("ADMISSION_SHORT_SECONDS", "3"))  # 短于该时长的音频优先识别
+ADMISSION_SHORT_BYTES = int(os.getenv("ADMISSION_SHORT_BYTES", "48000"))  # 容器格式上传按大小估计时长
+ADMISSION_SHORT_CHARS = int(os.getenv("ADMISSION_SHORT_CHARS", "20"))  # 短文本的回复优先生成
+
+asr_admission = AdmissionController("upload-audio", ADMISSION_ASR_CONCURRENCY, ADMISSION_ASR_QUEUE,
+                                    ADMISSION_ASR_MAX_WAIT)
+tts_admission = AdmissionController("generate-tts", ADMISSION_TTS_CONCURRENCY, ADMISSION_TTS_QUEUE,
+                                    ADMISSION_TTS_MAX_WAIT, initial_service_time=3.0)
+
+
+def upload_priority(audio, data):
+    """短音频优先：PCM 上传按采样数计算时长，容器格式按大小估计"""
+    if isinstance(audio, np.ndarray):
+        short = len(audio) / ASR_SAMPLE_RATE <= ADMISSION_SHORT_SECONDS
+    else:
+        short = len(data) <= ADMISSION_SHORT_BYTES
+    return PRIORITY_HIGH if short else PRIORITY_NORMAL
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 @app.get("/diyvoice", response_class=HTMLResponse)
 async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 @app.post("/diyvoice/upload-audio/")
-async def upload_audio(file: UploadFile = File(...)):
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{UPLOAD_DIR}/audio_{timestamp}.webm"
-    
-    with open(filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    print(f"收到音频：{filename}")
+async def upload_audio(request: Request, file: UploadFile = File(...)):
+    data = await file.read()
+    print(f"收到音频：{file.filename}（{file.content_type}，{len(data)} 字节）")
     try:
-        segments, info = model.transcribe(filename, language='zh',beam_size=5)
-        full_text = "".join(segment.text for segment in segments)
+        audio = decode_upload(data, file.content_type)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"text": "", "error": f"无法解析音频参数：{str(e)}"})
+    try:
+        async with asr_admission.slot(client_id(request), upload_priority(audio, data)):
+            full_text = await asr_pool.transcribe(audio)
         print("识别结果：", full_text)
-    finally:
-        # 确保即使报错也会清理文件
-        if os.path.exists(filename):
-            os.remove(filename)
-            print(f"已删除文件：{filename}")
+    except AdmissionRejected as e:
+        print(f"识别请求被拒绝（{e.reason}），建议 {e.retry_after} 秒后重试")
+        return JSONResponse(status_code=e.status, headers=e.headers(),
+                            content={"text": "", "error": "识别服务繁忙，请稍后重试"})
+    except QueueFullError as e:
+        print(f"识别队列已满，拒绝请求：{str(e)}")
+        return JSONResponse(status_code=503, headers={"Retry-After": str(asr_admission.retry_after())},
+                            content={"text": "", "error": "识别服务繁忙，请稍后重试"})
 
     return {"text": full_text}
 
+# 识别任务池的当前状态在输出指标时读取
+gauge("diyvoice_asr_queue_depth", "等待中的识别任务数").set_function(lambda: asr_pool.stats()["queue_depth"])
+gauge("diyvoice_asr_in_flight", "正在解码的识别任务数").set_function(lambda: asr_pool.stats()["in_flight"])
+gauge("diyvoice_asr_ready", "模型是否已加载完成").set_function(lambda: int(asr_pool.ready))
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式的指标"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+
+@app.get("/diyvoice/ready")
+async def readiness():
+    """模型加载完成前返回 503，供负载均衡和启动脚本探测
+
+    lazy 模式下模型在首次识别时才加载，服务本身随时可以接收请求，因此返回 200 并标明尚未加载
+    """
+    if asr_pool.ready:
+        return {"ready": True}
+    if ASR_LOAD_MODE == "lazy":
+        return {"ready": False, "load_mode": ASR_LOAD_MODE}
+    return JSONResponse(status_code=503, content={"ready": False, "load_mode": ASR_LOAD_MODE})
+
+
+@app.get("/diyvoice/asr-stats")
+async def asr_stats():
+    stats = asr_pool.stats()
+    if ASR_CASCADE:
+        stats["cascade"] = cascade_stats.snapshot()
+    stats["policies"] = [WEB_POLICY.stats(), PARTIAL_POLICY.stats()]
+    return stats
+
+@app.get("/diyvoice/admission-stats")
+async def admission_stats():
+    return [asr_admission.stats(), tts_admission.stats()]
+
+@app.get("/diyvoice/audio-store-stats")
+async def audio_store_stats():
+    return artifact_store.stats()
+
+@app.get("/diyvoice/tts-cache-stats")
+async def tts_cache_stats():
+    return tts_cache.stats() if tts_cache else {"enabled": False}
+
 @app.post("/diyvoice/generate-tts/")
 async def generate_tts(request: Request):
     data = await request.json()
     text = data.get("text")
     print(f"TTS请求文本: {text}")
     
-    client = OpenAI(
-        api_key="xMJKMQQmFiv4G4HyouBnXI764sq8BttpC8848E7DD8F911ED9A5512FBC092A79E",
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
-    
-    print("正在调用TTS API...")
-    completion = client.chat.completions.create(
-        model="qwen-omni-turbo",
-        messages=[{"role": "user", "content": text}],
-        modalities=["text","audio"],
-        audio={"voice": "Cherry", "format": "wav"},
-        stream=True,
-        stream_options={"include_usage": True},
-    )
-
     try:
-        audio_string = ""
-        for chunk in completion:
-            if chunk.choices:
-                if hasattr(chunk.choices[0].delta, "audio"):
-                    try:
-                        audio_string += chunk.choices[0].delta.audio["data"]
-                    except Exception as e:
-                        print(chunk.choices[0].delta.audio["transcript"])
-            else:
-                print(chunk.usage)
-
-        wav_bytes = base64.b64decode(audio_string)
+        key = cache_key(text) if tts_cache else None
+        wav_bytes = tts_cache.get(key) if key else None
+        if wav_bytes is not None:
+            print("TTS缓存命中，跳过API调用")
+        else:
+            priority = PRIORITY_HIGH if text and len(text) <= ADMISSION_SHORT_CHARS else PRIORITY_NORMAL
+            async with tts_admission.slot(client_id(request), priority):
+                print("正在调用TTS API...")
+                wav_bytes = await asyncio.wait_for(request_omni_audio(text), timeout=LLM_REQUEST_TIMEOUT)
+            if key and wav_bytes:
+                tts_cache.put(key, wav_bytes)
         audio_np = np.frombuffer(wav_bytes, dtype=np.int16)
 
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"diyvoice/llmanswer/tts_{timestamp}.wav"
-        with open(output_filename, "wb") as f:
-            f.write(wav_bytes)
-        print(f"Audio saved to {output_filename}")
-        sf.write(output_filename, audio_np, samplerate=24000)
+        buffer = io.BytesIO()
+        sf.write(buffer, audio_np, samplerate=24000, format="WAV")
+        audio_id = artifact_store.put(buffer.getvalue(), "audio/wav")
+        print(f"Audio stored as {audio_id}")
+        CONVERSATION_TURNS.labels("web").inc()
     
-        return {"status": "success", "file_path": output_filename}
+        return {"status": "success", "file_path": f"/diyvoice/audio/{audio_id}", "audio_id": audio_id}
+    except AdmissionRejected as e:
+        print(f"TTS请求被拒绝（{e.reason}），建议 {e.retry_after} 秒后重试")
+        return JSONResponse(status_code=e.status, headers=e.headers(),
+                            content={"status": "busy", "error": "语音生成服务繁忙，请稍后重试"})
     except Exception as e:
         print(f"TTS generation error: {str(e)}")
+        LLM_ERRORS.labels("web").inc()
         return Response(content="", status_code=500)
 
+@app.get("/diyvoice/audio/{audio_id}")
+async def get_audio(audio_id: str, request: Request):
+    artifact = artifact_store.get(audio_id)
+    if artifact is None:
+        return Response(status_code=404)
+
+    total = len(artifact.data)
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "private, max-age=300"}
+    range_header = request.headers.get("range")
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, total)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{total}"})
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+            return Response(content=artifact.data[start:end + 1], status_code=206,
+                            media_type=artifact.media_type, headers=headers)
+    return Response(content=artifact.data, media_type=artifact.media_type, headers=headers)
+
 @app.post("/diyvoice/delete-audio/")
 async def delete_audio(request: Request):
+    # 回复音频由内存存储按过期时间和容量自动清理，这里只作为可以提前淘汰的提示
     data = await request.json()
-    file_path = data.get("file_path")
-    
-    # 安全检查：确保只删除llmanswer目录下的文件
-    if not file_path or not file_path.startswith("diyvoice/llmanswer/"):
-        return {"status": "error", "message": "Invalid file path"}
-    
+    audio_id = data.get("audio_id") or (data.get("file_path") or "").rsplit("/", 1)[-1]
+    artifact_store.release(audio_id)
+    return {"status": "success"}
+
+
+# WebSocket 全双工语音对话参数
+WS_SILENCE_MS = int(os.getenv("WS_SILENCE_MS", "1000"))  # 服务端端点检测的静音时长
+WS_MAX_UTTERANCE_SECONDS = float(os.getenv("WS_MAX_UTTERANCE_SECONDS", "20"))  # 单段语音最长时长
+WS_PARTIAL_INTERVAL_MS = int(os.getenv("WS_PARTIAL_INTERVAL_MS", "500"))  # 增量识别间隔
+WS_TRIM_MARGIN = 0.2  # 识别时保留的尾部静音（秒）
+REPLY_SAMPLE_RATE = 24000
+REPLY_CHUNK_BYTES = 9600  # 缓存命中时按0.2秒一块发送
+
+
+class VoiceSocketSession:
+    """一个 WebSocket 连接上的语音对话
+
+    客户端先发送 {"type": "start", "format": "pcm"|"webm", "sample_rate": 16000}，之后发送二进制音频帧：
+    - pcm：小端16位单声道PCM，服务端做端点检测和增量识别
+    - webm：MediaRecorder 的容器片段，由客户端发送 {"type": "stop"} 表示一段语音结束
+    采样率不是 16kHz 时服务端逐帧连续重采样；采样率不合法时回复 error，不发送 ready。
+    客户端可随时发送 {"type": "cancel"} 打断当前回复。
+
+    服务端发送 JSON 事件 speech_start / partial / final / reply_start / transcript /
+    reply_end / reply_cancelled / error，回复音频以二进制帧（24kHz 16位PCM）随生成随发送。
+    所有发送都经过 outbox 队列由单独的任务完成，识别线程中的回调也可以安全地发消息。
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.loop = asyncio.get_running_loop()
+        self.outbox = asyncio.Queue()
+        self.format = "pcm"
+        self.sample_rate = ASR_SAMPLE_RATE
+        self.resampler = None
+        self.endpointer = Endpointer(
+            create_vad("adaptive", rate=ASR_SAMPLE_RATE),
+            silence_duration=WS_SILENCE_MS / 1000,
+            max_duration=WS_MAX_UTTERANCE_SECONDS,
+        )
+        self.transcriber = None
+        self.utterance_samples = 0
+        self.container = bytearray()
+        self.turn_task = None
+        self.turns = 0
+
+    def send(self, message):
+        self.outbox.put_nowait(message)
+
+    def send_threadsafe(self, message):
+        self.loop.call_soon_threadsafe(self.outbox.put_nowait, message)
+
+    async def run_sender(self):
+        while True:
+            message = await self.outbox.get()
+            if isinstance(message, (bytes, bytearray)):
+                await self.websocket.send_bytes(bytes(message))
+            else:
+                await self.websocket.send_json(message)
+
+    async def on_control(self, message):
+        kind = message.get("type")
+        if kind == "start":
+            try:
+                sample_rate = int(message.get("sample_rate", ASR_SAMPLE_RATE))
+            except (TypeError, ValueError):
+                sample_rate = 0
+            if sample_rate <= 0:
+                self.send({"type": "error", "message": f"采样率不合法: {message.get('sample_rate')}"})
+                return
+            self.format = message.get("format", "pcm")
+            self.sample_rate = sample_rate
+            self.resampler = StreamResampler(sample_rate, ASR_SAMPLE_RATE) if sample_rate != ASR_SAMPLE_RATE else None
+            self.endpointer.reset()
+            self.send({"type": "ready"})
+        elif kind == "stop":
+            if self.format == "webm" and self.container:
+                data = bytes(self.container)
+                self.container.clear()
+                self.start_turn(self.transcribe_container(data))
+            elif self.transcriber:
+                self.endpointer.reset()
+                self.end_utterance(0)
+        elif kind == "cancel":
+            self.cancel_turn()
+
+    async def on_audio(self, data):
+        if self.format == "webm":
+            self.container.extend(data)
+            return
+        samples = np.frombuffer(data, dtype="<i2", count=len(data) // 2)
+        if self.resampler is not None:
+            samples = self.resampler.process(samples)
+        for kind, value in self.endpointer.feed(samples):
+            if kind == "start":
+                self.begin_utterance(value)
+            elif kind == "audio":
+                self.feed_utterance(value)
+            else:
+                self.end_utterance(value["trailing_silence"])
+
+    def begin_utterance(self, samples):
+        # 用户开口即打断正在进行的回复
+        self.cancel_turn()
+        VAD_TRIGGERS.labels("web").inc()
+        self.send({"type": "speech_start"})
+        self.transcriber = IncrementalTranscriber(
+            lambda audio, prompt: asr_pool.submit(
+                audio, return_segments=True, initial_prompt=prompt, policy=PARTIAL_POLICY).result(),
+            final_transcribe_fn=lambda audio, prompt: asr_pool.submit(
+                audio, return_segments=True, initial_prompt=prompt).result(),
+            rate=ASR_SAMPLE_RATE,
+            interval=WS_PARTIAL_INTERVAL_MS / 1000,
+            on_partial=lambda committed, tentative: self.send_threadsafe(
+                {"type": "partial", "committed": committed, "tentative": tentative}),
+        ).start()
+        self.utterance_samples = 0
+        self.feed_utterance(samples)
+
+    def feed_utterance(self, samples):
+        if self.transcriber:
+            self.transcriber.feed(samples)
+            self.utterance_samples += len(samples)
+
+    def end_utterance(self, trailing_silence):
+        transcriber = self.transcriber
+        self.transcriber = None
+        if transcriber is None:
+            return
+        end = self.utterance_samples - max(trailing_silence - int(WS_TRIM_MARGIN * ASR_SAMPLE_RATE), 0)
+        RECORDING_SECONDS.labels("web").observe(end / ASR_SAMPLE_RATE)
+        self.start_turn(asyncio.to_thread(transcriber.finalize, end))
+
+    async def transcribe_container(self, data):
+        return await asr_pool.transcribe(io.BytesIO(data))
+
+    def start_turn(self, transcription):
+        self.cancel_turn()
+        self.turn_task = asyncio.create_task(self.run_turn(transcription))
+
+    def cancel_turn(self):
+        if self.turn_task and not self.turn_task.done():
+            self.turn_task.cancel()
+        self.turn_task = None
+
+    async def run_turn(self, transcription):
+        try:
+            try:
+                text = await transcription
+            except QueueFullError:
+                self.send({"type": "error", "message": "识别服务繁忙，请稍后重试"})
+                return
+            print("识别结果：", text)
+            self.send({"type": "final", "text": text})
+            if not text.strip():
+                return
+            await asyncio.wait_for(self.stream_reply(text), timeout=LLM_REQUEST_TIMEOUT)
+            self.turns += 1
+            CONVERSATION_TURNS.labels("web").inc()
+        except asyncio.CancelledError:
+            self.send({"type": "reply_cancelled"})
+            raise
+        except Exception as e:
+            print(f"WebSocket 对话出错: {str(e)}")
+            LLM_ERRORS.labels("web").inc()
+            self.send({"type": "error", "message": str(e)})
+
+    async def stream_reply(self, text):
+        """把回复音频边生成边发送给客户端"""
+        self.send({"type": "reply_start", "sample_rate": REPLY_SAMPLE_RATE, "format": "pcm16"})
+        key = cache_key(text) if tts_cache else None
+        cached = tts_cache.get(key) if key else None
+        if cached is not None:
+            for start in range(0, len(cached), REPLY_CHUNK_BYTES):
+                self.send(cached[start:start + REPLY_CHUNK_BYTES])
+        else:
+            decoder = OmniDecoder(keep_audio=key is not None, timeout=LLM_REQUEST_TIMEOUT)
+            async with aclosing(iter_omni_events(text, decoder)) as events:
+                async for kind, value in events:
+                    if kind == "audio":
+                        self.send(value)
+                    elif kind == "transcript":
+                        self.send({"type": "transcript", "text": value})
+            if key and decoder.audio_bytes:
+                tts_cache.put(key, decoder.audio())
+        self.send({"type": "reply_end"})
+
+    def close(self):
+        self.cancel_turn()
+        if self.transcriber:
+            self.transcriber.cancel()
+            self.transcriber = None
+
+
+@app.websocket("/diyvoice/ws")
+async def voice_socket(websocket: WebSocket):
+    await websocket.accept()
+    session = VoiceSocketSession(websocket)
+    sender = asyncio.create_task(session.run_sender())
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            print(f"Deleted audio file: {file_path}")
-            return {"status": "success"}
-        return {"status": "error", "message": "File not found"}
-    except Exception as e:
-        print(f"Delete audio error: {str(e)}")
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                await session.on_audio(message["bytes"])
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except json.JSONDecodeError:
+                    control = None
+                if not isinstance(control, dict) or "type" not in control:
+                    # 与 HTTP 接口对非法输入返回 400 一致：回复 error，会话继续
+                    session.send({"type": "error", "message": "无法解析控制消息"})
+                    continue
+                await session.on_control(control)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        session.close()
+        sender.cancel()
+        print(f"WebSocket 会话结束，共 {session.turns} 轮对话")
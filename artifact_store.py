@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+进程内音频制品存储
+TTS生成的回复音频保存在内存中按ID提供下载，按过期时间和总字节数淘汰，
+不再写入 diyvoice/llmanswer 目录，也不需要浏览器回调删除
+"""
+
+import re
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+
+class Artifact:
+    """一个音频制品"""
+
+    def __init__(self, data, media_type, ttl):
+        self.data = data
+        self.media_type = media_type
+        self.created = time.time()
+        self.expires = self.created + ttl
+        self.released = False
+
+
+class ArtifactStore:
+    """按 TTL 和字节数限制的制品存储
+
+    - 超过 max_bytes 时先淘汰已释放的制品，再按创建顺序淘汰最旧的
+    - release() 表示客户端已不再需要，过期时间缩短为 released_ttl（留出断点续传的时间）
+    - reap() 清理过期制品，由后台任务定期调用
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300.0, released_ttl=30.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.released_ttl = released_ttl
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.counters = {"stored": 0, "served": 0, "expired": 0, "evicted": 0, "released": 0}
+
+    def put(self, data, media_type="audio/wav"):
+        """保存制品，返回ID"""
+        artifact_id = uuid.uuid4().hex
+        with self._lock:
+            self._items[artifact_id] = Artifact(data, media_type, self.ttl)
+            self._size += len(data)
+            self.counters["stored"] += 1
+            self._evict()
+        return artifact_id
+
+    def get(self, artifact_id):
+        """按ID获取制品，不存在或已过期返回 None"""
+        with self._lock:
+            artifact = self._items.get(artifact_id)
+            if artifact is None:
+                return None
+            if artifact.expires < time.time():
+                self._remove(artifact_id)
+                self.counters["expired"] += 1
+                return None
+            self.counters["served"] += 1
+            return artifact
+
+    def release(self, artifact_id):
+        """标记制品可以淘汰"""
+        with self._lock:
+            artifact = self._items.get(artifact_id)
+            if artifact is None or artifact.released:
+                return False
+            artifact.released = True
+            artifact.expires = min(artifact.expires, time.time() + self.released_ttl)
+            self.counters["released"] += 1
+            return True
+
+    def reap(self):
+        """清理过期制品，返回清理数量"""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, artifact in self._items.items() if artifact.expires < now]
+            for key in expired:
+                self._remove(key)
+            self.counters["expired"] += len(expired)
+            return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "items": len(self._items), "bytes": self._size}
+
+    def _remove(self, artifact_id):
+        artifact = self._items.pop(artifact_id)
+        self._size -= len(artifact.data)
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._items) > 1:
+            victim = next((key for key, artifact in self._items.items() if artifact.released),
+                          next(iter(self._items)))
+            self._remove(victim)
+            self.counters["evicted"] += 1
+
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, total):
+    """解析单段 Range 请求头，返回 (起点, 终点含)；格式不支持返回 None，越界抛出 ValueError"""
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        length = int(end)
+        if length == 0:
+            raise ValueError("空的后缀范围")
+        return max(total - length, 0), total - 1
+    start = int(start)
+    end = int(end) if end else total - 1
+    if start >= total or end < start:
+        raise ValueError("范围越界")
+    return start, min(end, total - 1)
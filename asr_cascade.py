@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+两级识别
+先用小模型快速解码，只有置信度低的语音才交给大模型重新解码；
+明显不是语音的片段直接丢弃，不触发升级
+
+    ASR_CASCADE                 1 表示启用
+    ASR_FAST_MODEL_SIZE         第一级模型规格，默认 base
+    ASR_FAST_BEAM_SIZE          第一级 beam 大小，默认1
+    ASR_ESCALATE_LOGPROB        片段平均对数概率低于该值时升级，默认 -0.6
+    ASR_ESCALATE_COMPRESSION    片段压缩比高于该值（疑似重复幻觉）时升级，默认 2.4
+    ASR_ESCALATE_NO_SPEECH      片段无语音概率高于该值（不确定是否为语音）时升级，默认 0.4
+    ASR_DROP_NO_SPEECH          无语音概率高于该值且平均对数概率低于升级阈值的片段直接丢弃，默认 0.8
+"""
+
+import os
+import time
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger("ASRCascade")
+
+ASR_CASCADE = os.getenv("ASR_CASCADE", "0") == "1"
+ASR_FAST_MODEL_SIZE = os.getenv("ASR_FAST_MODEL_SIZE", "base")
+ASR_FAST_BEAM_SIZE = int(os.getenv("ASR_FAST_BEAM_SIZE", "1"))
+ASR_ESCALATE_LOGPROB = float(os.getenv("ASR_ESCALATE_LOGPROB", "-0.6"))
+ASR_ESCALATE_COMPRESSION = float(os.getenv("ASR_ESCALATE_COMPRESSION", "2.4"))
+ASR_ESCALATE_NO_SPEECH = float(os.getenv("ASR_ESCALATE_NO_SPEECH", "0.4"))
+ASR_DROP_NO_SPEECH = float(os.getenv("ASR_DROP_NO_SPEECH", "0.8"))
+
+
+class CascadeStats:
+    """升级率和各级耗时统计，同一进程内的所有级联模型共用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.utterances = 0
+            self.escalations = 0
+            self.dropped_segments = 0
+            self.fast_seconds = 0.0
+            self.accurate_seconds = 0.0
+            self.audio_seconds = 0.0
+
+    def record(self, audio_seconds, fast_seconds, accurate_seconds=None, dropped=0):
+        with self._lock:
+            self.utterances += 1
+            self.dropped_segments += dropped
+            self.audio_seconds += audio_seconds
+            self.fast_seconds += fast_seconds
+            if accurate_seconds is not None:
+                self.escalations += 1
+                self.accurate_seconds += accurate_seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "utterances": self.utterances,
+                "escalations": self.escalations,
+                "escalation_rate": self.escalations / self.utterances if self.utterances else 0.0,
+                "dropped_segments": self.dropped_segments,
+                "avg_fast_seconds": self.fast_seconds / self.utterances if self.utterances else 0.0,
+                "avg_accurate_seconds": self.accurate_seconds / self.escalations if self.escalations else 0.0,
+                "real_time_factor": (self.fast_seconds + self.accurate_seconds) / self.audio_seconds
+                if self.audio_seconds else 0.0,
+            }
+
+
+cascade_stats = CascadeStats()
+
+
+class CascadeModel:
+    """两级识别模型，接口与 WhisperModel.transcribe 相同
+
+    第一级解码后逐片段检查：
+    - no_speech_prob >= drop_no_speech 且 avg_logprob < escalate_logprob：视为非语音，丢弃
+    - 剩余片段中任一 avg_logprob < escalate_logprob、compression_ratio > escalate_compression
+      或 no_speech_prob > escalate_no_speech：整段音频用第二级模型重新解码
+    第一级全部片段都被丢弃时直接返回空结果。
+    调用方未指定 beam_size 时第一级使用 fast_beam_size，指定时（例如解码策略的重新解码）保持不变。
+    """
+
+    def __init__(self, fast_model, accurate_model, fast_beam_size=ASR_FAST_BEAM_SIZE,
+                 escalate_logprob=ASR_ESCALATE_LOGPROB, escalate_compression=ASR_ESCALATE_COMPRESSION,
+                 escalate_no_speech=ASR_ESCALATE_NO_SPEECH, drop_no_speech=ASR_DROP_NO_SPEECH,
+                 stats=cascade_stats, rate=16000):
+        self.fast_model = fast_model
+        self.accurate_model = accurate_model
+        self.fast_beam_size = fast_beam_size
+        self.escalate_logprob = escalate_logprob
+        self.escalate_compression = escalate_compression
+        self.escalate_no_speech = escalate_no_speech
+        self.drop_no_speech = drop_no_speech
+        self.stats = stats
+        self.rate = rate
+
+    def is_non_speech(self, segment):
+        return segment.no_speech_prob >= self.drop_no_speech and segment.avg_logprob < self.escalate_logprob
+
+    def needs_escalation(self, segment):
+        return (segment.avg_logprob < self.escalate_logprob
+                or segment.compression_ratio > self.escalate_compression
+                or segment.no_speech_prob > self.escalate_no_speech)
+
+    def transcribe(self, audio, **options):
+        started = time.monotonic()
+        fast_options = {"beam_size": self.fast_beam_size, **options}
+        segments, info = self.fast_model.transcribe(audio, **fast_options)
+        segments = list(segments)
+        fast_seconds = time.monotonic() - started
+        # 文件路径等非数组输入按解码信息中的时长统计
+        audio_seconds = len(audio) / self.rate if isinstance(audio, np.ndarray) else getattr(info, "duration", 0.0)
+
+        kept = [segment for segment in segments if not self.is_non_speech(segment)]
+        dropped = len(segments) - len(kept)
+        if not any(self.needs_escalation(segment) for segment in kept):
+            self.stats.record(audio_seconds, fast_seconds, dropped=dropped)
+            return iter(kept), info
+
+        started = time.monotonic()
+        segments, info = self.accurate_model.transcribe(audio, **options)
+        segments = list(segments)
+        kept = [segment for segment in segments if not self.is_non_speech(segment)]
+        # 第一级的结果已被整体丢弃，只统计第二级过滤掉的片段
+        dropped = len(segments) - len(kept)
+        accurate_seconds = time.monotonic() - started
+        logger.debug(f"低置信度，已升级到第二级模型（{fast_seconds:.2f}s + {accurate_seconds:.2f}s）")
+        self.stats.record(audio_seconds, fast_seconds, accurate_seconds, dropped)
+        return iter(kept), info
+
+
+def create_cascade(create_model):
+    """用 create_model(**覆盖配置) 创建两级模型：第一级为 ASR_FAST_MODEL_SIZE，第二级为默认配置"""
+    return CascadeModel(create_model(model_size=ASR_FAST_MODEL_SIZE), create_model())
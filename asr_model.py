@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Whisper 模型加载
+模型规格通过环境变量配置，支持立即/后台/延迟加载、就绪标志和合成音频预热；
+设置 ASR_SERVER_SOCKET 后改为连接独立的识别模型服务（asr_server.py），多个服务共用一份模型。
+存在 autotune.py 生成的配置文件时，未设置的 WHISPER_* 取配置文件中的值（配置文件在其他硬件上生成时忽略）
+
+    WHISPER_MODEL_SIZE    模型规格，默认 medium
+    WHISPER_DEVICE        cpu 或 cuda，默认 cpu
+    WHISPER_COMPUTE_TYPE  计算精度，默认 int8
+    WHISPER_CPU_THREADS   每个模型的推理线程数，默认0（自动）
+    WHISPER_NUM_WORKERS   每个模型可并发解码的数量，默认1
+    ASR_LOAD_MODE         eager（启动时加载并等待）、background（后台加载）或 lazy（首次识别时加载）
+    ASR_WARMUP            1 表示加载后先解码一段合成音频
+    ASR_SERVER_SOCKET     识别模型服务的 Unix 套接字路径
+    ASR_CASCADE           1 表示使用两级识别（配置见 asr_cascade.py）
+    ASR_PROFILE           自动调优配置文件，默认为本目录下的 asr_profile.json
+"""
+
+import os
+import json
+import time
+import platform
+import socket
+import struct
+import logging
+import threading
+from collections import namedtuple
+import numpy as np
+from faster_whisper import WhisperModel
+from faster_whisper.audio import decode_audio
+from asr_cascade import ASR_CASCADE, create_cascade
+
+logger = logging.getLogger("ASRModel")
+
+SAMPLE_RATE = 16000
+
+ASR_PROFILE = os.getenv("ASR_PROFILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "asr_profile.json"))
+
+
+def hardware_fingerprint():
+    """用于判断调优配置是否在本机生成"""
+    return {"machine": platform.machine(), "cpu_count": os.cpu_count() or 1}
+
+
+def load_profile(path=ASR_PROFILE):
+    """读取 autotune.py 生成的模型配置，文件不存在、无法解析或来自其他硬件时返回空字典"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"无法读取调优配置 {path}: {str(e)}")
+        return {}
+    if profile.get("hardware") != hardware_fingerprint():
+        logger.warning(f"调优配置 {path} 在其他硬件上生成（{profile.get('hardware')}），已忽略，请重新运行 autotune.py")
+        return {}
+    logger.info(f"使用调优配置 {path}: {profile.get('config')}")
+    return profile.get("config", {})
+
+
+_PROFILE = load_profile()
+
+
+def _setting(name, key, default):
+    """环境变量优先，其次是调优配置，最后是默认值"""
+    return os.getenv(name) or str(_PROFILE.get(key, default))
+
+
+WHISPER_MODEL_SIZE = _setting("WHISPER_MODEL_SIZE", "model_size", "medium")
+WHISPER_DEVICE = _setting("WHISPER_DEVICE", "device", "cpu")
+WHISPER_COMPUTE_TYPE = _setting("WHISPER_COMPUTE_TYPE", "compute_type", "int8")
+WHISPER_CPU_THREADS = int(_setting("WHISPER_CPU_THREADS", "cpu_threads", "0"))
+WHISPER_NUM_WORKERS = int(_setting("WHISPER_NUM_WORKERS", "num_workers", "1"))
+ASR_LOAD_MODE = os.getenv("ASR_LOAD_MODE", "background")
+ASR_WARMUP = os.getenv("ASR_WARMUP", "1") == "1"
+ASR_SERVER_SOCKET = os.getenv("ASR_SERVER_SOCKET", "")
+
+LOAD_MODES = ("eager", "background", "lazy")
+
+
+def model_config():
+    """当前的模型配置"""
+    return {
+        "model_size": WHISPER_MODEL_SIZE,
+        "device": WHISPER_DEVICE,
+        "compute_type": WHISPER_COMPUTE_TYPE,
+        "cpu_threads": WHISPER_CPU_THREADS,
+        "num_workers": WHISPER_NUM_WORKERS,
+    }
+
+
+def create_model(socket_path=None, **overrides):
+    """按配置创建模型；配置了识别模型服务时返回 RemoteModel"""
+    socket_path = ASR_SERVER_SOCKET if socket_path is None else socket_path
+    if socket_path:
+        logger.info(f"使用识别模型服务: {socket_path}")
+        return RemoteModel(socket_path)
+    config = {**model_config(), **overrides}
+    started = time.monotonic()
+    model = WhisperModel(
+        config["model_size"],
+        device=config["device"],
+        compute_type=config["compute_type"],
+        cpu_threads=config["cpu_threads"],
+        num_workers=config["num_workers"],
+    )
+    logger.info(f"Whisper 模型 {config['model_size']}({config['compute_type']}) 加载完成，"
+                f"耗时 {time.monotonic() - started:.1f}秒")
+    return model
+
+
+def warmup(model, seconds=1.0):
+    """用一段合成的低噪声解码一次，让首个真实请求不再承担初始化开销"""
+    audio = (np.random.default_rng(0).standard_normal(int(SAMPLE_RATE * seconds)) * 0.01).astype(np.float32)
+    started = time.monotonic()
+    segments, info = model.transcribe(audio, language="zh", beam_size=1)
+    list(segments)
+    logger.info(f"模型预热完成，耗时 {time.monotonic() - started:.2f}秒")
+
+
+def load_model(socket_path=None):
+    """创建模型并按配置预热（模块级函数，可用于进程池）
+
+    ASR_CASCADE=1 时创建两级识别模型（见 asr_cascade.py）
+    """
+    socket_path = ASR_SERVER_SOCKET if socket_path is None else socket_path
+    if socket_path:
+        return create_model(socket_path)
+    if ASR_CASCADE:
+        model = create_cascade(lambda **overrides: create_model("", **overrides))
+        tiers = [model.fast_model, model.accurate_model]
+    else:
+        model = create_model("")
+        tiers = [model]
+    if ASR_WARMUP:
+        for tier in tiers:
+            warmup(tier)
+    return model
+
+
+class ModelHandle:
+    """按加载模式持有一个模型
+
+    - eager：load() 在当前线程加载完成后返回
+    - background：load() 启动后台线程加载，立即返回
+    - lazy：首次 transcribe() 时加载
+    transcribe() 在模型就绪前阻塞等待，接口与 WhisperModel.transcribe 相同。
+    """
+
+    def __init__(self, factory=load_model, mode=ASR_LOAD_MODE):
+        if mode not in LOAD_MODES:
+            raise ValueError(f"未知的模型加载模式: {mode}，可选: {', '.join(LOAD_MODES)}")
+        self.factory = factory
+        self.mode = mode
+        self.error = None
+        self._model = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def load(self):
+        """按加载模式开始加载"""
+        if self.mode == "eager":
+            self._load()
+        elif self.mode == "background":
+            threading.Thread(target=self._load, name="ModelLoader", daemon=True).start()
+
+    def _load(self):
+        with self._lock:
+            if self._model is not None:
+                return self._model
+            try:
+                self._model = self.factory()
+            except Exception as e:
+                logger.error(f"模型加载出错: {str(e)}")
+                self.error = e
+                raise
+            finally:
+                self._ready.set()
+            return self._model
+
+    def get(self, timeout=None):
+        """返回已加载的模型，必要时等待加载完成"""
+        if self._model is None:
+            if self.mode == "lazy":
+                return self._load()
+            if not self._ready.wait(timeout):
+                raise TimeoutError("模型尚未加载完成")
+            if self.error:
+                raise RuntimeError(f"模型加载失败: {self.error}")
+        return self._model
+
+    def transcribe(self, audio, **options):
+        return self.get().transcribe(audio, **options)
+
+
+# 识别模型服务的通信格式：4字节大端长度 + JSON 头，请求头之后紧跟 float32 音频
+RemoteSegment = namedtuple(
+    "RemoteSegment", ["start", "end", "text", "avg_logprob", "no_speech_prob", "compression_ratio"]
+)
+RemoteInfo = namedtuple("RemoteInfo", ["language", "language_probability", "duration"])
+
+_HEADER = struct.Struct(">I")
+
+
+def send_message(sock, header, payload=b""):
+    data = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data + payload)
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(min(size - len(buffer), 1 << 20))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+
+def recv_message(sock):
+    """读取一个 JSON 头，返回字典"""
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, size).decode("utf-8"))
+
+
+def recv_audio(sock, samples):
+    return np.frombuffer(_recv_exact(sock, samples * 4), dtype=np.float32)
+
+
+class RemoteModel:
+    """通过 Unix 套接字调用识别模型服务，接口与 WhisperModel.transcribe 相同"""
+
+    def __init__(self, socket_path, timeout=120.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _request(self, header, payload=b""):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            send_message(sock, header, payload)
+            response = recv_message(sock)
+        if "error" in response:
+            raise RuntimeError(f"识别模型服务出错: {response['error']}")
+        return response
+
+    def ping(self):
+        """服务状态，包括模型是否就绪"""
+        return self._request({"op": "ping"})
+
+    def transcribe(self, audio, **options):
+        if not isinstance(audio, np.ndarray):
+            audio = decode_audio(audio, sampling_rate=SAMPLE_RATE)
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        response = self._request(
+            {"op": "transcribe", "samples": len(audio), "options": options}, audio.tobytes()
+        )
+        segments = [RemoteSegment(**segment) for segment in response["segments"]]
+        return iter(segments), RemoteInfo(**response["info"])
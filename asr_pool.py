@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+识别任务池
+在独立线程（或进程）中运行多个 Whisper 模型副本，通过有界队列接收任务，
+可选把并发的短音频合并为一次 faster-whisper 批量推理
+"""
+
+import os
+import time
+import queue
+import asyncio
+import bisect
+import inspect
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+import numpy as np
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from faster_whisper.audio import decode_audio
+from metrics import observe_asr
+
+logger = logging.getLogger("ASRPool")
+
+SAMPLE_RATE = 16000
+
+
+class QueueFullError(Exception):
+    """识别任务队列已满"""
+
+
+class _Job:
+    """一个识别任务"""
+
+    def __init__(self, audio, options, return_segments=False):
+        self.audio = audio
+        self.options = options
+        self.return_segments = return_segments
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+def _decode(audio):
+    """文件路径或文件对象解码为 16kHz float32 数组"""
+    if isinstance(audio, np.ndarray):
+        return audio
+    return decode_audio(audio, sampling_rate=SAMPLE_RATE)
+
+
+# 批量推理接受的参数，解码策略中的其他参数（如 condition_on_previous_text）在批量时忽略
+_BATCH_OPTIONS = set(inspect.signature(BatchedInferencePipeline.transcribe).parameters) - {"self", "audio"}
+
+
+def _transcribe_one(model, audio, options, return_segments=False):
+    """options 中的 policy 为解码策略（见 decoding_policy.py），其余参数按原样传入"""
+    policy = options.get("policy")
+    if policy is not None:
+        options = {key: value for key, value in options.items() if key != "policy"}
+        segments, info = policy.transcribe(model, audio, **options)
+    else:
+        segments, info = model.transcribe(audio, **options)
+    if return_segments:
+        return list(segments)
+    return "".join(segment.text for segment in segments)
+
+
+def _transcribe_batch(pipeline, audios, options):
+    """把多段短音频拼接后用一次批量推理解码，按时间范围拆回各自的文本
+
+    使用解码策略时按策略的首次解码参数批量解码，不做低置信度回退
+    """
+    policy = options.get("policy")
+    if policy is not None:
+        rest = {key: value for key, value in options.items() if key != "policy"}
+        options = {key: value for key, value in policy.options(**rest).items() if key in _BATCH_OPTIONS}
+    starts = []
+    clips = []
+    offset = 0
+    for audio in audios:
+        starts.append(offset / SAMPLE_RATE)
+        clips.append({"start": offset / SAMPLE_RATE, "end": (offset + len(audio)) / SAMPLE_RATE})
+        offset += len(audio)
+    segments, info = pipeline.transcribe(
+        np.concatenate(audios), clip_timestamps=clips, batch_size=len(audios), **options
+    )
+    texts = [""] * len(audios)
+    for segment in segments:
+        index = bisect.bisect_right(starts, (segment.start + segment.end) / 2) - 1
+        texts[max(index, 0)] += segment.text
+    return texts
+
+
+def _run(model, pipeline, audios, options, return_segments=False):
+    """解码一个批次，返回每段音频的文本（或片段列表）
+
+    pipeline 为空（模型不支持批量推理，例如两级识别或识别模型服务）时逐段解码
+    """
+    if len(audios) == 1 or pipeline is None:
+        return [_transcribe_one(model, audio, options, return_segments) for audio in audios]
+    return _transcribe_batch(pipeline, audios, options)
+
+
+def _create_pipeline(model):
+    return BatchedInferencePipeline(model) if isinstance(model, WhisperModel) else None
+
+
+# 进程模式下每个子进程持有的模型
+_process_model = None
+_process_pipeline = None
+_process_barrier = None
+
+
+def _init_process(model_factory, barrier=None):
+    global _process_model, _process_pipeline, _process_barrier
+    _process_model = model_factory()
+    _process_pipeline = _create_pipeline(_process_model)
+    _process_barrier = barrier
+
+
+def _process_run(audios, options, return_segments=False):
+    return _run(_process_model, _process_pipeline, audios, options, return_segments)
+
+
+def _process_warm(timeout):
+    """在子进程中确认模型已加载，返回进程号
+
+    所有副本的预热任务在屏障处等待，一个子进程同一时间只执行一个任务，
+    因此每个子进程恰好执行一个预热任务，全部返回时每个子进程都已加载完成
+    """
+    if _process_model is None:
+        raise RuntimeError("子进程模型未加载")
+    if _process_barrier is not None:
+        _process_barrier.wait(timeout)
+    return os.getpid()
+
+
+class ASRWorkerPool:
+    """识别任务池
+
+    - mode="thread"：每个副本一个线程，各自持有一份模型（CTranslate2 推理时释放GIL）
+    - mode="process"：每个副本一个子进程，model_factory 必须可被 pickle（模块级函数）
+    - 队列满时 submit() 抛出 QueueFullError，由调用方决定如何拒绝请求
+    - 模型在工作线程（或子进程）中加载，全部副本加载完成后 ready 为真；
+      进程模式下每个子进程都执行一次预热任务后才算加载完成（最多等待 load_timeout 秒）；
+      未调用 start() 时首次 submit() 会自动启动（延迟加载）
+    - batch_size > 1 时，工作线程取到一个短音频任务后会在 batch_window 秒内
+      继续收集参数相同的短音频任务，合并为一次批量推理
+    """
+
+    def __init__(self, model_factory, replicas=1, mode="thread", max_queue=32,
+                 batch_size=1, batch_window=0.05, max_batch_duration=15.0,
+                 transcribe_options=None, service="web", load_timeout=600.0):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"未知的识别池模式: {mode}")
+        self.model_factory = model_factory
+        self.replicas = replicas
+        self.mode = mode
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_batch_samples = int(max_batch_duration * SAMPLE_RATE)
+        self.transcribe_options = transcribe_options or {}
+        self.service = service  # 指标中的 service 标签
+        self.load_timeout = load_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._batches = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._service_total = 0.0
+        self._loaded = 0
+        self._processes = set()  # 进程模式下已确认加载完成的子进程
+        self._ready = threading.Event()
+
+    @property
+    def ready(self):
+        """所有模型副本是否已加载完成"""
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def start(self):
+        """启动工作线程，模型副本在各工作线程中加载"""
+        with self._lock:
+            if self._threads:
+                return
+            self._start()
+
+    def _start(self):
+        if self.mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.replicas,
+                initializer=_init_process,
+                initargs=(self.model_factory, multiprocessing.Barrier(self.replicas)),
+            )
+        for index in range(self.replicas):
+            thread = threading.Thread(target=self._worker, args=(index,), name=f"ASRWorker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"识别任务池已启动: {self.replicas} 个{self.mode}副本，批大小 {self.batch_size}")
+
+    def shutdown(self):
+        """停止工作线程"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout=5.0)
+        if self._executor:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def submit(self, audio, return_segments=False, **options):
+        """提交识别任务，返回 concurrent.futures.Future
+
+        结果为识别文本；return_segments 为真时为片段列表（不参与批量推理）
+        """
+        if not self._threads:
+            self.start()
+        job = _Job(audio, {**self.transcribe_options, **options}, return_segments)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError(f"识别队列已满({self._queue.maxsize})")
+        return job.future
+
+    async def transcribe(self, audio, return_segments=False, **options):
+        """在事件循环中等待识别结果，不阻塞事件循环"""
+        return await asyncio.wrap_future(self.submit(audio, return_segments, **options))
+
+    def stats(self):
+        """队列深度、等待时间和处理时间统计"""
+        with self._lock:
+            started = self._completed + self._failed + self._in_flight
+            finished = self._completed + self._failed
+            return {
+                "mode": self.mode,
+                "replicas": self.replicas,
+                "ready": self.ready,
+                "loaded_replicas": self._loaded,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "failed": self._failed,
+                "batches": self._batches,
+                "avg_batch_size": finished / self._batches if self._batches else 0.0,
+                "avg_wait_seconds": self._wait_total / started if started else 0.0,
+                "max_wait_seconds": self._wait_max,
+                "avg_service_seconds": self._service_total / self._batches if self._batches else 0.0,
+            }
+
+    def _prepare(self, job):
+        """在工作线程中把上传文件解码为数组，失败时直接结束该任务"""
+        if isinstance(job.audio, np.ndarray):
+            return True
+        try:
+            job.audio = _decode(job.audio)
+            return True
+        except Exception as e:
+            logger.error(f"音频解码出错: {str(e)}")
+            job.future.set_exception(e)
+            with self._lock:
+                self._failed += 1
+            return False
+
+    def _batchable(self, job):
+        return (self.batch_size > 1 and not job.return_segments and isinstance(job.audio, np.ndarray)
+                and len(job.audio) <= self.max_batch_samples)
+
+    def _collect(self, first):
+        """从队列中收集可与 first 合并的任务，返回 (批次, 未合并的任务)"""
+        batch = [first]
+        leftover = []
+        if not self._batchable(first):
+            return batch, leftover
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                leftover.append(job)
+                break
+            if not self._prepare(job):
+                continue
+            if self._batchable(job) and job.options == first.options:
+                batch.append(job)
+            else:
+                leftover.append(job)
+        return batch, leftover
+
+    def _worker(self, index):
+        model = pipeline = None
+        try:
+            if self.mode == "thread":
+                model = self.model_factory()
+                if self.batch_size > 1:
+                    pipeline = _create_pipeline(model)
+            else:
+                # 每个工作线程提交一个预热任务，各任务在屏障处互相等待，保证落到不同的子进程上
+                pid = self._executor.submit(_process_warm, self.load_timeout).result()
+                with self._lock:
+                    self._processes.add(pid)
+            with self._lock:
+                self._loaded += 1
+                if self._loaded >= self.replicas and (self.mode == "thread" or len(self._processes) >= self.replicas):
+                    self._ready.set()
+        except Exception as e:
+            # 加载失败的副本仍然从队列取任务，使任务以异常结束而不是一直等待
+            logger.error(f"识别副本 {index} 加载模型出错: {str(e)}")
+        pending = []
+        while True:
+            job = pending.pop(0) if pending else self._queue.get()
+            if job is None:
+                break
+            if not self._prepare(job):
+                continue
+            batch, leftover = self._collect(job)
+            pending.extend(leftover)
+            self._process(model, pipeline, batch)
+        for job in pending:
+            if job is not None:
+                job.future.set_exception(RuntimeError("识别任务池已停止"))
+
+    def _process(self, model, pipeline, batch):
+        started = time.monotonic()
+        with self._lock:
+            self._in_flight += len(batch)
+            self._batches += 1
+            for job in batch:
+                wait = started - job.submitted
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+        audios = [job.audio for job in batch]
+        options = batch[0].options
+        return_segments = batch[0].return_segments
+        try:
+            if self._executor:
+                texts = self._executor.submit(_process_run, audios, options, return_segments).result()
+            else:
+                texts = _run(model, pipeline, audios, options, return_segments)
+            elapsed = time.monotonic() - started
+            policy = options.get("policy")
+            for job, text in zip(batch, texts):
+                observe_asr(self.service, policy.name if policy else "default", elapsed, len(job.audio) / SAMPLE_RATE)
+                job.future.set_result(text)
+            failed = 0
+        except Exception as e:
+            logger.error(f"识别任务出错: {str(e)}")
+            for job in batch:
+                job.future.set_exception(e)
+            failed = len(batch)
+        with self._lock:
+            self._in_flight -= len(batch)
+            self._completed += len(batch) - failed
+            self._failed += failed
+            self._service_total += time.monotonic() - started
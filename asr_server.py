@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+独立的识别模型服务
+加载一份 Whisper 模型（或按 ASR_REPLICAS 加载多个副本），通过本地 Unix 套接字提供识别，
+app.py 和 shell_service.py 设置相同的 ASR_SERVER_SOCKET 后共用这一份模型
+
+启动:
+    python asr_server.py --socket /tmp/diyvoice-asr.sock
+"""
+
+import os
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+from asr_pool import ASRWorkerPool, QueueFullError
+from asr_model import SAMPLE_RATE, load_model, model_config, send_message, recv_message, recv_audio
+from asr_cascade import ASR_CASCADE, cascade_stats
+
+logger = logging.getLogger("ASRServer")
+
+DEFAULT_SOCKET = os.getenv("ASR_SERVER_SOCKET", "") or "/tmp/diyvoice-asr.sock"
+
+
+def load_local_model():
+    """服务端始终加载本地模型（模块级函数，可用于进程池）"""
+    return load_model(socket_path="")
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        pool = self.server.pool
+        try:
+            request = recv_message(self.request)
+            if request.get("op") == "ping":
+                stats = pool.stats()
+                if ASR_CASCADE:
+                    stats["cascade"] = cascade_stats.snapshot()
+                send_message(self.request, {"ready": pool.ready, "config": model_config(), "stats": stats})
+                return
+            audio = recv_audio(self.request, int(request["samples"]))
+            options = request.get("options") or {}
+            segments = pool.submit(audio, return_segments=True, **options).result()
+            send_message(self.request, {
+                "segments": [{
+                    "start": segment.start,
+                    "end": segment.end,
+                    "text": segment.text,
+                    "avg_logprob": segment.avg_logprob,
+                    "no_speech_prob": segment.no_speech_prob,
+                    "compression_ratio": segment.compression_ratio,
+                } for segment in segments],
+                "info": {
+                    "language": options.get("language"),
+                    "language_probability": 1.0,
+                    "duration": len(audio) / SAMPLE_RATE,
+                },
+            })
+        except (ConnectionError, socket.timeout):
+            pass
+        except QueueFullError as e:
+            send_message(self.request, {"error": str(e)})
+        except Exception as e:
+            logger.error(f"处理识别请求出错: {str(e)}")
+            try:
+                send_message(self.request, {"error": str(e)})
+            except OSError:
+                pass
+
+
+class ASRServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, pool):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.pool = pool
+        super().__init__(socket_path, _Handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="识别模型服务")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--replicas", type=int, default=int(os.getenv("ASR_REPLICAS", "1")))
+    parser.add_argument("--mode", default=os.getenv("ASR_POOL_MODE", "thread"))
+    parser.add_argument("--queue-size", type=int, default=int(os.getenv("ASR_QUEUE_SIZE", "32")))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    pool = ASRWorkerPool(load_local_model, replicas=args.replicas, mode=args.mode, max_queue=args.queue_size,
+                         service="asr_server")
+    pool.start()
+    server = ASRServer(args.socket, pool)
+    os.chmod(args.socket, 0o660)
+    threading.Thread(target=lambda: pool.wait_ready() and logger.info("模型已就绪"), daemon=True).start()
+    logger.info(f"识别模型服务监听 {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("接收到退出信号")
+    finally:
+        server.server_close()
+        pool.shutdown()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,713 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+音频输入源和输出端
+本地服务的录音器和播放器通过这里读写音频，除了 PyAudio 设备，
+还可以从 WAV 文件、WAV 目录、标准输入（原始PCM）或 Unix 套接字读入，
+输出到 WAV 文件、原始PCM、Unix 套接字或只计时的空输出端，
+用于无声卡的服务器、压测和按现场录音复现问题
+
+按字符串创建:
+    pyaudio              麦克风 / 扬声器
+    pyaudio:callback     麦克风，回调模式（PortAudio 回调写入无锁环形缓冲区，适合常驻的低功耗设备）
+    wav:<文件>           WAV 文件
+    dir:<目录>           目录中的所有 WAV 文件（按文件名排序，文件之间插入静音）
+    stdin / stdout       16位单声道原始PCM
+    raw:<文件>           16位单声道原始PCM文件
+    unix:<套接字>        输入端监听该 Unix 套接字，输出端连接该套接字
+    null                 丢弃输出，只记录时长（仅输出端）
+"""
+
+import os
+import sys
+import time
+import wave
+import socket
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger("AudioIO")
+
+
+class _Pacer:
+    """按 speed 倍速控制读写节奏，speed 为 0 时不等待"""
+
+    def __init__(self, rate, speed):
+        self.rate = rate
+        self.speed = speed
+        self._start = None
+        self._samples = 0
+
+    def wait(self, samples):
+        if not self.speed:
+            return
+        if self._start is None:
+            self._start = time.monotonic()
+        self._samples += samples
+        delay = self._start + self._samples / self.rate / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _Backoff:
+    """设备恢复的指数退避，连续失败时等待时间翻倍，成功后重置"""
+
+    def __init__(self, initial=0.5, maximum=30.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = 0.0
+
+    def wait(self):
+        if self.delay:
+            logger.info(f"{self.delay:.1f}秒后重新打开麦克风")
+            time.sleep(self.delay)
+        self.delay = min(max(self.delay * 2, self.initial), self.maximum)
+
+    def reset(self):
+        self.delay = 0.0
+
+
+class SPSCRing:
+    """单生产者单消费者的 int16 环形缓冲区，不加锁
+
+    生产者（音频回调）只推进 write_pos，消费者只推进 read_pos，两者单调递增；
+    写满时丢弃新到的数据（overruns 记次数，dropped 记采样数），不覆盖消费者尚未读取的数据。
+    """
+
+    def __init__(self, capacity):
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self.write_pos = 0
+        self.read_pos = 0
+        self.dropped = 0
+        self.overruns = 0
+
+    def available(self):
+        return self.write_pos - self.read_pos
+
+    def write(self, samples):
+        free = self.capacity - (self.write_pos - self.read_pos)
+        if len(samples) > free:
+            self.dropped += len(samples) - free
+            self.overruns += 1
+            samples = samples[:free]
+        start = self.write_pos % self.capacity
+        first = min(len(samples), self.capacity - start)
+        self.buffer[start:start + first] = samples[:first]
+        self.buffer[:len(samples) - first] = samples[first:]
+        self.write_pos += len(samples)
+
+    def read(self, count):
+        count = min(count, self.available())
+        start = self.read_pos % self.capacity
+        first = min(count, self.capacity - start)
+        out = np.concatenate((self.buffer[start:start + first], self.buffer[:count - first]))
+        self.read_pos += count
+        return out
+
+
+def _to_mono_int16(data, channels):
+    samples = np.frombuffer(data, dtype="<i2")
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)[:, 0]
+    return samples
+
+
+def _resample(samples, rate, target):
+    if rate == target or len(samples) == 0:
+        return samples
+    positions = np.arange(0, len(samples), rate / target)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.int16)
+
+
+class StreamResampler:
+    """分块到达的 int16 音频线性插值重采样
+
+    跨块保留上一块的最后一个采样和下一个输出点的小数位置，
+    块边界处不会出现不连续，输出总长度也不会因逐块取整而漂移
+    """
+
+    def __init__(self, rate, target):
+        self.rate = rate
+        self.target = target
+        self.step = rate / target
+        self.reset()
+
+    def reset(self):
+        self._position = 0.0  # 下一个输出点相对于下一块第一个采样的位置（输入采样为单位）
+        self._last = None
+
+    def process(self, samples):
+        if self.rate == self.target or len(samples) == 0:
+            return samples
+        samples = samples.astype(np.float32)
+        if self._last is None:
+            source, start = samples, self._position
+        else:
+            source, start = np.concatenate(([self._last], samples)), self._position + 1
+        end = len(source) - 1
+        count = int((end - start) // self.step) + 1 if start <= end else 0
+        positions = start + np.arange(count) * self.step
+        output = np.interp(positions, np.arange(len(source)), source)
+        self._position = start + count * self.step - len(source)
+        self._last = source[-1]
+        return np.round(output).clip(-32768, 32767).astype(np.int16)
+
+
+class AudioSource:
+    """音频输入源
+
+    read(frames) 返回最多 frames 个 int16 采样，返回 None 表示输入结束。
+    realtime 为真表示输入按实际时钟到达、不能暂停（麦克风），下游应丢弃积压而不是阻塞；
+    文件和管道类输入为假，下游阻塞即可形成反压，保证回放结果确定。
+    """
+
+    realtime = False
+
+    def __init__(self, rate=16000):
+        self.rate = rate
+
+    def open(self):
+        pass
+
+    def read(self, frames):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PyAudioSource(AudioSource):
+    """麦克风输入（阻塞读取），读取出错时按指数退避重新打开设备"""
+
+    realtime = True
+
+    def __init__(self, rate=16000, frames_per_buffer=1024):
+        super().__init__(rate)
+        import pyaudio
+        self._pyaudio = pyaudio
+        self.frames_per_buffer = frames_per_buffer
+        self.p = pyaudio.PyAudio()
+        self.stream = None
+        self.restarts = 0
+        self._backoff = _Backoff()
+
+    def open(self):
+        """打开麦克风"""
+        try:
+            self._close_stream()
+            self.stream = self._open_stream()
+            logger.info("麦克风监听已启动")
+        except Exception as e:
+            logger.error(f"启动麦克风监听出错: {str(e)}")
+            # 尝试重新初始化PyAudio
+            try:
+                self.p.terminate()
+                time.sleep(0.5)
+                self.p = self._pyaudio.PyAudio()
+                self.stream = self._open_stream()
+                logger.info("麦克风监听已重新启动")
+            except Exception as e2:
+                logger.error(f"重新启动麦克风监听失败: {str(e2)}")
+
+    def _open_stream(self):
+        return self.p.open(
+            format=self._pyaudio.paInt16,
+            channels=1,
+            rate=self.rate,
+            input=True,
+            frames_per_buffer=self.frames_per_buffer
+        )
+
+    def _close_stream(self):
+        if self.stream:
+            try:
+                self.stream.stop_stream()
+                self.stream.close()
+            except Exception:
+                pass
+            self.stream = None
+
+    def read(self, frames):
+        if not self.stream or not self.stream.is_active():
+            logger.warning("音频流不可用，重新启动...")
+            self.restarts += 1
+            self._backoff.wait()
+            self.open()
+            if not self.stream:
+                return np.zeros(0, dtype=np.int16)
+        try:
+            data = self.stream.read(frames, exception_on_overflow=False)
+        except Exception as e:
+            logger.error(f"读取音频数据出错: {str(e)}")
+            self._close_stream()
+            return np.zeros(0, dtype=np.int16)
+        self._backoff.reset()
+        return np.frombuffer(data, dtype=np.int16)
+
+    def close(self):
+        self._close_stream()
+        self.p.terminate()
+
+
+class PyAudioCallbackSource(AudioSource):
+    """麦克风输入（回调模式）
+
+    PortAudio 在自己的线程中回调，音频写入无锁环形缓冲区；read() 在凑够一帧前阻塞在事件上，
+    空闲时不轮询。设备溢出、缓冲区满和设备停止供数分别计入 xruns，
+    设备出错或超过 stall_timeout 秒没有数据时按指数退避重新打开。
+    """
+
+    realtime = True
+
+    def __init__(self, rate=16000, frames_per_buffer=1024, ring_seconds=2.0, stall_timeout=2.0):
+        super().__init__(rate)
+        import pyaudio
+        self._pyaudio = pyaudio
+        self.frames_per_buffer = frames_per_buffer
+        self.stall_timeout = stall_timeout
+        self.ring = SPSCRing(int(rate * ring_seconds))
+        self.p = None
+        self.stream = None
+        self.callbacks = 0
+        self.restarts = 0
+        self._overflows = 0
+        self._stalls = 0
+        self._wanted = frames_per_buffer
+        self._ready = threading.Event()
+        self._backoff = _Backoff()
+
+    @property
+    def xruns(self):
+        return {"overflow": self._overflows, "ring_full": self.ring.overruns, "stall": self._stalls}
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        self.callbacks += 1
+        if status & self._pyaudio.paInputOverflow:
+            self._overflows += 1
+        self.ring.write(np.frombuffer(in_data, dtype=np.int16))
+        if self.ring.available() >= self._wanted and not self._ready.is_set():
+            self._ready.set()
+        return None, self._pyaudio.paContinue
+
+    def open(self):
+        """打开麦克风，失败时返回 False"""
+        self._backoff.wait()
+        try:
+            if self.p is None:
+                self.p = self._pyaudio.PyAudio()
+            self.stream = self.p.open(
+                format=self._pyaudio.paInt16,
+                channels=1,
+                rate=self.rate,
+                input=True,
+                frames_per_buffer=self.frames_per_buffer,
+                stream_callback=self._callback
+            )
+            self.stream.start_stream()
+            logger.info("麦克风监听已启动(回调模式)")
+            return True
+        except Exception as e:
+            logger.error(f"启动麦克风监听出错: {str(e)}")
+            self._teardown()
+            return False
+
+    def _teardown(self):
+        """关闭音频流并释放 PyAudio，下次打开时重新初始化设备"""
+        if self.stream:
+            try:
+                self.stream.stop_stream()
+                self.stream.close()
+            except Exception:
+                pass
+            self.stream = None
+        if self.p:
+            self.p.terminate()
+            self.p = None
+
+    def read(self, frames):
+        while True:
+            if self.stream is None and not self.open():
+                return np.zeros(0, dtype=np.int16)
+            if self.ring.available() >= frames:
+                self._backoff.reset()
+                return self.ring.read(frames)
+            self._wanted = frames
+            self._ready.clear()
+            if self.ring.available() >= frames:
+                continue
+            if self._ready.wait(self.stall_timeout):
+                continue
+            if self.stream.is_active():
+                self._stalls += 1
+                logger.warning(f"麦克风超过 {self.stall_timeout:.1f} 秒没有数据，重新打开设备")
+            else:
+                logger.warning("音频流已停止，重新打开设备")
+            self.restarts += 1
+            self._teardown()
+
+    def close(self):
+        self._teardown()
+        logger.info(f"麦克风已关闭(回调 {self.callbacks} 次，重启 {self.restarts} 次，溢出统计: {self.xruns})")
+
+
+class WavFileSource(AudioSource):
+    """WAV 文件输入，speed 为回放倍速（1 为实时，0 为尽可能快）"""
+
+    def __init__(self, path, rate=16000, speed=0.0):
+        super().__init__(rate)
+        self.path = path
+        self.speed = speed
+        self._samples = None
+        self._position = 0
+        self._pacer = _Pacer(rate, speed)
+
+    def open(self):
+        with wave.open(self.path, "rb") as wf:
+            if wf.getsampwidth() != 2:
+                raise ValueError(f"只支持16位WAV: {self.path}")
+            samples = _to_mono_int16(wf.readframes(wf.getnframes()), wf.getnchannels())
+            self._samples = _resample(samples, wf.getframerate(), self.rate)
+        self._position = 0
+        logger.info(f"从文件读取音频: {self.path}({len(self._samples) / self.rate:.1f}秒)")
+
+    def read(self, frames):
+        if self._samples is None:
+            self.open()
+        if self._position >= len(self._samples):
+            return None
+        block = self._samples[self._position:self._position + frames]
+        self._position += len(block)
+        self._pacer.wait(len(block))
+        return block
+
+
+class WavDirectorySource(AudioSource):
+    """目录中的所有 WAV 文件依次输入，文件之间插入 gap 秒静音，保证每个文件都能检测到结束"""
+
+    def __init__(self, directory, rate=16000, speed=0.0, gap=3.0):
+        super().__init__(rate)
+        self.directory = directory
+        self.speed = speed
+        self.gap = gap
+        self._files = []
+        self._current = None
+        self._silence = 0
+        self._pacer = _Pacer(rate, speed)
+
+    def open(self):
+        self._files = sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".wav")
+        )
+        logger.info(f"从目录读取音频: {self.directory}({len(self._files)} 个文件)")
+
+    def read(self, frames):
+        while True:
+            if self._silence:
+                count = min(frames, self._silence)
+                self._silence -= count
+                self._pacer.wait(count)
+                return np.zeros(count, dtype=np.int16)
+            if self._current is None:
+                if not self._files:
+                    return None
+                self._current = WavFileSource(self._files.pop(0), self.rate)
+                self._current.open()
+            block = self._current.read(frames)
+            if block is None:
+                self._current = None
+                self._silence = int(self.gap * self.rate)
+                continue
+            self._pacer.wait(len(block))
+            return block
+
+
+class RawPCMSource(AudioSource):
+    """16位单声道原始PCM输入（文件或标准输入）"""
+
+    def __init__(self, stream=None, path=None, rate=16000, speed=0.0):
+        super().__init__(rate)
+        self.stream = stream
+        self.path = path
+        self._pacer = _Pacer(rate, speed)
+        self._carry = b""
+
+    def open(self):
+        if self.stream is None:
+            self.stream = open(self.path, "rb") if self.path else sys.stdin.buffer
+
+    def read(self, frames):
+        if self.stream is None:
+            self.open()
+        received = self.stream.read(frames * 2 - len(self._carry))
+        if not received:
+            return None
+        data = self._carry + received
+        usable = len(data) - len(data) % 2
+        self._carry = data[usable:]
+        block = np.frombuffer(data[:usable], dtype="<i2")
+        self._pacer.wait(len(block))
+        return block
+
+    def close(self):
+        if self.path and self.stream:
+            self.stream.close()
+
+
+class UnixSocketSource(AudioSource):
+    """监听 Unix 套接字，读取连接方发送的16位单声道原始PCM
+
+    一个连接断开后继续等待下一个连接，close() 后结束
+    """
+
+    def __init__(self, path, rate=16000):
+        super().__init__(rate)
+        self.path = path
+        self._server = None
+        self._conn = None
+        self._closed = False
+
+    def open(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen(1)
+        logger.info(f"等待音频输入连接: {self.path}")
+
+    def read(self, frames):
+        if self._server is None:
+            self.open()
+        while not self._closed:
+            if self._conn is None:
+                try:
+                    self._conn, _ = self._server.accept()
+                except OSError:
+                    return None
+                self._reader = RawPCMSource(self._conn.makefile("rb"), rate=self.rate)
+                logger.info("音频输入已连接")
+            block = self._reader.read(frames)
+            if block is not None:
+                return block
+            self._conn.close()
+            self._conn = None
+            logger.info("音频输入连接已断开")
+        return None
+
+    def close(self):
+        self._closed = True
+        if self._conn:
+            self._conn.close()
+        if self._server:
+            self._server.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class AudioSink:
+    """音频输出端
+
+    start(rate) 按采样率打开输出，write(samples) 写入 int16 采样；
+    speed 表示写入速度相对实时的倍数，0 表示写入立即完成（不能据此判断播放欠载）
+    """
+
+    speed = 1.0
+
+    def __init__(self):
+        self.rate = None
+
+    def start(self, rate):
+        self.rate = rate
+
+    def write(self, samples):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PyAudioSink(AudioSink):
+    """扬声器输出，write() 在设备缓冲区有空间后返回"""
+
+    def __init__(self):
+        super().__init__()
+        import pyaudio
+        self._pyaudio = pyaudio
+        self.p = pyaudio.PyAudio()
+        self.stream = None
+
+    def start(self, rate):
+        if self.stream and rate == self.rate:
+            return
+        self._close_stream()
+        self.stream = self.p.open(
+            format=self.p.get_format_from_width(2),  # 16位音频
+            channels=1,
+            rate=rate,
+            output=True
+        )
+        self.rate = rate
+
+    def write(self, samples):
+        self.stream.write(samples.tobytes())
+
+    def _close_stream(self):
+        if self.stream:
+            try:
+                self.stream.stop_stream()
+                self.stream.close()
+            except Exception as e:
+                logger.error(f"关闭音频流时出错: {str(e)}")
+            self.stream = None
+
+    def close(self):
+        self._close_stream()
+        self.p.terminate()
+
+
+class WavFileSink(AudioSink):
+    """所有输出依次写入一个 WAV 文件"""
+
+    speed = 0.0
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._wav = None
+
+    def start(self, rate):
+        if self._wav and rate == self.rate:
+            return
+        if self._wav:
+            raise ValueError(f"WAV 输出不支持中途改变采样率: {self.rate} -> {rate}")
+        self._wav = wave.open(self.path, "wb")
+        self._wav.setnchannels(1)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(rate)
+        self.rate = rate
+
+    def write(self, samples):
+        self._wav.writeframes(samples.astype("<i2").tobytes())
+
+    def close(self):
+        if self._wav:
+            self._wav.close()
+            self._wav = None
+
+
+class RawPCMSink(AudioSink):
+    """16位单声道原始PCM输出（文件、标准输出或已连接的套接字）
+
+    speed 大于0时每次写入后按倍速等待，接收方按实时节奏收到音频（网络会话中打断回复能及时生效）
+    """
+
+    def __init__(self, stream=None, path=None, speed=0.0):
+        super().__init__()
+        self.stream = stream
+        self.path = path
+        self.speed = speed
+
+    def start(self, rate):
+        self.rate = rate
+        if self.stream is None:
+            self.stream = open(self.path, "wb") if self.path else sys.stdout.buffer
+
+    def write(self, samples):
+        self.stream.write(samples.astype("<i2").tobytes())
+        self.stream.flush()
+        if self.speed:
+            time.sleep(len(samples) / self.rate / self.speed)
+
+    def close(self):
+        if self.path and self.stream:
+            self.stream.close()
+
+
+class UnixSocketSink(RawPCMSink):
+    """连接 Unix 套接字发送16位单声道原始PCM"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.socket_path = path
+        self._sock = None
+
+    def start(self, rate):
+        self.rate = rate
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(self.socket_path)
+            self.stream = self._sock.makefile("wb")
+
+    def close(self):
+        if self._sock:
+            self.stream.close()
+            self._sock.close()
+            self._sock = None
+
+
+class NullSink(AudioSink):
+    """丢弃输出，只记录时长；speed 大于0时按倍速等待，模拟播放耗时"""
+
+    def __init__(self, speed=0.0):
+        super().__init__()
+        self.speed = speed
+        self.samples = 0
+        self.writes = 0
+        self.first_write = None
+        self.last_write = None
+
+    def write(self, samples):
+        now = time.monotonic()
+        if self.first_write is None:
+            self.first_write = now
+        self.last_write = now
+        self.writes += 1
+        self.samples += len(samples)
+        if self.speed:
+            time.sleep(len(samples) / self.rate / self.speed)
+
+    def stats(self):
+        return {
+            "writes": self.writes,
+            "seconds": self.samples / self.rate if self.rate else 0.0,
+        }
+
+
+def create_source(spec, rate=16000, frames_per_buffer=1024, speed=0.0, gap=3.0):
+    """按字符串创建输入源"""
+    kind, _, target = spec.partition(":")
+    if kind == "pyaudio":
+        if target == "callback":
+            return PyAudioCallbackSource(rate, frames_per_buffer)
+        return PyAudioSource(rate, frames_per_buffer)
+    if kind == "wav":
+        return WavFileSource(target, rate, speed)
+    if kind == "dir":
+        return WavDirectorySource(target, rate, speed, gap)
+    if kind == "stdin":
+        return RawPCMSource(rate=rate, speed=speed)
+    if kind == "raw":
+        return RawPCMSource(path=target, rate=rate, speed=speed)
+    if kind == "unix":
+        return UnixSocketSource(target, rate)
+    raise ValueError(f"未知的音频输入: {spec}")
+
+
+def create_sink(spec, speed=0.0):
+    """按字符串创建输出端"""
+    kind, _, target = spec.partition(":")
+    if kind == "pyaudio":
+        return PyAudioSink()
+    if kind == "wav":
+        return WavFileSink(target)
+    if kind == "stdout":
+        return RawPCMSink()
+    if kind == "raw":
+        return RawPCMSink(path=target)
+    if kind == "unix":
+        return UnixSocketSink(target)
+    if kind == "null":
+        return NullSink(speed)
+    raise ValueError(f"未知的音频输出: {spec}")
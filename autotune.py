@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+识别模型自动调优
+在参考语料上测量各模型规格和计算精度的实时率与字错误率，选出满足目标实时率和
+字错误率上限的最快配置，再为它调整 cpu_threads 和 num_workers，结果写入 asr_profile.json；
+app.py 和 shell_service.py 启动时由 asr_model.py 读取（环境变量仍然优先）
+
+    python autotune.py --corpus asr_reference --target-rtf 0.5 --max-cer 0.15
+
+参考语料目录中每个 xxx.wav 需要一个同名的 xxx.txt 参考文本（与 decoding_policy.py report 相同），
+建议放几段在部署现场录制、总长30秒以上的语音
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from asr_model import SAMPLE_RATE, ASR_PROFILE, create_model, warmup, hardware_fingerprint
+from decoding_policy import create_policy, load_corpus, evaluate
+
+logger = logging.getLogger("AutoTune")
+
+DEFAULT_SIZES = "tiny,base,small,medium,large-v3"
+DEFAULT_COMPUTE_TYPES = "int8,int8_float32,float32"
+DEFAULT_CORPUS = "asr_reference"
+
+
+def thread_candidates(cpu_count):
+    """cpu_threads 候选：四分之一、一半和全部核心"""
+    return sorted({max(cpu_count // 4, 1), max(cpu_count // 2, 1), cpu_count})
+
+
+def measure(config, corpus, policy_name, streams=1):
+    """按配置加载模型，streams 个线程同时识别整个语料
+
+    返回单路实时率（平均每路解码耗时/音频时长）、吞吐实时率（总耗时/总音频时长）和字错误率
+    """
+    started = time.monotonic()
+    model = create_model(socket_path="", **config)
+    load_seconds = time.monotonic() - started
+    try:
+        warmup(model)
+        policies = [create_policy(policy_name) for _ in range(streams)]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=streams) as executor:
+            results = list(executor.map(lambda policy: evaluate(model, policy, corpus), policies))
+        wall = time.monotonic() - started
+    finally:
+        del model
+        gc.collect()
+    audio_seconds = sum(result["audio_seconds"] for result in results)
+    return {
+        **config,
+        "streams": streams,
+        "load_seconds": round(load_seconds, 2),
+        "rtf": round(sum(result["real_time_factor"] for result in results) / streams, 4),
+        "throughput_rtf": round(wall / audio_seconds, 4) if audio_seconds else 0.0,
+        "cer": round(max(result["cer"] for result in results), 4),
+    }
+
+
+def meets(result, target_rtf, max_cer):
+    return "error" not in result and result["rtf"] <= target_rtf and result["cer"] <= max_cer
+
+
+def tune(corpus, sizes, compute_types, device, target_rtf, max_cer, policy_name, workers, exhaustive=False):
+    """先选模型规格和计算精度，再调整线程数和并发数，返回 (最佳配置, 全部测量结果)"""
+    cpu_count = os.cpu_count() or 1
+    results = []
+
+    # 第一步：全部核心、单路解码，按规格从小到大测量；满足条件的最小规格测完即停止
+    for size in sizes:
+        for compute_type in compute_types:
+            config = {"model_size": size, "device": device, "compute_type": compute_type,
+                      "cpu_threads": cpu_count, "num_workers": 1}
+            logger.info(f"测量 {size}({compute_type})...")
+            try:
+                result = measure(config, corpus, policy_name)
+            except Exception as e:
+                logger.warning(f"{size}({compute_type}) 无法运行: {str(e)}")
+                result = {**config, "streams": 1, "error": str(e)}
+            logger.info(f"结果: {result}")
+            results.append(result)
+        if not exhaustive and any(meets(result, target_rtf, max_cer) for result in results):
+            break
+
+    passing = [result for result in results if meets(result, target_rtf, max_cer)]
+    if not passing:
+        return None, results
+    best = min(passing, key=lambda result: result["rtf"])
+
+    # 第二步：固定规格和精度，调整每个模型的线程数和并发解码数，按吞吐实时率选择
+    tuned = [best]
+    for num_workers in workers:
+        for cpu_threads in thread_candidates(cpu_count):
+            if num_workers == 1 and cpu_threads == cpu_count:
+                continue
+            if cpu_threads * num_workers > cpu_count * 2:
+                continue
+            config = {key: best[key] for key in ("model_size", "device", "compute_type")}
+            config.update(cpu_threads=cpu_threads, num_workers=num_workers)
+            logger.info(f"测量 cpu_threads={cpu_threads} num_workers={num_workers}...")
+            try:
+                result = measure(config, corpus, policy_name, streams=num_workers)
+            except Exception as e:
+                logger.warning(f"配置无法运行: {str(e)}")
+                continue
+            logger.info(f"结果: {result}")
+            results.append(result)
+            if meets(result, target_rtf, max_cer):
+                tuned.append(result)
+    best = min(tuned, key=lambda result: (result["throughput_rtf"], result["rtf"]))
+    return best, results
+
+
+def write_profile(path, best, results, args):
+    profile = {
+        "config": {key: best[key] for key in ("model_size", "device", "compute_type", "cpu_threads", "num_workers")},
+        "measured": {key: best[key] for key in ("rtf", "throughput_rtf", "cer", "load_seconds")},
+        "target_rtf": args.target_rtf,
+        "max_cer": args.max_cer,
+        "policy": args.policy,
+        "corpus": os.path.abspath(args.corpus),
+        "hardware": hardware_fingerprint(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "candidates": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    return profile
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="识别模型自动调优")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="参考语料目录（wav + 同名 txt）")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES)
+    parser.add_argument("--compute-types", default=DEFAULT_COMPUTE_TYPES)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--workers", default="1,2", help="num_workers 候选")
+    parser.add_argument("--target-rtf", type=float, default=0.5, help="单路实时率上限")
+    parser.add_argument("--max-cer", type=float, default=0.15, help="字错误率上限")
+    parser.add_argument("--policy", default="fast", help="测量时使用的解码策略")
+    parser.add_argument("--exhaustive", action="store_true", help="测量全部规格，不在满足条件后提前停止")
+    parser.add_argument("--output", default=ASR_PROFILE)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        parser.error(f"参考语料目录中没有可用的 wav/txt: {args.corpus}")
+    logger.info(f"参考语料: {len(corpus)} 个文件，共 {sum(len(audio) for _, audio, _ in corpus) / SAMPLE_RATE:.1f}秒")
+
+    best, results = tune(
+        corpus,
+        [size.strip() for size in args.sizes.split(",")],
+        [compute_type.strip() for compute_type in args.compute_types.split(",")],
+        args.device, args.target_rtf, args.max_cer, args.policy,
+        [int(value) for value in args.workers.split(",")],
+        args.exhaustive,
+    )
+
+    print(f"{'规格':<12}{'精度':<14}{'线程':>6}{'并发':>6}{'实时率':>10}{'吞吐实时率':>12}{'字错误率':>10}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['model_size']:<12}{result['compute_type']:<14}{'无法运行':>20}")
+            continue
+        print(f"{result['model_size']:<12}{result['compute_type']:<14}{result['cpu_threads']:>6}"
+              f"{result['num_workers']:>6}{result['rtf']:>10.3f}{result['throughput_rtf']:>12.3f}{result['cer']:>10.3f}")
+
+    if best is None:
+        print(f"没有配置同时满足实时率 ≤ {args.target_rtf} 和字错误率 ≤ {args.max_cer}，未写入 {args.output}")
+        return 1
+    write_profile(args.output, best, results, args)
+    print(f"已写入 {args.output}: {best['model_size']}({best['compute_type']}) "
+          f"cpu_threads={best['cpu_threads']} num_workers={best['num_workers']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+端到端延迟基准测试
+用一组 WAV 文件驱动本地服务（shell_service）或 Web 服务（app.py）的完整一轮对话，
+LLM 请求发往本地模拟接口（mock_dashscope.py），输出各阶段延迟的 p50/p95/p99（JSON）
+
+    python benchmark.py synth bench_corpus --count 20       # 生成合成语料
+    python benchmark.py shell bench_corpus --mock           # 本地服务：端点检测 → 识别 → LLM → 播放
+    python benchmark.py app bench_corpus --mock             # Web 服务：上传识别 → 生成回复 → 下载音频
+    python benchmark.py app bench_corpus --app-url http://127.0.0.1:8888
+
+指标（秒）:
+    endpoint_delay       用户说完到检测到语音结束
+    asr_seconds / asr_rtf  识别耗时和实时率
+    llm_first_byte       发出 LLM 请求到收到第一个数据块（仅本地服务）
+    first_audio          用户说完到拿到第一段回复音频
+    turn_total           用户说完到回复音频全部收到
+"""
+
+import os
+import io
+import json
+import time
+import wave
+import socket
+import logging
+import argparse
+import threading
+import numpy as np
+from vad import create_vad, frame_energy, read_wav_int16, Endpointer
+from audio_io import NullSink
+
+logger = logging.getLogger("Benchmark")
+
+RATE = 16000
+FEED_CHUNK = 1024
+METRICS = ["endpoint_delay", "asr_seconds", "asr_rtf", "llm_first_byte", "first_audio", "turn_total"]
+PHRASES = ["你好", "今天天气怎么样", "帮我设置一个明天早上七点的闹钟", "讲一个简短的笑话", "现在几点了"]
+
+
+def synth_utterance(seconds, seed, lead=0.5, tail=2.5):
+    """合成类似语音的信号：带谐波和音节包络的浊音段，前后是低噪声"""
+    rng = np.random.default_rng(seed)
+    noise = lambda n: rng.normal(0, 60, n)
+    voiced = []
+    remaining = int(RATE * seconds)
+    while remaining > 0:
+        length = min(int(RATE * rng.uniform(0.15, 0.3)), remaining)
+        t = np.arange(length) / RATE
+        pitch = rng.uniform(110, 220)
+        tone = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+        voiced.append(6000 * np.hanning(length) * tone / 2.3)
+        gap = int(RATE * rng.uniform(0.03, 0.08))
+        voiced.append(noise(gap))
+        remaining -= length + gap
+    speech = np.concatenate(voiced)
+    speech = speech + noise(len(speech))
+    audio = np.concatenate([noise(int(RATE * lead)), speech, noise(int(RATE * tail))])
+    return np.clip(audio, -32768, 32767).astype(np.int16)
+
+
+def synth_corpus(directory, count):
+    os.makedirs(directory, exist_ok=True)
+    for index in range(count):
+        phrase = PHRASES[index % len(PHRASES)]
+        samples = synth_utterance(0.4 + 0.25 * len(phrase), seed=index)
+        name = os.path.join(directory, f"synth_{index:03d}")
+        with wave.open(f"{name}.wav", "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(RATE)
+            wf.writeframes(samples.tobytes())
+        with open(f"{name}.txt", "w", encoding="utf-8") as f:
+            f.write(phrase)
+    return count
+
+
+def load_corpus(directory):
+    """返回 [(名称, int16 采样, 参考文本或 None)]"""
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".wav"):
+            continue
+        path = os.path.join(directory, name)
+        samples, rate = read_wav_int16(path)
+        if rate != RATE:
+            samples = np.interp(np.arange(0, len(samples), rate / RATE), np.arange(len(samples)),
+                                samples).astype(np.int16)
+        txt_path = os.path.splitext(path)[0] + ".txt"
+        reference = None
+        if os.path.exists(txt_path):
+            with open(txt_path, "r", encoding="utf-8") as f:
+                reference = f.read().strip()
+        corpus.append((name, samples, reference))
+    return corpus
+
+
+def percentiles(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "mean": float(np.mean(values)),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(np.max(values)),
+    }
+
+
+def summarize(turns):
+    return {metric: percentiles([turn.get(metric) for turn in turns]) for metric in METRICS}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_thread(app):
+    """在后台线程中运行 ASGI 应用，返回 (地址, 服务器)"""
+    import uvicorn
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name=f"uvicorn-{port}", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+def start_mock():
+    """启动模拟接口，并让之后导入的服务指向它"""
+    from mock_dashscope import app as mock_app
+    url, server = serve_in_thread(mock_app)
+    os.environ["DASHSCOPE_BASE_URL"] = f"{url}/v1"
+    os.environ.setdefault("DASHSCOPE_API_KEY", "mock")
+    logger.info(f"模拟接口已启动: {url}/v1")
+    return server
+
+
+def endpoint(samples, engine, vad_options, silence_duration, max_duration, pre_roll, realtime=False):
+    """按采集块送入端点检测，返回 (录到的音频, 检测到结束时已送入的采样数)
+
+    与本地服务录音器相同的 VAD 和静音时长，按采样点计时；realtime 时按实际速度送入
+    """
+    endpointer = Endpointer(create_vad(engine, rate=RATE, **vad_options), silence_duration=silence_duration,
+                            max_duration=max_duration, pre_roll=pre_roll)
+    recorded = []
+    for offset in range(0, len(samples), FEED_CHUNK):
+        block = samples[offset:offset + FEED_CHUNK]
+        if realtime:
+            time.sleep(len(block) / RATE)
+        for kind, value in endpointer.feed(block):
+            if kind in ("start", "audio"):
+                recorded.append(value)
+            elif recorded:
+                return np.concatenate(recorded), offset + len(block), endpointer.vad.threshold
+    if recorded:
+        return np.concatenate(recorded), len(samples), endpointer.vad.threshold
+    return None, len(samples), endpointer.vad.threshold
+
+
+def speech_end(samples, threshold, ratio=0.5, frame_ms=20):
+    """参考的语音结束位置：最后一个能量超过 threshold * ratio 的帧（与录音裁剪规则相同，不留余量）"""
+    frame_len = int(RATE * frame_ms / 1000)
+    voiced = np.flatnonzero(frame_energy(samples, frame_len) > threshold * ratio)
+    return (int(voiced[-1]) + 1) * frame_len if len(voiced) else len(samples)
+
+
+def run_shell(corpus, realtime=False, use_cache=False):
+    """本地服务：录音端点检测 → transcribe_audio → get_llm_response → 播放"""
+    import shell_service as service
+    if not use_cache:
+        service.tts_cache = None
+    service.model.load()
+    service.model.get()
+
+    turns = []
+    for name, samples, reference in corpus:
+        recorded, detected_at, threshold = endpoint(
+            samples, service.VAD_ENGINE, service.VAD_OPTIONS.get(service.VAD_ENGINE, {}),
+            service.SILENCE_DURATION, service.MAX_RECORD_DURATION, service.PRE_ROLL_DURATION, realtime)
+        if recorded is None:
+            logger.warning(f"{name}: 没有检测到语音")
+            continue
+        endpoint_delay = max(detected_at - speech_end(samples, threshold), 0) / RATE
+        start, end = service.speech_bounds(recorded, threshold * service.TRIM_THRESHOLD_RATIO)
+        utterance = service.int16_to_float32(recorded[start:end])
+
+        started = time.monotonic()
+        text = service.transcribe_audio(utterance)
+        asr_seconds = time.monotonic() - started
+
+        sink = NullSink()
+        sink.start(service.PLAYBACK_RATE)
+        timings = {}
+        llm_started = time.monotonic()
+        service.get_llm_response(text or reference or PHRASES[0], on_audio=sink.write, timings=timings)
+        first_byte = timings.get("first_chunk")
+        turns.append({
+            "file": name,
+            "text": text,
+            "audio_seconds": len(utterance) / RATE,
+            "endpoint_delay": endpoint_delay,
+            "asr_seconds": asr_seconds,
+            "asr_rtf": asr_seconds / max(len(utterance) / RATE, 1e-6),
+            "llm_first_byte": first_byte - timings["request"] if first_byte else None,
+            "first_audio": endpoint_delay + asr_seconds + (sink.first_write - llm_started) if sink.first_write else None,
+            "turn_total": endpoint_delay + asr_seconds + (sink.last_write - llm_started) if sink.last_write else None,
+        })
+        logger.info(f"{name}: {turns[-1]}")
+    return turns
+
+
+def _wav_bytes(samples):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def run_app(corpus, app_url=None, silence_duration=2.0):
+    """Web 服务：上传录音 → generate-tts → 下载回复音频
+
+    浏览器在本地按 silence_duration 秒静音判断结束，上传的录音包含尾部静音
+    """
+    import httpx
+    server = None
+    if app_url is None:
+        import app as web
+        app_url, server = serve_in_thread(web.app)
+    turns = []
+    with httpx.Client(base_url=app_url, timeout=120.0) as client:
+        while client.get("/diyvoice/ready").status_code != 200:
+            time.sleep(0.5)
+        for name, samples, reference in corpus:
+            recorded, detected_at, threshold = endpoint(samples, "adaptive", {}, silence_duration, 20, 0.3)
+            if recorded is None:
+                logger.warning(f"{name}: 没有检测到语音")
+                continue
+            endpoint_delay = max(detected_at - speech_end(samples, threshold), 0) / RATE
+
+            started = time.monotonic()
+            response = client.post("/diyvoice/upload-audio/",
+                                   files={"file": ("recording.wav", _wav_bytes(recorded), "audio/wav")})
+            response.raise_for_status()
+            asr_seconds = time.monotonic() - started
+            text = response.json().get("text") or reference or PHRASES[0]
+
+            started = time.monotonic()
+            response = client.post("/diyvoice/generate-tts/", json={"text": text})
+            response.raise_for_status()
+            file_path = response.json()["file_path"]
+            first_audio = None
+            with client.stream("GET", file_path) as download:
+                for _ in download.iter_bytes():
+                    if first_audio is None:
+                        first_audio = time.monotonic() - started
+            reply_seconds = time.monotonic() - started
+            turns.append({
+                "file": name,
+                "text": text,
+                "audio_seconds": len(recorded) / RATE,
+                "endpoint_delay": endpoint_delay,
+                "asr_seconds": asr_seconds,
+                "asr_rtf": asr_seconds / (len(recorded) / RATE),
+                "llm_first_byte": None,
+                "first_audio": endpoint_delay + asr_seconds + first_audio if first_audio else None,
+                "turn_total": endpoint_delay + asr_seconds + reply_seconds,
+            })
+            logger.info(f"{name}: {turns[-1]}")
+    if server:
+        server.should_exit = True
+    return turns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="端到端延迟基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+    synth = sub.add_parser("synth", help="生成合成语料")
+    synth.add_argument("directory")
+    synth.add_argument("--count", type=int, default=20)
+    for target in ("shell", "app"):
+        run = sub.add_parser(target, help=f"测试{'本地服务' if target == 'shell' else 'Web服务'}")
+        run.add_argument("corpus")
+        run.add_argument("--mock", action="store_true", help="启动本地模拟的百炼接口")
+        run.add_argument("--output", help="结果 JSON 文件，默认输出到标准输出")
+        run.add_argument("--details", action="store_true", help="包含每轮对话的结果")
+        if target == "shell":
+            run.add_argument("--realtime", action="store_true", help="按实际速度送入音频")
+            run.add_argument("--use-cache", action="store_true", help="允许使用TTS缓存")
+        else:
+            run.add_argument("--app-url", help="已运行的 Web 服务地址，默认在进程内启动")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == "synth":
+        print(f"已生成 {synth_corpus(args.directory, args.count)} 个文件: {args.directory}")
+        return
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        parser.error(f"语料目录中没有 wav 文件: {args.corpus}")
+    if args.mock:
+        start_mock()
+    if args.command == "shell":
+        turns = run_shell(corpus, realtime=args.realtime, use_cache=args.use_cache)
+    else:
+        turns = run_app(corpus, app_url=args.app_url)
+
+    result = {
+        "target": args.command,
+        "files": len(corpus),
+        "turns": len(turns),
+        "llm_base_url": os.getenv("DASHSCOPE_BASE_URL"),
+        "metrics": summarize(turns),
+    }
+    if args.details:
+        result["details"] = turns
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+识别解码策略
+先用贪心解码，只把置信度低的片段按原时间范围截取后用 beam search 重新解码；
+可开启 faster-whisper 内置的 VAD 跳过静音段，用热词或提示词减少温度回退重试。
+各入口按名称选择策略:
+
+    ASR_POLICY_WEB       Web 上传和 WebSocket 最终结果，默认 fast
+    ASR_POLICY_SHELL     本地服务最终结果，默认 fast
+    ASR_POLICY_PARTIAL   增量识别的中间结果，默认 partial
+    ASR_HOTWORDS         逗号分隔的领域热词
+    ASR_HOTWORDS_FILE    热词文件（每行一个）
+    ASR_INITIAL_PROMPT   提示词
+
+在本地语料上比较各策略的实时率和字错误率（目录中每个 wav 对应同名 txt 参考文本）:
+    python decoding_policy.py report corpus/ --policies fast,accurate
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import logging
+import argparse
+import threading
+import dataclasses
+import unicodedata
+import numpy as np
+
+logger = logging.getLogger("DecodingPolicy")
+
+SAMPLE_RATE = 16000
+FALLBACK_PADDING = 0.1  # 重新解码时片段两端多截取的时长（秒）
+
+
+def _load_hotwords():
+    words = [word.strip() for word in os.getenv("ASR_HOTWORDS", "").split(",") if word.strip()]
+    path = os.getenv("ASR_HOTWORDS_FILE")
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            words.extend(line.strip() for line in f if line.strip())
+    return words
+
+
+ASR_HOTWORDS = _load_hotwords()
+ASR_INITIAL_PROMPT = os.getenv("ASR_INITIAL_PROMPT") or None
+
+
+def _shift(segment, offset):
+    """片段时间加上偏移（兼容 faster-whisper 的 dataclass 片段和 namedtuple 片段）"""
+    changes = {"start": segment.start + offset, "end": segment.end + offset}
+    if dataclasses.is_dataclass(segment):
+        return dataclasses.replace(segment, **changes)
+    return segment._replace(**changes)
+
+
+def _mean_logprob(segments):
+    return sum(segment.avg_logprob for segment in segments) / len(segments) if segments else float("-inf")
+
+
+class DecodingPolicy:
+    """一组解码参数加上低置信度片段的回退规则
+
+    - beam_size：首次解码的 beam 大小，1 为贪心
+    - fallback_beam_size：片段 avg_logprob 低于 fallback_logprob 或压缩比高于
+      fallback_compression 时，截取该片段用此 beam 大小重新解码；为 None 时不回退
+    - 重新解码的平均对数概率更高时才替换原片段
+    其余参数直接传给 WhisperModel.transcribe。
+    """
+
+    def __init__(self, name, language="zh", beam_size=1, fallback_beam_size=5, fallback_logprob=-0.8,
+                 fallback_compression=2.4, temperature=0.0, vad_filter=True, vad_parameters=None,
+                 condition_on_previous_text=False, word_timestamps=False, without_timestamps=False,
+                 hotwords=None, initial_prompt=None):
+        self.name = name
+        self.language = language
+        self.beam_size = beam_size
+        self.fallback_beam_size = fallback_beam_size
+        self.fallback_logprob = fallback_logprob
+        self.fallback_compression = fallback_compression
+        self.temperature = temperature
+        self.vad_filter = vad_filter
+        self.vad_parameters = vad_parameters
+        self.condition_on_previous_text = condition_on_previous_text
+        self.word_timestamps = word_timestamps
+        self.without_timestamps = without_timestamps
+        self.hotwords = list(hotwords or [])
+        self.initial_prompt = initial_prompt
+        self.counters = {"decodes": 0, "segments": 0, "fallbacks": 0, "fallbacks_accepted": 0}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _prompt(self, initial_prompt=None):
+        parts = [part for part in (self.initial_prompt, initial_prompt) if part]
+        return "".join(parts) or None
+
+    def options(self, initial_prompt=None, **overrides):
+        """首次解码的 transcribe 参数"""
+        options = {
+            "language": self.language,
+            "beam_size": self.beam_size,
+            "temperature": self.temperature,
+            "vad_filter": self.vad_filter,
+            "condition_on_previous_text": self.condition_on_previous_text,
+            "word_timestamps": self.word_timestamps,
+            "without_timestamps": self.without_timestamps,
+            "initial_prompt": self._prompt(initial_prompt),
+        }
+        if self.vad_parameters:
+            options["vad_parameters"] = self.vad_parameters
+        if self.hotwords:
+            options["hotwords"] = " ".join(self.hotwords)
+        options.update(overrides)
+        return options
+
+    def needs_fallback(self, segment):
+        return self.fallback_beam_size is not None and (
+            segment.avg_logprob < self.fallback_logprob or segment.compression_ratio > self.fallback_compression)
+
+    def transcribe(self, model, audio, initial_prompt=None, **overrides):
+        """按策略解码，返回 (片段列表, info)"""
+        segments, info = model.transcribe(audio, **self.options(initial_prompt, **overrides))
+        segments = list(segments)
+        low = [index for index, segment in enumerate(segments) if self.needs_fallback(segment)]
+        with self._lock:
+            self.counters["decodes"] += 1
+            self.counters["segments"] += len(segments)
+            self.counters["fallbacks"] += len(low)
+        if not low:
+            return segments, info
+
+        if not isinstance(audio, np.ndarray):
+            from faster_whisper.audio import decode_audio
+            audio = decode_audio(audio, sampling_rate=SAMPLE_RATE)
+        accepted = 0
+        for index in low:
+            segment = segments[index]
+            start = max(segment.start - FALLBACK_PADDING, 0.0)
+            end = segment.end + FALLBACK_PADDING
+            clip = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+            if len(clip) == 0:
+                continue
+            prompt = "".join(s.text for s in segments[:index])[-200:] or initial_prompt
+            retry, _ = model.transcribe(clip, **self.options(
+                prompt, beam_size=self.fallback_beam_size, vad_filter=False))
+            retry = list(retry)
+            if retry and _mean_logprob(retry) > segment.avg_logprob:
+                shifted = [_shift(s, start) for s in retry]
+                segments[index] = shifted[0] if len(shifted) == 1 else _merge(shifted)
+                accepted += 1
+        with self._lock:
+            self.counters["fallbacks_accepted"] += accepted
+        return segments, info
+
+    def stats(self):
+        with self._lock:
+            return {"policy": self.name, **self.counters}
+
+
+def _merge(segments):
+    """把重新解码得到的多个片段合并为一个，保持片段数量不变"""
+    changes = {
+        "start": segments[0].start,
+        "end": segments[-1].end,
+        "text": "".join(s.text for s in segments),
+        "avg_logprob": _mean_logprob(segments),
+        "compression_ratio": max(s.compression_ratio for s in segments),
+        "no_speech_prob": min(s.no_speech_prob for s in segments),
+    }
+    if dataclasses.is_dataclass(segments[0]):
+        return dataclasses.replace(segments[0], **changes)
+    return segments[0]._replace(**changes)
+
+
+POLICIES = {
+    # 原来的固定参数：beam 5，不过滤静音，Whisper 默认的温度回退
+    "accurate": dict(beam_size=5, fallback_beam_size=None, temperature=[0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+                     vad_filter=False, condition_on_previous_text=True),
+    # 贪心解码 + 低置信度片段 beam 回退 + 内置 VAD
+    "fast": dict(beam_size=1, fallback_beam_size=5, temperature=0.0, vad_filter=True),
+    # 增量识别的中间结果：只做贪心解码，窗口很短且已经过端点检测
+    "partial": dict(beam_size=1, fallback_beam_size=None, temperature=0.0, vad_filter=False),
+}
+
+
+def create_policy(name, **overrides):
+    """按名称创建策略，热词和提示词来自环境变量"""
+    try:
+        params = POLICIES[name]
+    except KeyError:
+        raise ValueError(f"未知的解码策略: {name}，可选: {', '.join(POLICIES)}")
+    params = {"hotwords": ASR_HOTWORDS, "initial_prompt": ASR_INITIAL_PROMPT, **params, **overrides}
+    return DecodingPolicy(name, **params)
+
+
+def entry_policy(entry):
+    """入口（web / shell / partial）配置的策略"""
+    defaults = {"web": "fast", "shell": "fast", "partial": "partial"}
+    return create_policy(os.getenv(f"ASR_POLICY_{entry.upper()}", defaults[entry]))
+
+
+def normalize_transcript(text):
+    """去掉空白和标点，全角转半角，用于计算字错误率"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return "".join(ch for ch in text if not ch.isspace() and not unicodedata.category(ch).startswith("P"))
+
+
+def edit_distance(reference, hypothesis):
+    """字符级编辑距离"""
+    previous = np.arange(len(hypothesis) + 1)
+    for i, ref_char in enumerate(reference, 1):
+        current = np.empty_like(previous)
+        current[0] = i
+        for j, hyp_char in enumerate(hypothesis, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_char != hyp_char))
+        previous = current
+    return int(previous[-1])
+
+
+def load_corpus(directory):
+    """读取语料目录，返回 [(名称, 音频, 参考文本)]"""
+    from faster_whisper.audio import decode_audio
+    corpus = []
+    for wav_path in sorted(glob.glob(os.path.join(directory, "*.wav"))):
+        txt_path = os.path.splitext(wav_path)[0] + ".txt"
+        if not os.path.exists(txt_path):
+            logger.warning(f"缺少参考文本: {txt_path}")
+            continue
+        with open(txt_path, "r", encoding="utf-8") as f:
+            reference = f.read().strip()
+        corpus.append((os.path.basename(wav_path), decode_audio(wav_path, sampling_rate=SAMPLE_RATE), reference))
+    return corpus
+
+
+def evaluate(model, policy, corpus):
+    """在语料上运行策略，返回实时率、字错误率和回退统计"""
+    errors = chars = 0
+    audio_seconds = decode_seconds = 0.0
+    details = []
+    for name, audio, reference in corpus:
+        started = time.monotonic()
+        segments, _ = policy.transcribe(model, audio)
+        elapsed = time.monotonic() - started
+        hypothesis = "".join(segment.text for segment in segments)
+        ref, hyp = normalize_transcript(reference), normalize_transcript(hypothesis)
+        distance = edit_distance(ref, hyp)
+        errors += distance
+        chars += len(ref)
+        audio_seconds += len(audio) / SAMPLE_RATE
+        decode_seconds += elapsed
+        details.append({"file": name, "cer": distance / max(len(ref), 1), "seconds": elapsed, "text": hypothesis})
+    return {
+        **policy.stats(),
+        "files": len(corpus),
+        "cer": errors / chars if chars else 0.0,
+        "real_time_factor": decode_seconds / audio_seconds if audio_seconds else 0.0,
+        "decode_seconds": decode_seconds,
+        "audio_seconds": audio_seconds,
+        "details": details,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="识别解码策略评测")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="比较各策略的实时率和字错误率")
+    report.add_argument("corpus")
+    report.add_argument("--policies", default=",".join(POLICIES))
+    report.add_argument("--details", action="store_true", help="输出每个文件的结果")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from asr_model import load_model
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        parser.error(f"语料目录中没有可用的 wav/txt: {args.corpus}")
+    model = load_model()
+    results = []
+    for name in args.policies.split(","):
+        result = evaluate(model, create_policy(name.strip()), corpus)
+        if not args.details:
+            result.pop("details")
+        results.append(result)
+
+    print(f"{'策略':<10}{'实时率':>10}{'字错误率':>10}{'回退片段':>10}")
+    for result in results:
+        print(f"{result['policy']:<10}{result['real_time_factor']:>10.3f}{result['cer']:>10.3f}"
+              f"{result['fallbacks_accepted']:>6}/{result['fallbacks']:<4}")
+    json.dump(results, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+各阶段延迟指标
+进程内的计数器、直方图和仪表，按 Prometheus 文本格式输出；
+app.py 在 /metrics 提供，shell_service.py 在本地 HTTP 端口（SHELL_METRICS_PORT）提供
+"""
+
+import json
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+DURATION_BUCKETS = (0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 12.0, 20.0, 30.0)
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0)
+BYTES_BUCKETS = (16e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """按标签值取子指标"""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签: {', '.join(self.labelnames)}")
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+            return child
+
+    def _only(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} 需要先调用 labels()")
+        return self._children[()]
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            yield from child.samples(self.name, self.labelnames, values)
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def set_function(self, function):
+        """输出时调用 function() 取当前值，用于导出其他组件自己维护的累计次数"""
+        self._function = function
+
+    def samples(self, name, labelnames, values):
+        value = self._value
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                return
+        yield f"{name}{_format_labels(labelnames, values)} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    """只增不减的计数器，名称以 _total 结尾"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._only().inc(amount)
+
+    def set_function(self, function):
+        self._only().set_function(function)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._value = 0.0
+        self._function = None
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        """输出时调用 function() 取当前值"""
+        self._function = function
+
+    def samples(self, name, labelnames, values):
+        value = self._value
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                return
+        yield f"{name}{_format_labels(labelnames, values)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._only().set(value)
+
+    def set_function(self, function):
+        self._only().set_function(function)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[index] += 1
+                    break
+
+    def samples(self, name, labelnames, values):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(labelnames, values, ("le", _format_value(bound)))
+            yield f"{name}_bucket{labels} {cumulative}"
+        yield f"{name}_bucket{_format_labels(labelnames, values, ('le', '+Inf'))} {count}"
+        yield f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}"
+        yield f"{name}_count{_format_labels(labelnames, values)} {count}"
+
+
+class Histogram(_Metric):
+    """按桶累计的分布，用于计算 p50/p95/p99"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._only().observe(value)
+
+
+class Registry:
+    """指标注册表，同名指标只注册一次"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render():
+    return REGISTRY.render()
+
+
+# 各服务共用的指标，service 标签区分 shell（本地服务）和 web（app.py）
+VAD_TRIGGERS = counter("diyvoice_vad_triggers_total", "检测到语音开始的次数", ["service"])
+RECORDING_SECONDS = histogram("diyvoice_recording_seconds", "单段录音时长（秒）", ["service"], DURATION_BUCKETS)
+ASR_DECODE_SECONDS = histogram("diyvoice_asr_decode_seconds", "识别解码耗时（秒）", ["service", "policy"])
+ASR_REAL_TIME_FACTOR = histogram("diyvoice_asr_real_time_factor", "识别实时率（解码耗时/音频时长）",
+                                 ["service", "policy"], RTF_BUCKETS)
+LLM_FIRST_CHUNK_SECONDS = histogram("diyvoice_llm_first_chunk_seconds", "LLM 请求到第一个数据块的耗时（秒）", ["service"])
+LLM_STREAM_SECONDS = histogram("diyvoice_llm_stream_seconds", "LLM 流式响应总耗时（秒）", ["service"])
+LLM_AUDIO_BYTES = histogram("diyvoice_llm_audio_bytes", "每次 LLM 响应收到的音频字节数", ["service"], BYTES_BUCKETS)
+LLM_ERRORS = counter("diyvoice_llm_errors_total", "LLM 请求失败次数", ["service"])
+PLAYBACK_UNDERRUNS = counter("diyvoice_playback_underruns_total", "流式播放欠载次数", ["service"])
+CONVERSATION_TURNS = counter("diyvoice_conversation_turns_total", "完成的对话轮数", ["service"])
+LLM_SPECULATIONS = counter("diyvoice_llm_speculations_total",
+                           "推测请求次数（hit 被采用 / miss 最终结果不同 / resumed 用户继续说话）", ["service", "outcome"])
+LLM_SPECULATION_LEAD_SECONDS = histogram("diyvoice_llm_speculation_lead_seconds",
+                                         "被采用的推测请求比最终识别结果提前发出的时间（秒）", ["service"])
+CAPTURE_XRUNS = counter("diyvoice_capture_xruns_total",
+                        "麦克风采集异常次数（overflow 设备溢出 / ring_full 缓冲区满 / stall 设备停止供数）", ["service", "kind"])
+CAPTURE_RESTARTS = counter("diyvoice_capture_restarts_total", "麦克风重新打开次数", ["service"])
+IDLE_CPU_RATIO = gauge("diyvoice_idle_cpu_ratio", "未录音期间进程的CPU占用（CPU秒/秒）", ["service"])
+RESPONSE_SECONDS = histogram("diyvoice_response_seconds", "录音结束到回复首个音频就绪的耗时（秒）", ["service"])
+BARGE_INS = counter("diyvoice_barge_ins_total", "用户插话打断回复的次数", ["service"])
+PIPELINE_DROPPED = counter("diyvoice_pipeline_dropped_total", "流水线队列满时丢弃的任务数", ["service", "queue"])
+
+
+def observe_asr(service, policy, seconds, audio_seconds):
+    """记录一次识别的耗时和实时率"""
+    ASR_DECODE_SECONDS.labels(service, policy).observe(seconds)
+    if audio_seconds > 0:
+        ASR_REAL_TIME_FACTOR.labels(service, policy).observe(seconds / audio_seconds)
+
+
+def observe_llm(service, timings, audio_bytes):
+    """记录一次 LLM 请求，timings 为 get_llm_response 记录的时间点"""
+    if "request" not in timings:
+        return
+    if "first_chunk" in timings:
+        LLM_FIRST_CHUNK_SECONDS.labels(service).observe(timings["first_chunk"] - timings["request"])
+    if "done" in timings:
+        LLM_STREAM_SECONDS.labels(service).observe(timings["done"] - timings["request"])
+    LLM_AUDIO_BYTES.labels(service).observe(audio_bytes)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            body = render().encode("utf-8")
+            content_type = CONTENT_TYPE
+        elif path in self.server.routes:
+            body = json.dumps(self.server.routes[path](), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="127.0.0.1", routes=None):
+    """在后台线程中提供 /metrics，返回服务器对象
+
+    routes 为 {路径: 返回字典的函数}，这些路径以 JSON 输出
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.routes = routes or {}
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    return server
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地模拟的百炼 OpenAI 兼容接口
+按可配置的节奏流式返回 qwen-omni 格式的音频片段，用于压测和离线基准测试
+
+启动:
+    uvicorn mock_dashscope:app --port 9000
+然后把服务指向它:
+    export DASHSCOPE_BASE_URL=http://127.0.0.1:9000/v1
+"""
+
+import os
+import json
+import time
+import uuid
+import base64
+import asyncio
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+SAMPLE_RATE = 24000
+FIRST_CHUNK_DELAY_MS = float(os.getenv("MOCK_FIRST_CHUNK_DELAY_MS", "300"))  # 首个数据块之前的延迟
+CHUNK_INTERVAL_MS = float(os.getenv("MOCK_CHUNK_INTERVAL_MS", "50"))  # 数据块之间的间隔
+CHUNK_AUDIO_MS = float(os.getenv("MOCK_CHUNK_AUDIO_MS", "100"))  # 每个数据块包含的音频时长
+REPLY_SECONDS = float(os.getenv("MOCK_REPLY_SECONDS", "3"))  # 每次回复的音频总时长
+
+app = FastAPI()
+
+
+def synth_tone(seconds, frequency=440.0):
+    """生成带淡入淡出的正弦波，int16 PCM"""
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    envelope = np.minimum(1.0, np.minimum(t, seconds - t) / 0.05)
+    return (0.3 * 32767 * envelope * np.sin(2 * np.pi * frequency * t)).astype(np.int16)
+
+
+def _chunk(completion_id, model, delta=None, usage=None):
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": None}],
+    }
+    if usage is not None:
+        payload["usage"] = usage
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def _stream(text, model):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    pcm = synth_tone(REPLY_SECONDS).tobytes()
+    step = int(SAMPLE_RATE * CHUNK_AUDIO_MS / 1000) * 2
+
+    await asyncio.sleep(FIRST_CHUNK_DELAY_MS / 1000)
+    yield _chunk(completion_id, model, {"role": "assistant", "content": None,
+                                         "audio": {"transcript": f"模拟回复：{text}"}})
+    for start in range(0, len(pcm), step):
+        data = base64.b64encode(pcm[start:start + step]).decode("ascii")
+        yield _chunk(completion_id, model, {"audio": {"data": data}})
+        await asyncio.sleep(CHUNK_INTERVAL_MS / 1000)
+    yield _chunk(completion_id, model, usage={
+        "prompt_tokens": len(text),
+        "completion_tokens": int(REPLY_SECONDS * 25),
+        "total_tokens": len(text) + int(REPLY_SECONDS * 25),
+    })
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+@app.post("/compatible-mode/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages") or [{}]
+    content = messages[-1].get("content") or ""
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return StreamingResponse(_stream(content, body.get("model", "qwen-omni-turbo")),
+                             media_type="text/event-stream")
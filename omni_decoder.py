@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+qwen-omni 流式响应解码
+逐块解析 chat.completions 的流式响应：base64 音频按4字节边界增量解码，
+写入按需扩容的预分配缓冲区，或直接交给回调（播放、发送、流式 WAV 写入）；
+音频转写、文本回复和用量分别记录。回复音频超过大小上限或总耗时超过上限时抛出 OmniResponseError。
+
+    decoder = OmniDecoder()
+    for chunk in completion:
+        for kind, value in decoder.feed(chunk):
+            ...  # ("audio", PCM字节) / ("transcript", 文本) / ("text", 文本) / ("usage", 用量)
+    decoder.finish()
+    audio_np = decoder.samples()
+"""
+
+import os
+import time
+import wave
+import base64
+import logging
+import binascii
+import numpy as np
+
+logger = logging.getLogger("OmniDecoder")
+
+OMNI_MAX_AUDIO_MB = int(os.getenv("OMNI_MAX_AUDIO_MB", "32"))  # 单次回复解码后音频的大小上限
+OMNI_TIMEOUT = float(os.getenv("OMNI_TIMEOUT", "120"))  # 单次回复从开始到结束的最长时间（秒）
+
+SAMPLE_RATE = 24000
+INITIAL_CAPACITY = SAMPLE_RATE * 2 * 10  # 缓冲区初始容量：10秒 24kHz 16位音频
+
+
+class OmniResponseError(Exception):
+    """回复超过大小或时间上限"""
+
+
+def _field(value, name):
+    """delta.audio 可能是字典，也可能是带属性的对象"""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+class PCMBuffer:
+    """预分配的字节缓冲区，容量不足时翻倍扩容，总复制量与数据长度成线性关系"""
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self._buffer = bytearray(capacity)
+        self.size = 0
+
+    def write(self, data):
+        end = self.size + len(data)
+        if end > len(self._buffer):
+            self._buffer.extend(bytes(max(end, len(self._buffer) * 2) - len(self._buffer)))
+        self._buffer[self.size:end] = data
+        self.size = end
+
+    def getvalue(self):
+        """已写入的内容（复制为 bytes）"""
+        return bytes(memoryview(self._buffer)[:self.size])
+
+    def samples(self):
+        """已写入内容的 int16 视图（不复制，之后不能再写入）"""
+        return np.frombuffer(self._buffer, dtype=np.int16, count=self.size // 2)
+
+
+class WavStreamWriter:
+    """边接收边写入 WAV 文件，关闭时回填文件头中的长度"""
+
+    def __init__(self, path, rate=SAMPLE_RATE):
+        self.path = path
+        self._wav = wave.open(path, "wb")
+        self._wav.setnchannels(1)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(rate)
+
+    def write(self, pcm):
+        self._wav.writeframes(pcm)
+
+    def close(self):
+        self._wav.close()
+
+
+class OmniDecoder:
+    """增量解码一次流式回复
+
+    - feed(chunk) 处理一个数据块，返回其中的事件列表；音频事件为凑满整采样点的 PCM 字节
+    - on_audio 不为空时每段 PCM 到达即回调；keep_audio 为真时同时保存在缓冲区中（默认在没有回调时保存）
+    - timings 为字典时记录 first_chunk / first_audio / done 的 time.monotonic() 时间点
+    - 解码后的音频超过 max_bytes 或从创建起超过 timeout 秒时抛出 OmniResponseError；
+      数据块之间的等待由 HTTP 客户端的读取超时限制
+    """
+
+    def __init__(self, on_audio=None, keep_audio=None, timings=None,
+                 max_bytes=OMNI_MAX_AUDIO_MB * 1024 * 1024, timeout=OMNI_TIMEOUT):
+        self.on_audio = on_audio
+        self.buffer = PCMBuffer() if (on_audio is None if keep_audio is None else keep_audio) else None
+        self.timings = timings if timings is not None else {}
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self.audio_bytes = 0
+        self.usage = None
+        self._transcript = []
+        self._text = []
+        self._base64_carry = ""  # 不足4个字符的 base64 尾部
+        self._pcm_carry = b""  # 不足一个采样点的字节
+
+    @property
+    def transcript(self):
+        return "".join(self._transcript)
+
+    @property
+    def text(self):
+        return "".join(self._text)
+
+    def feed(self, chunk):
+        """处理一个流式数据块，返回 [(类型, 值)]"""
+        now = time.monotonic()
+        if now - self.started > self.timeout:
+            raise OmniResponseError(f"回复超过 {self.timeout:.0f}秒 仍未结束")
+        self.timings.setdefault("first_chunk", now)
+        events = []
+        if not chunk.choices:
+            if getattr(chunk, "usage", None):
+                self.usage = chunk.usage
+                events.append(("usage", chunk.usage))
+            return events
+        delta = chunk.choices[0].delta
+        if delta is None:
+            return events
+        audio = getattr(delta, "audio", None)
+        data = _field(audio, "data")
+        if data:
+            self.timings.setdefault("first_audio", now)
+            pcm = self._decode(data)
+            if pcm:
+                events.append(("audio", pcm))
+        transcript = _field(audio, "transcript")
+        if transcript:
+            self._transcript.append(transcript)
+            events.append(("transcript", transcript))
+        content = getattr(delta, "content", None)
+        if content:
+            self._text.append(content)
+            events.append(("text", content))
+        return events
+
+    def _decode(self, data):
+        """解码一段 base64，返回凑满整采样点的 PCM 字节"""
+        data = self._base64_carry + data
+        usable = len(data) - len(data) % 4
+        self._base64_carry = data[usable:]
+        if not usable:
+            return b""
+        pcm = self._pcm_carry + base64.b64decode(data[:usable])
+        usable = len(pcm) - len(pcm) % 2
+        self._pcm_carry = pcm[usable:]
+        return self._emit(pcm[:usable])
+
+    def _emit(self, pcm):
+        if not pcm:
+            return pcm
+        self.audio_bytes += len(pcm)
+        if self.audio_bytes > self.max_bytes:
+            raise OmniResponseError(f"回复音频超过上限({self.max_bytes // (1024 * 1024)}MB)")
+        if self.buffer is not None:
+            self.buffer.write(pcm)
+        if self.on_audio is not None:
+            self.on_audio(pcm)
+        return pcm
+
+    def finish(self):
+        """流结束：处理剩余的不完整数据并记录结束时间"""
+        if self._base64_carry:
+            try:
+                pcm = self._pcm_carry + base64.b64decode(self._base64_carry + "=" * (-len(self._base64_carry) % 4))
+                usable = len(pcm) - len(pcm) % 2
+                self._pcm_carry = pcm[usable:]
+                self._emit(pcm[:usable])
+            except (binascii.Error, ValueError):
+                logger.warning(f"丢弃不完整的 base64 尾部: {len(self._base64_carry)} 个字符")
+            self._base64_carry = ""
+        if self._pcm_carry:
+            logger.warning("丢弃不完整的采样点")
+            self._pcm_carry = b""
+        self.timings["done"] = time.monotonic()
+
+    def audio(self):
+        """缓冲区中的全部音频（bytes）"""
+        return self.buffer.getvalue() if self.buffer is not None else b""
+
+    def samples(self):
+        """缓冲区中的全部音频（int16 数组，不复制）"""
+        return self.buffer.samples() if self.buffer is not None else np.zeros(0, dtype=np.int16)
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+多会话语音对话服务
+一个进程同时服务多个音频终端（每个房间一个连接），各会话有独立的语音检测、录音切分和对话计数，
+识别共用一个识别任务池（一份模型，可合并并发的短音频批量推理），LLM 共用一个客户端连接池；
+两者都经过准入控制（admission.py），按会话轮转放行，一个会话说个不停也不会挡住其他会话。
+
+协议（Unix 套接字或 TCP，一个连接一个会话）:
+    客户端先发送一行 JSON 头，如 {"session": "room-1", "realtime": true}，之后持续发送 16kHz 16位单声道原始PCM；
+    服务端回复一行 JSON 头 {"session": ..., "rate": 24000}，之后在同一连接上发送 24kHz 16位单声道的回复音频。
+    realtime 为真（默认）表示麦克风实时输入，回复按实时节奏发送并支持插话打断；
+    为假时按文件回放处理，不丢弃任何一轮，客户端关闭写入端后服务端播放完剩余回复再断开。
+
+各会话和汇总的延迟统计在 http://127.0.0.1:SESSION_METRICS_PORT/sessions 提供（JSON），指标在 /metrics
+"""
+
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+import threading
+import socketserver
+from collections import deque
+import numpy as np
+from audio_io import RawPCMSource, RawPCMSink
+from asr_model import ASR_LOAD_MODE, ASR_SERVER_SOCKET, load_model
+from asr_pool import ASRWorkerPool
+from admission import AdmissionController, AdmissionRejected, PRIORITY_HIGH, PRIORITY_NORMAL
+from metrics import gauge, start_http_server
+from vad import EchoGate
+from shell_service import (
+    RATE, PLAYBACK_RATE, STREAM_PLAYBACK, BARGE_IN, ECHO_GATE_RATIO, ECHO_TAIL_MS, SHELL_POLICY, PARTIAL_POLICY,
+    AudioRecorder, AudioPlayer, StreamingAudioPlayer, PipelineServices, VoicePipeline, get_llm_response,
+)
+
+logger = logging.getLogger("SessionServer")
+
+SESSION_LISTEN = os.getenv("SESSION_LISTEN", "tcp:127.0.0.1:9200")  # unix:<套接字> 或 tcp:<地址>:<端口>
+SESSION_MAX = int(os.getenv("SESSION_MAX", "32"))  # 同时连接的会话上限，超出时拒绝新连接
+SESSION_METRICS_PORT = int(os.getenv("SESSION_METRICS_PORT", "9109"))  # /metrics 和 /sessions，0 表示不提供
+SESSION_ASR_REPLICAS = int(os.getenv("SESSION_ASR_REPLICAS", "1"))  # 识别模型副本数
+SESSION_ASR_BATCH = int(os.getenv("SESSION_ASR_BATCH", "4"))  # 大于1时合并各会话并发的短音频批量推理
+SESSION_ASR_BATCH_WINDOW_MS = int(os.getenv("SESSION_ASR_BATCH_WINDOW_MS", "20"))  # 凑批等待时间
+SESSION_ASR_MAX_WAIT = float(os.getenv("SESSION_ASR_MAX_WAIT", "5"))  # 识别最长排队时间（秒），超过时放弃这次识别
+SESSION_LLM_CONCURRENCY = int(os.getenv("SESSION_LLM_CONCURRENCY", "8"))  # 同时进行的上游LLM请求数
+SESSION_LLM_MAX_WAIT = float(os.getenv("SESSION_LLM_MAX_WAIT", "10"))  # LLM请求最长排队时间（秒）
+
+LATENCY_WINDOW = 1000  # 每项延迟统计保留的最近样本数
+
+ACTIVE_SESSIONS = gauge("diyvoice_sessions", "已连接的会话数")
+
+
+class LatencyStats:
+    """最近若干次耗时的平均值和分位数（线程安全）"""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def observe(self, seconds):
+        with self._lock:
+            self._values.append(seconds)
+            self.count += 1
+
+    def summary(self):
+        with self._lock:
+            values = np.array(self._values)
+        if not len(values):
+            return {"count": self.count}
+        return {
+            "count": self.count,
+            "avg": round(float(values.mean()), 3),
+            "p50": round(float(np.percentile(values, 50)), 3),
+            "p95": round(float(np.percentile(values, 95)), 3),
+            "p99": round(float(np.percentile(values, 99)), 3),
+            "max": round(float(values.max()), 3),
+        }
+
+
+# 各会话和汇总统计的延迟项
+LATENCY_KINDS = (
+    "asr",  # 最终识别耗时（含排队）
+    "llm_first_audio",  # 发出LLM请求到收到首个音频（含排队）
+    "response",  # 录音结束到回复首个音频就绪
+)
+
+
+class _FairGate:
+    """在工作线程中使用的准入控制
+
+    AdmissionController 运行在服务器的事件循环线程中，会话线程阻塞等待放行，
+    排队的调用按会话轮转出队；被拒绝时抛出 AdmissionRejected
+    """
+
+    def __init__(self, controller, loop):
+        self.controller = controller
+        self.loop = loop
+
+    def call(self, client, priority, fn, *args, **kwargs):
+        asyncio.run_coroutine_threadsafe(self.controller.acquire(client, priority), self.loop).result()
+        started = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.loop.call_soon_threadsafe(self.controller.release, started)
+
+
+class SessionServices(PipelineServices):
+    """一个会话使用的识别和LLM接口：经过公平调度的共享资源，并记录本会话的延迟"""
+
+    def __init__(self, server, session):
+        self.server = server
+        self.session = session
+
+    def _observe(self, kind, seconds):
+        self.session.latency[kind].observe(seconds)
+        self.server.latency[kind].observe(seconds)
+
+    def _transcribe(self, priority, audio, **options):
+        return self.server.asr_gate.call(
+            self.session.name, priority, lambda: self.server.asr_pool.submit(audio, **options).result()
+        )
+
+    def transcribe(self, audio):
+        started = time.monotonic()
+        try:
+            text = self._transcribe(PRIORITY_HIGH, audio)
+        except AdmissionRejected as e:
+            logger.warning(f"[{self.session.name}] 识别排队过久，放弃本轮({e.reason})")
+            return ""
+        except Exception as e:
+            logger.error(f"[{self.session.name}] 音频识别出错: {str(e)}")
+            return ""
+        self._observe("asr", time.monotonic() - started)
+        logger.info(f"[{self.session.name}] 识别结果: {text}")
+        return text
+
+    def transcribe_segments(self, audio, initial_prompt=None, policy=SHELL_POLICY):
+        # 中间结果可以跳过，排在最终识别之后
+        final = policy is not PARTIAL_POLICY
+        started = time.monotonic()
+        segments = self._transcribe(PRIORITY_HIGH if final else PRIORITY_NORMAL, audio, return_segments=True,
+                                    policy=policy, initial_prompt=initial_prompt)
+        if final:
+            self._observe("asr", time.monotonic() - started)
+        return segments
+
+    def _respond(self, priority, text, on_audio=None, cancel_event=None):
+        timings = {}
+        started = time.monotonic()
+        try:
+            result = self.server.llm_gate.call(
+                self.session.name, priority, get_llm_response, text, on_audio=on_audio, timings=timings,
+                cancel_event=cancel_event,
+            )
+        except AdmissionRejected as e:
+            logger.warning(f"[{self.session.name}] LLM请求排队过久，放弃本轮({e.reason})")
+            return None
+        if "first_audio" in timings:
+            self._observe("llm_first_audio", timings["first_audio"] - started)
+        return result
+
+    def respond(self, text, on_audio=None, cancel_event=None):
+        return self._respond(PRIORITY_HIGH, text, on_audio, cancel_event)
+
+    def speculate(self, text, on_audio, cancel_event):
+        # 推测请求可能作废，排在确定的请求之后
+        return self._respond(PRIORITY_NORMAL, text, on_audio, cancel_event)
+
+    def observe_response(self, seconds):
+        self._observe("response", seconds)
+
+
+class Session:
+    """一个连接对应的对话会话：独立的录音器、播放器和流水线"""
+
+    def __init__(self, server, conn, name, realtime):
+        self.server = server
+        self.conn = conn
+        self.name = name
+        self.realtime = realtime
+        self.started = time.monotonic()
+        self.latency = {kind: LatencyStats() for kind in LATENCY_KINDS}
+        self.pipeline = None
+
+    def run(self):
+        """运行到客户端断开或服务器停止"""
+        source = RawPCMSource(self.conn.makefile("rb"), rate=RATE)
+        source.realtime = self.realtime
+        sink = RawPCMSink(self.conn.makefile("wb"), speed=1.0 if self.realtime else 0.0)
+        recorder = AudioRecorder(source)
+        if BARGE_IN and self.realtime:
+            recorder.echo_gate = EchoGate(ECHO_GATE_RATIO, ECHO_TAIL_MS / 1000)
+        player = AudioPlayer(sink, recorder.echo_gate)
+        stream_player = None
+        if STREAM_PLAYBACK:
+            stream_player = StreamingAudioPlayer(sink=sink, echo_gate=recorder.echo_gate)
+            stream_player.start()
+        self.pipeline = VoicePipeline(recorder, player, stream_player, services=SessionServices(self.server, self))
+        try:
+            self.pipeline.start()
+            while (self.pipeline.is_alive() and not self.server.stopping.is_set()
+                   and not self.pipeline.finished.wait(1.0)):
+                pass
+        finally:
+            self.pipeline.stop()
+            recorder.close()
+            player.close()
+            if stream_player:
+                stream_player.close()
+
+    def stats(self):
+        pipeline = self.pipeline
+        stats = {
+            "session": self.name,
+            "realtime": self.realtime,
+            "seconds": round(time.monotonic() - self.started, 1),
+            "latency": {kind: latency.summary() for kind, latency in self.latency.items()},
+        }
+        if pipeline:
+            stats.update(
+                turns=pipeline.conversation_count,
+                recording=pipeline.recorder.is_recording,
+                barge_ins=pipeline.barge_ins,
+                dropped=dict(pipeline.dropped),
+                speculations=dict(pipeline.speculations),
+            )
+        return stats
+
+
+class SessionServer:
+    """多会话服务：监听连接，为每个连接创建会话，管理共享的识别池和LLM并发"""
+
+    def __init__(self, listen=SESSION_LISTEN, max_sessions=SESSION_MAX):
+        self.listen = listen
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.total_sessions = 0
+        self.rejected_sessions = 0
+        self.latency = {kind: LatencyStats() for kind in LATENCY_KINDS}
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._server = None
+        # 准入控制在专用的事件循环线程中运行
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="SessionScheduler", daemon=True).start()
+        self.asr_pool = ASRWorkerPool(
+            load_model,
+            replicas=SESSION_ASR_REPLICAS,
+            max_queue=max(SESSION_ASR_REPLICAS * SESSION_ASR_BATCH * 2, 32),
+            # 使用识别模型服务时由服务端合并推理，本地不再凑批
+            batch_size=1 if ASR_SERVER_SOCKET else SESSION_ASR_BATCH,
+            batch_window=SESSION_ASR_BATCH_WINDOW_MS / 1000,
+            transcribe_options={"policy": SHELL_POLICY},
+            service="session",
+        )
+        self.asr_admission = AdmissionController("session-asr", SESSION_ASR_REPLICAS * max(SESSION_ASR_BATCH, 1),
+                                                 max_queue=max_sessions * 2, max_wait=SESSION_ASR_MAX_WAIT,
+                                                 per_client_queue=2, initial_service_time=0.5)
+        self.llm_admission = AdmissionController("session-llm", SESSION_LLM_CONCURRENCY, max_queue=max_sessions * 2,
+                                                 max_wait=SESSION_LLM_MAX_WAIT, per_client_queue=2,
+                                                 initial_service_time=3.0)
+        self.asr_gate = _FairGate(self.asr_admission, self.loop)
+        self.llm_gate = _FairGate(self.llm_admission, self.loop)
+        ACTIVE_SESSIONS.set_function(lambda: len(self.sessions))
+
+    def _bind(self):
+        kind, _, target = self.listen.partition(":")
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                server.handle(self.request)
+
+        if kind == "unix":
+            if os.path.exists(target):
+                os.remove(target)
+            tcp = socketserver.ThreadingUnixStreamServer(target, Handler)
+        elif kind == "tcp":
+            host, _, port = target.rpartition(":")
+            tcp = socketserver.ThreadingTCPServer((host or "127.0.0.1", int(port)), Handler)
+        else:
+            raise ValueError(f"未知的监听地址: {self.listen}")
+        tcp.daemon_threads = True
+        return tcp
+
+    def start(self):
+        """启动识别池（按 ASR_LOAD_MODE 加载模型）并开始监听"""
+        if ASR_LOAD_MODE != "lazy":
+            self.asr_pool.start()
+            if ASR_LOAD_MODE == "eager":
+                self.asr_pool.wait_ready()
+        socketserver.TCPServer.allow_reuse_address = True
+        self._server = self._bind()
+        threading.Thread(target=self._server.serve_forever, name="SessionListener", daemon=True).start()
+        logger.info(f"多会话服务已启动: {self.listen}（最多 {self.max_sessions} 个会话）")
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        with self._lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            try:
+                session.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.asr_pool.shutdown()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.listen.startswith("unix:") and os.path.exists(self.listen[5:]):
+            os.remove(self.listen[5:])
+        logger.info("多会话服务已停止")
+
+    def _read_header(self, conn):
+        """读取客户端的 JSON 头（一行）"""
+        data = b""
+        while not data.endswith(b"\n"):
+            byte = conn.recv(1)
+            if not byte:
+                raise ConnectionError("连接在会话头之前关闭")
+            data += byte
+            if len(data) > 4096:
+                raise ValueError("会话头过长")
+        header = json.loads(data.decode("utf-8").strip() or "{}")
+        if not isinstance(header, dict):
+            raise ValueError("会话头必须是 JSON 对象")
+        return header
+
+    def handle(self, conn):
+        """处理一个连接，直到会话结束"""
+        try:
+            header = self._read_header(conn)
+        except (OSError, ValueError) as e:
+            logger.warning(f"无效的会话连接: {str(e)}")
+            return
+        with self._lock:
+            self.total_sessions += 1
+            name = str(header.get("session") or f"session-{self.total_sessions}")
+            if name in self.sessions:
+                name = f"{name}-{self.total_sessions}"
+            if len(self.sessions) >= self.max_sessions or self.stopping.is_set():
+                self.rejected_sessions += 1
+                session = None
+            else:
+                session = Session(self, conn, name, bool(header.get("realtime", True)))
+                self.sessions[name] = session
+        if session is None:
+            logger.warning(f"会话数已达上限({self.max_sessions})，拒绝 {name}")
+            conn.sendall(json.dumps({"error": "too many sessions"}).encode("utf-8") + b"\n")
+            return
+        conn.sendall(json.dumps({"session": name, "rate": PLAYBACK_RATE}).encode("utf-8") + b"\n")
+        logger.info(f"[{name}] 会话开始(realtime={session.realtime})")
+        try:
+            session.run()
+        except Exception as e:
+            logger.error(f"[{name}] 会话出错: {str(e)}")
+        finally:
+            with self._lock:
+                del self.sessions[name]
+            logger.info(f"[{name}] 会话结束: {session.stats()}")
+
+    def stats(self):
+        """各会话和汇总的统计"""
+        with self._lock:
+            sessions = list(self.sessions.values())
+        return {
+            "active_sessions": len(sessions),
+            "total_sessions": self.total_sessions,
+            "rejected_sessions": self.rejected_sessions,
+            "latency": {kind: latency.summary() for kind, latency in self.latency.items()},
+            "asr_pool": self.asr_pool.stats(),
+            "admission": [self.asr_admission.stats(), self.llm_admission.stats()],
+            "sessions": [session.stats() for session in sessions],
+        }
+
+
+def main():
+    server = SessionServer()
+    if SESSION_METRICS_PORT:
+        try:
+            start_http_server(SESSION_METRICS_PORT, routes={"/sessions": server.stats})
+            logger.info(f"会话统计已在 http://127.0.0.1:{SESSION_METRICS_PORT}/sessions 提供")
+        except OSError as e:
+            logger.error(f"启动指标服务出错: {str(e)}")
+    server.start()
+    try:
+        logger.info("按Ctrl+C退出程序")
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        logger.info("接收到退出信号")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,20 +3,33 @@
 
 """
 语音识别后端服务
-监听设备麦克风，识别语音，调用LLM获取响应，并通过设备播放器播放
+监听设备麦克风，识别语音，调用LLM获取响应，并通过设备播放器播放；
+也可以从文件回放输入、把回复写入文件或丢弃（AUDIO_SOURCE / AUDIO_SINK）
 """
 
 import os
 import time
 import wave
+import queue
+import threading
 import numpy as np
-import pyaudio
 import soundfile as sf
-import base64
 from datetime import datetime
-from faster_whisper import WhisperModel
 from openai import OpenAI
 import logging
+from vad import create_vad, EchoGate
+from audio_io import create_source, create_sink
+from asr_model import ModelHandle
+from asr_cascade import ASR_CASCADE, cascade_stats
+from decoding_policy import entry_policy, normalize_transcript
+from metrics import (
+    VAD_TRIGGERS, RECORDING_SECONDS, LLM_ERRORS, PLAYBACK_UNDERRUNS, CONVERSATION_TURNS, PIPELINE_DROPPED, BARGE_INS,
+    CAPTURE_XRUNS, CAPTURE_RESTARTS, IDLE_CPU_RATIO, LLM_SPECULATIONS, LLM_SPECULATION_LEAD_SECONDS, RESPONSE_SECONDS,
+    observe_asr, observe_llm, start_http_server,
+)
+from streaming_asr import IncrementalTranscriber
+from omni_decoder import OmniDecoder, OmniResponseError
+from tts_cache import TTSCache, cache_key, TTS_MODEL, TTS_VOICE, TTS_FORMAT
 
 # 目录设置
 TEMP_DIR = "temp_audio"
@@ -49,111 +62,249 @@ logger = logging.getLogger("ShellService")
 
 # 音频参数
 CHUNK = 1024
-FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000
-SILENCE_THRESHOLD = 1000  # 静音阈值
+SILENCE_THRESHOLD = 1000  # 静音阈值（energy 引擎使用）
+VAD_ENGINE = "adaptive"  # 语音检测引擎：energy（固定阈值）/ adaptive（自适应噪声底）
+VAD_OPTIONS = {
+    "energy": {"threshold": SILENCE_THRESHOLD},
+    "adaptive": {"use_spectral": False},
+}
 SILENCE_DURATION = 2  # 静音持续时间（秒）
 MAX_RECORD_DURATION = 20  # 最大录音时间（秒）
+PRE_ROLL_DURATION = 0.3  # 触发录音前保留的预录时长（秒），避免截掉首字
+TRIM_FRAME_MS = 20  # 首尾静音裁剪的分析帧长（毫秒）
+TRIM_THRESHOLD_RATIO = 0.5  # 裁剪阈值相对VAD阈值的比例，略低于触发阈值以保留弱辅音
+TRIM_MARGIN = 0.2  # 裁剪后首尾保留的静音余量（秒）
+DEBUG_SAVE_AUDIO = False  # 调试用：同时把每段录音保存为WAV文件
+
+# 音频输入输出，默认麦克风和扬声器，其余写法见 audio_io.py
+AUDIO_SOURCE = os.getenv("AUDIO_SOURCE", "pyaudio")  # pyaudio / pyaudio:callback / wav:<文件> / dir:<目录> / stdin / raw:<文件> / unix:<套接字>
+AUDIO_SINK = os.getenv("AUDIO_SINK", "pyaudio")  # pyaudio / wav:<文件> / stdout / raw:<文件> / unix:<套接字> / null
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "0"))  # 文件输入和 null 输出的速度倍数，1 为实时，0 为尽可能快
+
+# 指标：在本地端口提供 Prometheus 格式的 /metrics，0 表示不启动
+METRICS_PORT = int(os.getenv("SHELL_METRICS_PORT", "9108"))
+
+# 流式播放参数
+STREAM_PLAYBACK = True  # 是否边接收LLM音频边播放
+PLAYBACK_RATE = 24000  # LLM返回音频的采样率
+PREBUFFER_MS = 300  # 开始播放前的预缓冲时长（毫秒）
+JITTER_BUFFER_CHUNKS = 64  # 抖动缓冲区最多容纳的音频片段数
+PLAYBACK_CHUNK_MS = 40  # 每次写入输出端的时长（毫秒），播放可在两次写入之间中止
+
+# 插话打断：播放回复时继续监听，用户开口即停止当前回复并开始新一轮（仅麦克风输入）
+BARGE_IN = True
+ECHO_GATE_RATIO = 0.5  # 播放期间麦克风能量需超过播放能量的该倍数才算用户说话，扬声器声音大或离麦克风近时调高
+ECHO_TAIL_MS = 300  # 停止播放后回声门限的保持时间（毫秒），覆盖输出延迟和房间混响
+
+# TTS缓存：相同文本的回复直接使用缓存音频，跳过LLM请求
+TTS_CACHE_ENABLED = True
+
+# 增量识别参数
+INCREMENTAL_ASR = True  # 录音过程中后台增量识别，录音结束时只解码剩余部分
+INCREMENTAL_INTERVAL = 0.5  # 后台解码间隔（秒）
 
-# 加载 Whisper 模型
-logger.info("正在加载语音识别模型...")
-model = WhisperModel("medium", device="cpu", compute_type="int8")
-logger.info("语音识别模型加载完成")
+# 推测请求：录音中短暂停顿且部分识别结果稳定时提前请求LLM，最终识别结果一致才播放（需要增量识别）
+SPECULATIVE_LLM = os.getenv("SPECULATIVE_LLM", "0") == "1"
+SPECULATE_PAUSE = float(os.getenv("SPECULATE_PAUSE", "0.5"))  # 触发推测请求的静音时长（秒），应明显短于 SILENCE_DURATION
 
-# 阿里云百炼API客户端
+# 流水线队列参数
+UTTERANCE_QUEUE_SIZE = 4  # 待识别录音队列长度，满时丢弃最旧的录音
+TEXT_QUEUE_SIZE = 4  # 待发送LLM的文本队列长度，满时丢弃最旧的文本
+REPLY_QUEUE_SIZE = 2  # 待播放回复队列长度，满时LLM阶段阻塞等待（反压）
+
+# Whisper 模型在 main() 中按 ASR_LOAD_MODE 加载（默认后台加载），
+# 规格由 WHISPER_MODEL_SIZE 等环境变量配置，设置 ASR_SERVER_SOCKET 时使用共享的识别模型服务
+model = ModelHandle()
+
+# 解码策略：最终结果用 ASR_POLICY_SHELL，增量识别的中间结果用 ASR_POLICY_PARTIAL（见 decoding_policy.py）
+SHELL_POLICY = entry_policy("shell")
+PARTIAL_POLICY = entry_policy("partial")
+
+# 阿里云百炼API客户端，DASHSCOPE_BASE_URL 可指向 mock_dashscope.py 做基准测试
 client = OpenAI(
     api_key=os.getenv("DASHSCOPE_API_KEY"),
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+    base_url=os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
 )
 
+tts_cache = TTSCache() if TTS_CACHE_ENABLED else None
+
+class AudioRingBuffer:
+    """预分配的 int16 环形缓冲区
+
+    容量固定，写满后覆盖最旧的数据；未回绕时 view() 直接返回底层数组切片，不产生拷贝。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.write_pos = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        """清空缓冲区（不释放内存）"""
+        self.write_pos = 0
+        self.size = 0
+
+    def write(self, samples):
+        """写入采样点"""
+        n = len(samples)
+        if n >= self.capacity:
+            self.buffer[:] = samples[-self.capacity:]
+            self.write_pos = 0
+            self.size = self.capacity
+            return
+        end = self.write_pos + n
+        if end <= self.capacity:
+            self.buffer[self.write_pos:end] = samples
+        else:
+            first = self.capacity - self.write_pos
+            self.buffer[self.write_pos:] = samples[:first]
+            self.buffer[:n - first] = samples[first:]
+        self.write_pos = end % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def view(self):
+        """按时间顺序返回缓冲区内容，未回绕时为零拷贝视图"""
+        start = (self.write_pos - self.size) % self.capacity
+        if start + self.size <= self.capacity:
+            return self.buffer[start:start + self.size]
+        return np.concatenate((self.buffer[start:], self.buffer[:self.write_pos]))
+
+
+def int16_to_float32(samples):
+    """把 int16 采样转换为 Whisper 需要的 [-1, 1] float32 数组"""
+    audio = samples.astype(np.float32)
+    audio *= 1.0 / 32768.0
+    return audio
+
+
+def speech_bounds(samples, threshold, rate=RATE, frame_ms=TRIM_FRAME_MS, margin=TRIM_MARGIN):
+    """按帧向量化计算能量，返回去掉首尾低能量区域后的 (起点, 终点)，两端各保留 margin 秒余量
+
+    整段都低于阈值时返回整段范围。
+    """
+    frame_len = int(rate * frame_ms / 1000)
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return 0, len(samples)
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len)
+    energy = np.abs(frames, dtype=np.float32).mean(axis=1)
+    voiced = np.flatnonzero(energy > threshold)
+    if len(voiced) == 0:
+        return 0, len(samples)
+    margin_samples = int(rate * margin)
+    start = max(voiced[0] * frame_len - margin_samples, 0)
+    end = min((voiced[-1] + 1) * frame_len + margin_samples, len(samples))
+    return start, end
+
+
 class AudioRecorder:
-    """音频录制器"""
+    """音频录制器
+
+    录音计时使用采样时钟（已读取的采样数），从文件回放时与实际时间无关，
+    同一段输入无论回放速度如何都得到相同的录音切分。
+    """
     
-    def __init__(self):
-        self.p = pyaudio.PyAudio()
-        self.stream = None
-        self.frames = []
+    def __init__(self, source=None):
+        self.source = source or create_source(AUDIO_SOURCE, RATE, CHUNK, REPLAY_SPEED, gap=SILENCE_DURATION + 1)
+        self.source.open()
+        self.clock = 0  # 已读取的采样数
+        self.exhausted = False  # 输入是否已结束（只有文件等有限输入会结束）
+        self.vad = create_vad(VAD_ENGINE, rate=RATE, **VAD_OPTIONS.get(VAD_ENGINE, {}))
+        # 录音直接写入预分配缓冲区，多留预录和一个CHUNK的余量
+        self.pre_roll = AudioRingBuffer(int(RATE * PRE_ROLL_DURATION))
+        self.samples = AudioRingBuffer(RATE * MAX_RECORD_DURATION + len(self.pre_roll.buffer) + CHUNK)
         self.is_recording = False
         self.silence_start_time = None
         self.record_start_time = None
-        self.last_recording_time = 0  # 上次录音结束时间
+        self.last_recording_time = -1.0  # 上次录音结束时间
+        self.last_bounds = (0, 0)  # 上一段录音裁剪后在原始录音中的范围
+        self.echo_gate = None  # 播放期间的回声门限，见 EchoGate
+        # 未录音期间累计的进程CPU时间和实际时间，用于观察空闲功耗
+        self.idle_cpu = 0.0
+        self.idle_wall = 0.0
+        self._cpu_mark = None
+        # 录音开始和每写入一段录音时的回调，供增量识别使用
+        self.on_recording_start = None
+        self.on_recording_audio = None
     
-    def start_stream(self):
-        """开始音频流"""
-        try:
-            # 确保之前的流已关闭
-            if self.stream:
-                try:
-                    self.stream.stop_stream()
-                    self.stream.close()
-                except Exception:
-                    pass
-                self.stream = None
-            
-            # 创建新的音频流
-            self.stream = self.p.open(
-                format=FORMAT,
-                channels=CHANNELS,
-                rate=RATE,
-                input=True,
-                frames_per_buffer=CHUNK
-            )
-            logger.info("麦克风监听已启动")
-        except Exception as e:
-            logger.error(f"启动麦克风监听出错: {str(e)}")
-            # 尝试重新初始化PyAudio
-            try:
-                self.p.terminate()
-                time.sleep(0.5)
-                self.p = pyaudio.PyAudio()
-                self.stream = self.p.open(
-                    format=FORMAT,
-                    channels=CHANNELS,
-                    rate=RATE,
-                    input=True,
-                    frames_per_buffer=CHUNK
-                )
-                logger.info("麦克风监听已重新启动")
-            except Exception as e2:
-                logger.error(f"重新启动麦克风监听失败: {str(e2)}")
+    def _now(self):
+        """采样时钟（秒）"""
+        return self.clock / RATE
+    
+    @property
+    def idle_cpu_ratio(self):
+        """未录音期间进程的CPU占用（CPU秒/秒）"""
+        return self.idle_cpu / self.idle_wall if self.idle_wall else 0.0
+    
+    def silence_seconds(self):
+        """录音中当前这段静音已持续的时长（秒），没有录音或正在说话时为0"""
+        if not self.is_recording or self.silence_start_time is None:
+            return 0.0
+        return self._now() - self.silence_start_time
+    
+    def _account_cpu(self):
+        """累计上次读取以来的CPU时间，只统计未录音的时段"""
+        mark = (time.process_time(), time.monotonic())
+        if self._cpu_mark and not self.is_recording:
+            self.idle_cpu += mark[0] - self._cpu_mark[0]
+            self.idle_wall += mark[1] - self._cpu_mark[1]
+        self._cpu_mark = mark
     
     def start_recording(self):
         """开始录音"""
-        # 确保距离上次录音结束有足够的间隔
-        current_time = time.time()
-        if current_time - self.last_recording_time < 1.0:  # 至少1秒的间隔
-            logger.info(f"距离上次录音结束时间太短，等待...")
-            time.sleep(1.0)
-        
-        self.frames = []
+        self.samples.clear()
+        VAD_TRIGGERS.labels("shell").inc()
+        if self.on_recording_start:
+            self.on_recording_start()
+        # 先写入触发前的预录音频
+        self._record(self.pre_roll.view())
+        self.pre_roll.clear()
         self.is_recording = True
-        self.record_start_time = time.time()
+        self.record_start_time = self._now()
         self.silence_start_time = None
         logger.info("开始录音...")
     
     def stop_recording(self, reason=""):
         """停止录音"""
         self.is_recording = False
-        self.last_recording_time = time.time()  # 记录录音结束时间
+        self.last_recording_time = self._now()  # 记录录音结束时间
         logger.info(f"停止录音: {reason}")
-        return self.save_audio()
-    
-    def save_audio(self):
-        """保存录音为WAV文件"""
-        if not self.frames:
+        if not len(self.samples):
             logger.warning("没有录制到音频数据")
             return None
         
+        recorded = self.samples.view()
+        self.last_bounds = speech_bounds(recorded, self.vad.threshold * TRIM_THRESHOLD_RATIO)
+        samples = recorded[self.last_bounds[0]:self.last_bounds[1]]
+        RECORDING_SECONDS.labels("shell").observe(len(samples) / RATE)
+        logger.info(f"裁剪首尾静音: {len(recorded) / RATE:.2f}秒 -> {len(samples) / RATE:.2f}秒")
+        if DEBUG_SAVE_AUDIO:
+            self.save_audio(samples)
+        return int16_to_float32(samples)
+    
+    def _record(self, audio_data):
+        """写入录音缓冲区并通知回调"""
+        self.samples.write(audio_data)
+        if self.on_recording_audio:
+            self.on_recording_audio(audio_data)
+    
+    def save_audio(self, samples):
+        """保存录音为WAV文件（调试用）"""
         try:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"{TEMP_DIR}/recording_{timestamp}.wav"
             
             wf = wave.open(filename, 'wb')
             wf.setnchannels(CHANNELS)
-            wf.setsampwidth(self.p.get_sample_size(FORMAT))
+            wf.setsampwidth(2)  # 16位音频
             wf.setframerate(RATE)
-            wf.writeframes(b''.join(self.frames))
+            wf.writeframes(samples.tobytes())
             wf.close()
             
             logger.info(f"录音已保存: {filename}")
@@ -163,145 +314,294 @@ class AudioRecorder:
             return None
     
     def process_audio(self):
-        """处理音频流"""
-        if not self.stream or not self.stream.is_active():
-            self.start_stream()
-            # 给麦克风一点时间准备
-            time.sleep(0.1)
-        
+        """读取并处理一段输入音频，录音完成时返回录音
+
+        输入结束时结束正在进行的录音并把 exhausted 置为真
+        """
+        if self.exhausted:
+            return None
         try:
-            # 检查流是否可读
-            if not self.stream or not self.stream.is_active():
-                logger.warning("音频流不可用，重新启动...")
-                self.start_stream()
+            audio_data = self.source.read(CHUNK)
+            self._account_cpu()
+            if audio_data is None:
+                self.exhausted = True
+                logger.info("音频输入已结束")
+                if self.is_recording:
+                    return self.stop_recording("输入结束")
+                return None
+            if not len(audio_data):
                 return None
+            self.clock += len(audio_data)
+            is_speech = self.vad.is_speech(audio_data)
+            volume = self.vad.last_energy
             
-            try:
-                data = self.stream.read(CHUNK, exception_on_overflow=False)
-                audio_data = np.frombuffer(data, dtype=np.int16)
-                volume = np.abs(audio_data).mean()
-                
-                # 检测是否有声音
-                if volume > SILENCE_THRESHOLD:
-                    if not self.is_recording:
-                        # 确保距离上次录音有足够间隔
-                        if time.time() - self.last_recording_time < 1.0:
-                            return None
-                        self.start_recording()
-                        logger.info(f"检测到声音(音量: {volume:.2f})，开始录音...")
-                    self.frames.append(data)
-                    self.silence_start_time = None
-                elif self.is_recording:
-                    self.frames.append(data)
-                    
-                    # 检测静音
-                    if self.silence_start_time is None:
-                        self.silence_start_time = time.time()
-                    elif time.time() - self.silence_start_time > SILENCE_DURATION:
-                        return self.stop_recording("静音超过阈值")
-                    
-                    # 检测最大录音时间
-                    if time.time() - self.record_start_time > MAX_RECORD_DURATION:
-                        return self.stop_recording("达到最大录音时间")
+            # 检测是否有声音
+            if is_speech:
+                if not self.is_recording:
+                    # 确保距离上次录音结束至少1秒，并排除扬声器的回声
+                    if (self._now() - self.last_recording_time < 1.0
+                            or (self.echo_gate and self.echo_gate.is_echo(volume))):
+                        self.pre_roll.write(audio_data)
+                        return None
+                    self.start_recording()
+                    logger.info(f"检测到声音(音量: {volume:.2f})，开始录音...")
+                self._record(audio_data)
+                self.silence_start_time = None
+            elif self.is_recording:
+                self._record(audio_data)
                 
-                return None
-            except Exception as e:
-                logger.error(f"读取音频数据出错: {str(e)}")
-                # 尝试重新启动流
-                self.start_stream()
-                return None
+                # 检测静音
+                if self.silence_start_time is None:
+                    self.silence_start_time = self._now()
+                elif self._now() - self.silence_start_time > SILENCE_DURATION:
+                    return self.stop_recording("静音超过阈值")
+            else:
+                # 未录音时持续更新预录缓冲
+                self.pre_roll.write(audio_data)
+            
+            # 检测最大录音时间：每个数据块都检查，持续说话（或一直被判为语音的噪声）时也会切断，
+            # 并且在录音缓冲区回绕、丢掉开头之前切断
+            if self.is_recording and (self._now() - self.record_start_time >= MAX_RECORD_DURATION
+                                      or len(self.samples) + CHUNK > self.samples.capacity):
+                self.vad.reseed()
+                return self.stop_recording("达到最大录音时间")
+            
+            return None
         except Exception as e:
             logger.error(f"处理音频时出错: {str(e)}")
             # 重置状态
             self.is_recording = False
             self.silence_start_time = None
-            self.frames = []
-            # 尝试重新启动流
+            self.samples.clear()
             time.sleep(0.5)
-            self.start_stream()
             return None
     
     def close(self):
         """关闭资源"""
-        if self.stream:
-            self.stream.stop_stream()
-            self.stream.close()
-        self.p.terminate()
-        logger.info("音频资源已释放")
+        self.source.close()
+        logger.info(f"音频资源已释放(空闲CPU占用: {self.idle_cpu_ratio:.1%})")
+
+
+def write_interruptible(sink, samples, rate, cancelled, echo_gate=None):
+    """按 PLAYBACK_CHUNK_MS 分段写入输出端，每段之前检查 cancelled，返回已写入的采样数"""
+    piece = max(int(rate * PLAYBACK_CHUNK_MS / 1000), 1)
+    written = 0
+    while written < len(samples) and not cancelled.is_set():
+        block = samples[written:written + piece]
+        sink.write(block)
+        if echo_gate:
+            echo_gate.note_playback(block, rate)
+        written += len(block)
+    return written
 
 
 class AudioPlayer:
-    """音频播放器"""
+    """音频播放器，sink 为空时按 AUDIO_SINK 创建输出端
+
+    输出端常驻打开，音频分段写入，cancel() 可在播放中途停止；
+    同时只播放一段，后到的调用等待前一段结束。
+    """
     
-    def __init__(self):
-        self.p = pyaudio.PyAudio()
-        self.stream = None
+    def __init__(self, sink=None, echo_gate=None):
+        self._owns_sink = sink is None
+        self.sink = sink or create_sink(AUDIO_SINK, REPLAY_SPEED)
+        self.echo_gate = echo_gate
         self.is_playing = False
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
     
     def play_audio(self, audio_data, sample_rate=24000):
-        """播放音频数据"""
-        if self.is_playing:
-            logger.warning("已有音频正在播放，等待完成...")
-            return
-            
-        self.is_playing = True
-        try:
-            # 确保之前的流已关闭
-            if self.stream:
-                try:
-                    self.stream.stop_stream()
-                    self.stream.close()
-                except Exception:
-                    pass
-                self.stream = None
-            
-            # 创建新的音频流
-            self.stream = self.p.open(
-                format=self.p.get_format_from_width(2),  # 16位音频
-                channels=1,
-                rate=sample_rate,
-                output=True
-            )
-            
-            logger.info("开始播放音频...")
-            self.stream.write(audio_data.tobytes())
-            logger.info("音频播放完成")
-            
-            # 关闭流
-            self.stream.stop_stream()
-            self.stream.close()
-            self.stream = None
-        except Exception as e:
-            logger.error(f"播放音频时出错: {str(e)}")
-            if self.stream:
-                try:
-                    self.stream.stop_stream()
-                    self.stream.close()
-                except Exception:
-                    pass
-                self.stream = None
-        finally:
-            self.is_playing = False
-            logger.info("音频播放器已重置，准备下一次播放")
+        """播放音频数据，返回是否完整播放"""
+        with self._lock:
+            self._cancelled.clear()
+            self.is_playing = True
+            try:
+                self.sink.start(sample_rate)
+                logger.info("开始播放音频...")
+                written = write_interruptible(self.sink, audio_data, sample_rate, self._cancelled, self.echo_gate)
+                if written < len(audio_data):
+                    logger.info(f"播放已打断({written / sample_rate:.2f}/{len(audio_data) / sample_rate:.2f}秒)")
+                    return False
+                logger.info("音频播放完成")
+                return True
+            except Exception as e:
+                logger.error(f"播放音频时出错: {str(e)}")
+                return False
+            finally:
+                self.is_playing = False
+    
+    def cancel(self):
+        """停止正在播放的音频"""
+        self._cancelled.set()
+        if self.echo_gate:
+            self.echo_gate.cut()
     
     def close(self):
         """关闭资源"""
-        if self.stream:
+        if self._owns_sink:
+            self.sink.close()
+        logger.info("音频播放器资源已释放")
+
+
+class StreamingAudioPlayer:
+    """流式音频播放器
+
+    使用常驻输出流，LLM音频片段到达后经有界抖动缓冲区交给播放线程。
+    预缓冲达到阈值后才开始写入设备，缓冲区耗尽时记录欠载并重新预缓冲；
+    输出端写入立即完成（speed 为 0）时无法判断播放进度，不检测欠载。
+    音频分段写入，cancel() 后丢弃当前回复剩余的音频。
+    """
+
+    _END = object()  # 一段回复结束的标记
+
+    def __init__(self, sample_rate=PLAYBACK_RATE, prebuffer_ms=PREBUFFER_MS,
+                 max_chunks=JITTER_BUFFER_CHUNKS, sink=None, echo_gate=None):
+        self._owns_sink = sink is None
+        self.sink = sink or create_sink(AUDIO_SINK, REPLAY_SPEED)
+        self.echo_gate = echo_gate
+        self._cancelled = threading.Event()
+        self.sample_rate = sample_rate
+        self.prebuffer_samples = int(sample_rate * prebuffer_ms / 1000)
+        self.buffer = queue.Queue(maxsize=max_chunks)
+        self.underruns = 0
+        self.idle = threading.Event()
+        self.idle.set()
+        self._running = False
+        self._thread = None
+        self._drain_deadline = 0.0
+        self._reply_start_time = None
+        self._first_sound_logged = False
+
+    def start(self):
+        """打开常驻输出流并启动播放线程"""
+        if self._running:
+            return
+        self.sink.start(self.sample_rate)
+        self._running = True
+        self._thread = threading.Thread(target=self._playback_loop, name="StreamingPlayer", daemon=True)
+        self._thread.start()
+        logger.info(f"流式播放器已启动(预缓冲: {self.prebuffer_samples / self.sample_rate * 1000:.0f}ms)")
+
+    def begin_reply(self):
+        """开始接收一段新的回复"""
+        self.idle.clear()
+        self._cancelled.clear()
+        self._reply_start_time = time.monotonic()
+        self._first_sound_logged = False
+
+    def feed(self, audio_np):
+        """写入一个音频片段，缓冲区满时阻塞等待（反压到上游）"""
+        if audio_np is None or len(audio_np) == 0:
+            return
+        self.buffer.put(audio_np)
+
+    def end_reply(self):
+        """标记当前回复的音频已全部送达"""
+        self.buffer.put(self._END)
+
+    def cancel(self):
+        """停止当前回复，丢弃尚未播放的音频"""
+        self._cancelled.set()
+        if self.echo_gate:
+            self.echo_gate.cut()
+
+    def wait_done(self, timeout=None):
+        """等待当前回复播放完成"""
+        return self.idle.wait(timeout)
+
+    def _write(self, chunks):
+        """把若干片段写入输出流"""
+        data = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        if not self._first_sound_logged and self._reply_start_time is not None:
+            logger.info(f"首个音频延迟: {(time.monotonic() - self._reply_start_time) * 1000:.0f}ms")
+            self._first_sound_logged = True
+        written = write_interruptible(self.sink, data, self.sample_rate, self._cancelled, self.echo_gate)
+        now = time.monotonic()
+        duration = written / self.sample_rate / self.sink.speed if self.sink.speed else 0.0
+        self._drain_deadline = max(now, self._drain_deadline) + duration
+
+    def _playback_loop(self):
+        """播放线程：预缓冲、写入设备并检测欠载"""
+        pending = []
+        pending_samples = 0
+        playing = False
+        while self._running:
+            try:
+                item = self.buffer.get(timeout=0.02)
+            except queue.Empty:
+                if playing and self.sink.speed and time.monotonic() > self._drain_deadline:
+                    self.underruns += 1
+                    PLAYBACK_UNDERRUNS.labels("shell").inc()
+                    logger.warning(f"播放缓冲区欠载(累计 {self.underruns} 次)，重新预缓冲")
+                    playing = False
+                continue
+
             try:
-                self.stream.stop_stream()
-                self.stream.close()
+                if item is self._END:
+                    if self._cancelled.is_set():
+                        logger.info("流式音频播放已打断")
+                    else:
+                        if pending:
+                            self._write(pending)
+                        logger.info("流式音频播放完成")
+                    pending = []
+                    pending_samples = 0
+                    playing = False
+                    self.idle.set()
+                elif self._cancelled.is_set():
+                    # 已打断，丢弃本轮剩余的音频
+                    pending = []
+                    pending_samples = 0
+                    playing = False
+                elif playing:
+                    self._write([item])
+                else:
+                    pending.append(item)
+                    pending_samples += len(item)
+                    if pending_samples >= self.prebuffer_samples:
+                        self._write(pending)
+                        pending = []
+                        pending_samples = 0
+                        playing = True
             except Exception as e:
-                logger.error(f"关闭音频流时出错: {str(e)}")
-        self.p.terminate()
-        logger.info("音频播放器资源已释放")
+                logger.error(f"流式播放出错: {str(e)}")
+                pending = []
+                pending_samples = 0
+                playing = False
 
+    def close(self):
+        """关闭资源"""
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=1.0)
+        if self._owns_sink:
+            self.sink.close()
+        logger.info(f"流式播放器资源已释放(欠载 {self.underruns} 次)")
+
+
+def transcribe_segments(audio, initial_prompt=None, policy=SHELL_POLICY):
+    """转录音频并返回片段列表，供增量识别使用"""
+    started = time.monotonic()
+    segments, info = policy.transcribe(model, audio, initial_prompt)
+    observe_asr("shell", policy.name, time.monotonic() - started, len(audio) / RATE)
+    return segments
 
-def transcribe_audio(audio_file):
-    """使用Whisper模型转录音频"""
+
+def transcribe_audio(audio):
+    """使用Whisper模型转录音频
+
+    audio 可以是 16kHz float32 数组，也可以是音频文件路径
+    """
     try:
-        logger.info(f"正在识别音频: {audio_file}")
-        segments, info = model.transcribe(audio_file, language='zh', beam_size=5)
+        if isinstance(audio, np.ndarray):
+            logger.info(f"正在识别音频: {len(audio) / RATE:.2f}秒")
+        else:
+            logger.info(f"正在识别音频: {audio}")
+        started = time.monotonic()
+        segments, info = SHELL_POLICY.transcribe(model, audio)
         text = "".join(segment.text for segment in segments)
+        if isinstance(audio, np.ndarray):
+            observe_asr("shell", SHELL_POLICY.name, time.monotonic() - started, len(audio) / RATE)
         logger.info(f"识别结果: {text}")
         return text
     except Exception as e:
@@ -309,51 +609,79 @@ def transcribe_audio(audio_file):
         return ""
 
 
-def get_llm_response(text):
-    """获取LLM响应"""
+def get_llm_response(text, on_audio=None, timings=None, cancel_event=None):
+    """获取LLM响应
+
+    on_audio 为空时在流结束后返回完整的音频数组；
+    否则每个音频片段到达即解码并回调 on_audio，返回已接收的采样点数。
+    timings 为字典时记录 request / first_chunk / first_audio / done 的 time.monotonic() 时间点。
+    cancel_event 被置位后关闭响应流并返回 None，不写入缓存。
+    """
+    if timings is None:
+        timings = {}
     if not text.strip():
         return None
     
+    key = cache_key(text) if tts_cache else None
+    if key:
+        cached = tts_cache.get(key)
+        if cached is not None:
+            logger.info("TTS缓存命中，跳过LLM请求")
+            timings["request"] = timings["first_chunk"] = timings["first_audio"] = timings["done"] = time.monotonic()
+            audio_np = np.frombuffer(cached, dtype=np.int16)
+            if on_audio is not None:
+                on_audio(audio_np)
+                return len(audio_np)
+            return audio_np
+    
     try:
         logger.info(f"发送文本到LLM: {text}")
+        timings["request"] = time.monotonic()
         completion = client.chat.completions.create(
-            model="qwen-omni-turbo",
+            model=TTS_MODEL,
             messages=[{"role": "user", "content": text}],
             modalities=["text", "audio"],
-            audio={"voice": "Cherry", "format": "wav"},
+            audio={"voice": TTS_VOICE, "format": TTS_FORMAT},
             stream=True,
             stream_options={"include_usage": True},
         )
         
-        audio_string = ""
-        for chunk in completion:
-            if chunk.choices and chunk.choices[0].delta:
-                delta = chunk.choices[0].delta
-                if hasattr(delta, "audio") and delta.audio:
-                    try:
-                        if "data" in delta.audio:
-                            audio_string += delta.audio["data"]
-                        elif "transcript" in delta.audio:
-                            logger.info(f"音频转写: {delta.audio['transcript']}")
-                    except Exception as e:
-                        logger.error(f"处理音频数据出错: {str(e)}")
-                elif hasattr(delta, "content") and delta.content:
-                    logger.info(f"LLM文本响应: {delta.content}")
+        # 流式模式下音频片段到达即回调；需要写入缓存或返回完整音频时同时保存在解码缓冲区中
+        decoder = OmniDecoder(
+            on_audio=(lambda pcm: on_audio(np.frombuffer(pcm, dtype=np.int16))) if on_audio is not None else None,
+            keep_audio=on_audio is None or key is not None,
+            timings=timings,
+        )
+        try:
+            for chunk in completion:
+                if cancel_event is not None and cancel_event.is_set():
+                    completion.close()
+                    logger.info("LLM响应已取消")
+                    return None
+                decoder.feed(chunk)
+        except OmniResponseError:
+            completion.close()
+            raise
+        decoder.finish()
+        if decoder.transcript:
+            logger.info(f"音频转写: {decoder.transcript}")
+        if decoder.text:
+            logger.info(f"LLM文本响应: {decoder.text}")
+        observe_llm("shell", timings, decoder.audio_bytes)
         
-        if audio_string:
-            try:
-                wav_bytes = base64.b64decode(audio_string)
-                audio_np = np.frombuffer(wav_bytes, dtype=np.int16)
-                logger.info("LLM响应音频数据已接收")
-                return audio_np
-            except Exception as e:
-                logger.error(f"解码音频数据出错: {str(e)}")
-                return None
-        else:
+        if not decoder.audio_bytes:
             logger.warning("未收到LLM音频响应")
             return None
+        if key:
+            tts_cache.put(key, decoder.audio())
+        if on_audio is not None:
+            logger.info(f"LLM响应音频已流式接收: {decoder.audio_bytes / 2 / PLAYBACK_RATE:.2f}秒")
+            return decoder.audio_bytes // 2
+        logger.info("LLM响应音频数据已接收")
+        return decoder.samples()
     except Exception as e:
         logger.error(f"获取LLM响应出错: {str(e)}")
+        LLM_ERRORS.labels("shell").inc()
         return None
 
 
@@ -369,68 +697,534 @@ def cleanup_temp_files():
         logger.error(f"清理临时文件出错: {str(e)}")
 
 
+class PipelineServices:
+    """流水线调用的识别和LLM接口
+
+    默认直接使用本进程的模型和LLM客户端；多会话服务（session_server.py）
+    替换为经过公平调度的共享识别池和LLM并发限制，并按会话统计延迟
+    """
+
+    def transcribe(self, audio):
+        return transcribe_audio(audio)
+
+    def transcribe_segments(self, audio, initial_prompt=None, policy=SHELL_POLICY):
+        return transcribe_segments(audio, initial_prompt, policy)
+
+    def respond(self, text, on_audio=None, cancel_event=None):
+        return get_llm_response(text, on_audio=on_audio, cancel_event=cancel_event)
+
+    def speculate(self, text, on_audio, cancel_event):
+        """推测请求，默认与 respond 相同"""
+        return self.respond(text, on_audio=on_audio, cancel_event=cancel_event)
+
+    def observe_response(self, seconds):
+        """一轮对话从录音结束到回复首个音频就绪的耗时"""
+
+
+class _Utterance:
+    """一段录音，incremental 为录音过程中的增量识别器（可能为空），captured 为录音结束的时间"""
+
+    def __init__(self, audio, incremental=None, end=None, speculation=None):
+        self.audio = audio
+        self.incremental = incremental
+        self.end = end
+        self.speculation = speculation
+        self.captured = time.monotonic()
+
+    def cancel(self):
+        if self.incremental:
+            self.incremental.cancel()
+        if self.speculation:
+            self.speculation.cancel()
+
+
+_END_OF_INPUT = object()  # 有限输入结束后依次经过各阶段队列的标记
+
+
+class _Speculation:
+    """一次推测请求：在后台线程中按部分识别结果提前请求LLM
+
+    音频先缓存在 reply 中，最终识别结果一致时 reply 才进入播放队列
+    """
+
+    def __init__(self, text, respond):
+        self.text = text
+        self.respond = respond
+        self.reply = _Reply(text)
+        self.started = time.monotonic()
+
+    def start(self):
+        threading.Thread(target=self._run, name="SpeculativeLLM", daemon=True).start()
+        return self
+
+    def _run(self):
+        try:
+            self.respond(self.text, self.reply.chunks.put, self.reply.cancelled)
+        except Exception as e:
+            logger.error(f"推测请求出错: {str(e)}")
+        finally:
+            self.reply.chunks.put(None)
+
+    def matches(self, text):
+        return normalize_transcript(text) == normalize_transcript(self.text)
+
+    def cancel(self):
+        self.reply.cancel()
+
+
+class _Reply:
+    """一轮对话的回复，LLM阶段写入音频片段，播放阶段读取"""
+
+    def __init__(self, text, captured=None):
+        self.text = text
+        self.captured = captured  # 对应录音结束的时间，用于统计回复延迟
+        self.chunks = queue.Queue()  # 以 None 结尾
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class VoicePipeline:
+    """语音对话流水线
+
+    采集、识别、LLM、播放四个阶段各占一个线程，阶段之间通过有界队列连接：
+    - 采集线程从不阻塞，录音队列满时丢弃最旧的录音
+    - 文本队列满时同样丢弃最旧的文本
+    - 回复队列满时LLM阶段阻塞等待播放（反压）
+    回复先入队再生成，因此上一轮播放时下一轮的识别和LLM请求可以同时进行。
+    从文件等非实时输入回放时，录音和文本队列改为阻塞入队，不丢弃任何一轮；
+    输入结束后结束标记依次经过各阶段，最后一轮播放完成时 finished 被置位。
+    麦克风输入时播放期间继续采集，用户开口（BARGE_IN）即取消正在播放和排队的回复。
+    开启推测请求（SPECULATIVE_LLM）时，录音中停顿 SPECULATE_PAUSE 秒且部分识别结果稳定即提前请求LLM，
+    用户继续说话或最终结果不同时取消；一致时文本队列中传递的是推测请求，LLM阶段直接使用它的回复。
+    识别和LLM调用经过 services（见 PipelineServices），多个流水线可以共用同一组识别和LLM资源。
+    """
+
+    def __init__(self, recorder, player, stream_player=None, on_partial=None, services=None):
+        self.recorder = recorder
+        self.player = player
+        self.stream_player = stream_player
+        self.services = services or PipelineServices()
+        self.utterances = queue.Queue(maxsize=UTTERANCE_QUEUE_SIZE)
+        self.texts = queue.Queue(maxsize=TEXT_QUEUE_SIZE)
+        self.replies = queue.Queue(maxsize=REPLY_QUEUE_SIZE)
+        self.dropped = {"录音": 0, "文本": 0}
+        self.conversation_count = 0
+        self.realtime = recorder.source.realtime
+        self.finished = threading.Event()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._ended = set()  # 正常返回的阶段（输入结束后交出结束标记，或流水线停止）
+        self.on_partial = on_partial or self._log_partial
+        self._incremental = None
+        self._playing = None  # 正在播放的回复
+        self.barge_in = BARGE_IN and self.realtime
+        self.barge_ins = 0
+        # 尽可能快地回放时后台增量识别来不及运行，直接整段识别
+        self.incremental = INCREMENTAL_ASR and (self.realtime or REPLAY_SPEED)
+        recorder.on_recording_start = self._on_recording_start
+        if self.incremental:
+            recorder.on_recording_audio = self._feed_incremental
+        self.speculative = SPECULATIVE_LLM and self.incremental
+        self.speculations = {"hit": 0, "miss": 0, "resumed": 0}
+        self._speculation = None
+        self._partial_text = ""
+        self._partial_stable = False
+        self._partial_clock = 0  # 最近一次部分结果开始解码时录音器的采样时钟
+        self._decode_clock = 0
+
+    def start(self):
+        """启动各阶段线程"""
+        stages = (
+            ("Capture", self._capture_loop),
+            ("ASR", self._asr_loop),
+            ("LLM", self._llm_loop),
+            ("Playback", self._playback_loop),
+        )
+        for name, target in stages:
+            thread = threading.Thread(target=self._run_stage, args=(name, target), name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("语音对话流水线已启动")
+
+    def stop(self):
+        """停止各阶段线程"""
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        if self._speculation:
+            self._speculation.cancel()
+        logger.info(f"语音对话流水线已停止(丢弃统计: {self.dropped}，插话打断 {self.barge_ins} 次)")
+        if self.speculative:
+            logger.info(f"推测请求统计: {self.speculations}")
+        if self.recorder.echo_gate:
+            logger.info(f"回声门限拦截 {self.recorder.echo_gate.suppressed} 次")
+        if ASR_CASCADE:
+            logger.info(f"两级识别统计: {cascade_stats.snapshot()}")
+        logger.info(f"解码策略统计: {SHELL_POLICY.stats()} {PARTIAL_POLICY.stats()}")
+
+    def _run_stage(self, name, target):
+        target()
+        self._ended.add(name)
+
+    def is_alive(self):
+        """是否没有阶段线程异常退出（输入结束后正常退出的阶段不算）"""
+        return self.finished.is_set() or all(
+            thread.is_alive() or thread.name in self._ended for thread in self._threads)
+
+    def _put(self, q, item, label):
+        """实时输入时满队列丢弃最旧的元素，否则阻塞等待"""
+        if self.realtime:
+            self._put_drop_oldest(q, item, label)
+        else:
+            self._put_blocking(q, item)
+
+    def _put_drop_oldest(self, q, item, label):
+        """非阻塞入队，队列满时丢弃最旧的元素"""
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    oldest = q.get_nowait()
+                except queue.Empty:
+                    continue
+                self.dropped[label] += 1
+                PIPELINE_DROPPED.labels("shell", label).inc()
+                logger.warning(f"{label}队列已满，丢弃最旧的{label}(累计丢弃 {self.dropped[label]} 个)")
+                if isinstance(oldest, (_Utterance, _Speculation, _Reply)):
+                    oldest.cancel()
+
+    def _put_blocking(self, q, item):
+        """阻塞入队直到成功或流水线停止"""
+        while not self._stop_event.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        """带超时出队，超时返回 None 以便检查停止标志"""
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            return None
+
+    def interrupt(self):
+        """用户插话：取消正在播放的回复和排队等待播放的回复"""
+        reply = self._playing
+        if reply is None or reply.cancelled.is_set():
+            return
+        with self.replies.mutex:
+            pending = [item for item in self.replies.queue if isinstance(item, _Reply)]
+        for item in [reply] + pending:
+            item.cancel()
+        if self.stream_player:
+            self.stream_player.cancel()
+        else:
+            self.player.cancel()
+        self.barge_ins += 1
+        BARGE_INS.labels("shell").inc()
+        logger.info(f"用户插话，停止当前回复(取消 {len(pending) + 1} 段)")
+
+    def _on_recording_start(self):
+        """录音开始：插话时打断回复，并开始增量识别"""
+        if self.barge_in:
+            self.interrupt()
+        if self.incremental:
+            self._begin_incremental()
+
+    def _log_partial(self, committed, tentative):
+        logger.info(f"部分识别: {committed}|{tentative}")
+
+    def _begin_incremental(self):
+        """录音开始时创建增量识别器"""
+        if self._incremental:
+            self._incremental.cancel()
+        self._partial_text = ""
+        self._partial_stable = False
+        self._incremental = IncrementalTranscriber(
+            self._transcribe_partial,
+            final_transcribe_fn=self.services.transcribe_segments,
+            rate=RATE,
+            interval=INCREMENTAL_INTERVAL,
+            on_partial=self._on_partial,
+        ).start()
+
+    def _transcribe_partial(self, audio, prompt):
+        self._decode_clock = self.recorder.clock
+        return self.services.transcribe_segments(audio, prompt, PARTIAL_POLICY)
+
+    def _on_partial(self, committed, tentative):
+        """记录部分结果，连续两次相同视为稳定"""
+        text = committed + tentative
+        self._partial_stable = bool(text.strip()) and text == self._partial_text
+        self._partial_text = text
+        self._partial_clock = self._decode_clock
+        self.on_partial(committed, tentative)
+
+    def _update_speculation(self):
+        """录音中停顿足够久且部分结果稳定时发出推测请求，用户继续说话时取消"""
+        silence = self.recorder.silence_seconds()
+        if self._speculation:
+            if not silence:
+                self._discard_speculation(self._speculation, "resumed")
+                self._speculation = None
+            return
+        pause_start = self.recorder.clock - silence * RATE
+        # 部分结果必须是停顿开始后解码得到的，否则可能还没包含停顿前的最后几个字
+        if silence >= SPECULATE_PAUSE and self._partial_stable and self._partial_clock >= pause_start:
+            logger.info(f"停顿 {silence:.2f}秒，发出推测请求: {self._partial_text}")
+            self._speculation = _Speculation(self._partial_text, self.services.speculate).start()
+
+    def _discard_speculation(self, speculation, outcome):
+        speculation.cancel()
+        self.speculations[outcome] += 1
+        LLM_SPECULATIONS.labels("shell", outcome).inc()
+        logger.info(f"推测请求作废({outcome}): {speculation.text}")
+
+    def _resolve_speculation(self, speculation, text):
+        """最终识别结果确定后，采用一致的推测请求，否则作废"""
+        if text and speculation.matches(text):
+            self.speculations["hit"] += 1
+            LLM_SPECULATIONS.labels("shell", "hit").inc()
+            LLM_SPECULATION_LEAD_SECONDS.labels("shell").observe(time.monotonic() - speculation.started)
+            logger.info("采用推测请求的回复")
+            return speculation
+        self._discard_speculation(speculation, "miss")
+        return text
+
+    def _feed_incremental(self, audio_data):
+        if self._incremental:
+            self._incremental.feed(audio_data)
+
+    def _capture_loop(self):
+        """采集阶段：持续读取输入，录音完成后交给识别阶段"""
+        while not self._stop_event.is_set():
+            if self.recorder.exhausted:
+                self._put_blocking(self.utterances, _END_OF_INPUT)
+                return
+            try:
+                audio = self.recorder.process_audio()
+                if audio is not None:
+                    utterance = _Utterance(audio, self._incremental, self.recorder.last_bounds[1], self._speculation)
+                    self._incremental = None
+                    self._speculation = None
+                    self._put(self.utterances, utterance, "录音")
+                elif not self.recorder.is_recording:
+                    if self._incremental:
+                        # 录音结束但没有有效音频
+                        self._incremental.cancel()
+                        self._incremental = None
+                    if self._speculation:
+                        self._discard_speculation(self._speculation, "miss")
+                        self._speculation = None
+                elif self.speculative:
+                    self._update_speculation()
+            except Exception as e:
+                logger.error(f"采集阶段出错: {str(e)}")
+                # 重置录音状态，确保能继续监听
+                self.recorder.is_recording = False
+                self.recorder.silence_start_time = None
+                self.recorder.samples.clear()
+                if self._incremental:
+                    self._incremental.cancel()
+                    self._incremental = None
+                if self._speculation:
+                    self._discard_speculation(self._speculation, "miss")
+                    self._speculation = None
+                time.sleep(0.5)
+
+    def _transcribe(self, utterance):
+        """优先使用增量识别结果，失败时回退为整段识别"""
+        if utterance.incremental:
+            try:
+                text = utterance.incremental.finalize(utterance.end)
+                logger.info(f"识别结果: {text}")
+                return text
+            except Exception as e:
+                logger.error(f"增量识别出错，回退为整段识别: {str(e)}")
+        return self.services.transcribe(utterance.audio)
+
+    def _asr_loop(self):
+        """识别阶段：直接转录内存中的录音"""
+        while not self._stop_event.is_set():
+            utterance = self._get(self.utterances)
+            if utterance is None:
+                continue
+            if utterance is _END_OF_INPUT:
+                self._put_blocking(self.texts, _END_OF_INPUT)
+                return
+            try:
+                text = self._transcribe(utterance)
+                if utterance.speculation:
+                    text = self._resolve_speculation(utterance.speculation, text)
+                if isinstance(text, _Speculation):
+                    text.reply.captured = utterance.captured
+                    self._put(self.texts, text, "文本")
+                elif text:
+                    self._put(self.texts, _Reply(text, utterance.captured), "文本")
+            except Exception as e:
+                logger.error(f"识别阶段出错: {str(e)}")
+
+    def _llm_loop(self):
+        """LLM阶段：请求回复并把音频片段写入回复对象"""
+        while not self._stop_event.is_set():
+            reply = self._get(self.texts)
+            if reply is None:
+                continue
+            if reply is _END_OF_INPUT:
+                self._put_blocking(self.replies, _END_OF_INPUT)
+                return
+            if isinstance(reply, _Speculation):
+                # 推测请求已在后台生成回复
+                if not self._put_blocking(self.replies, reply.reply):
+                    reply.cancel()
+                    return
+                continue
+            if not self._put_blocking(self.replies, reply):
+                return
+            try:
+                if self.stream_player:
+                    self.services.respond(reply.text, on_audio=reply.chunks.put, cancel_event=reply.cancelled)
+                else:
+                    audio_data = self.services.respond(reply.text, cancel_event=reply.cancelled)
+                    if audio_data is not None:
+                        reply.chunks.put(audio_data)
+            except Exception as e:
+                logger.error(f"LLM阶段出错: {str(e)}")
+            finally:
+                reply.chunks.put(None)
+
+    def _playback_loop(self):
+        """播放阶段：按顺序播放各轮回复"""
+        while not self._stop_event.is_set():
+            reply = self._get(self.replies)
+            if reply is None:
+                continue
+            if reply is _END_OF_INPUT:
+                logger.info(f"输入已结束，全部 {self.conversation_count} 轮回复已播放")
+                self.finished.set()
+                return
+            if reply.cancelled.is_set():
+                logger.info("回复已取消，跳过播放")
+                continue
+            self._playing = reply
+            try:
+                played = self._play_reply(reply)
+                if played:
+                    self.conversation_count += 1
+                    CONVERSATION_TURNS.labels("shell").inc()
+                    logger.info(f"完成第 {self.conversation_count} 轮对话")
+                logger.info("准备下一轮对话...")
+            except Exception as e:
+                logger.error(f"播放阶段出错: {str(e)}")
+            finally:
+                self._playing = None
+
+    def _next_chunk(self, reply):
+        """取回复的下一个音频片段，回复结束或被取消时返回 None"""
+        while not reply.cancelled.is_set():
+            try:
+                chunk = reply.chunks.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if chunk is not None and reply.captured is not None:
+                self._observe_response(reply)
+            return chunk
+        return None
+
+    def _observe_response(self, reply):
+        """记录录音结束到回复首个音频就绪的耗时（每轮只记录一次）"""
+        seconds = time.monotonic() - reply.captured
+        reply.captured = None
+        RESPONSE_SECONDS.labels("shell").observe(seconds)
+        self.services.observe_response(seconds)
+
+    def _play_reply(self, reply):
+        """播放一轮回复，返回是否有音频"""
+        if self.stream_player:
+            self.stream_player.begin_reply()
+            played = False
+            try:
+                while True:
+                    chunk = self._next_chunk(reply)
+                    if chunk is None:
+                        break
+                    self.stream_player.feed(chunk)
+                    played = True
+            finally:
+                self.stream_player.end_reply()
+            self.stream_player.wait_done()
+            return played
+
+        chunks = []
+        while True:
+            chunk = self._next_chunk(reply)
+            if chunk is None:
+                break
+            chunks.append(chunk)
+        if not chunks or reply.cancelled.is_set():
+            return False
+        self.player.play_audio(np.concatenate(chunks))
+        return True
+
+
 def main():
     """主函数"""
     logger.info("启动语音识别后端服务")
+    logger.info(f"正在加载语音识别模型（{model.mode}）...")
+    model.load()
+    if METRICS_PORT:
+        try:
+            start_http_server(METRICS_PORT)
+            logger.info(f"指标已在 http://127.0.0.1:{METRICS_PORT}/metrics 提供")
+        except OSError as e:
+            logger.error(f"启动指标服务出错: {str(e)}")
     
     recorder = AudioRecorder()
-    player = AudioPlayer()
+    IDLE_CPU_RATIO.labels("shell").set_function(lambda: recorder.idle_cpu_ratio)
+    # 采集源自己维护累计次数，计数器在输出指标时读取
+    if hasattr(recorder.source, "restarts"):
+        CAPTURE_RESTARTS.labels("shell").set_function(lambda: recorder.source.restarts)
+    if hasattr(recorder.source, "xruns"):
+        for kind in recorder.source.xruns:
+            CAPTURE_XRUNS.labels("shell", kind).set_function(lambda kind=kind: recorder.source.xruns[kind])
+    if BARGE_IN and recorder.source.realtime:
+        recorder.echo_gate = EchoGate(ECHO_GATE_RATIO, ECHO_TAIL_MS / 1000)
+    sink = create_sink(AUDIO_SINK, REPLAY_SPEED)
+    player = AudioPlayer(sink, recorder.echo_gate)
+    stream_player = None
+    if STREAM_PLAYBACK:
+        stream_player = StreamingAudioPlayer(sink=sink, echo_gate=recorder.echo_gate)
+        stream_player.start()
+    pipeline = VoicePipeline(recorder, player, stream_player)
     
     try:
         logger.info("按Ctrl+C退出程序")
-        conversation_count = 0
-        
-        while True:
-            try:
-                # 处理音频并检查是否有录音完成
-                audio_file = recorder.process_audio()
-                
-                if audio_file:
-                    # 转录音频
-                    text = transcribe_audio(audio_file)
-                    
-                    if text:
-                        # 获取LLM响应
-                        audio_data = get_llm_response(text)
-                        
-                        if audio_data is not None:
-                            # 播放响应
-                            player.play_audio(audio_data)
-                            conversation_count += 1
-                            logger.info(f"完成第 {conversation_count} 轮对话")
-                    
-                    # 删除临时音频文件
-                    try:
-                        os.remove(audio_file)
-                        logger.info(f"已删除临时文件: {audio_file}")
-                    except Exception as e:
-                        logger.error(f"删除文件出错: {str(e)}")
-                    
-                    # 重置录音状态，准备下一轮对话
-                    recorder.is_recording = False
-                    recorder.silence_start_time = None
-                    recorder.frames = []
-                    logger.info("准备下一轮对话...")
-                
-                # 短暂休眠以减少CPU使用
-                time.sleep(0.01)
-            except Exception as e:
-                logger.error(f"主循环处理出错: {str(e)}")
-                # 重置录音状态，确保能继续监听
-                recorder.is_recording = False
-                recorder.silence_start_time = None
-                recorder.frames = []
-                logger.info("重置状态，继续监听...")
-                time.sleep(1)  # 出错后稍微等待一下再继续
-    
+        pipeline.start()
+        while pipeline.is_alive() and not pipeline.finished.wait(1.0):
+            pass
+        if not pipeline.finished.is_set():
+            logger.error("流水线线程意外退出")
+        elif hasattr(sink, "stats"):
+            logger.info(f"输出统计: {sink.stats()}")
     except KeyboardInterrupt:
         logger.info("接收到退出信号")
     except Exception as e:
         logger.error(f"程序运行出错: {str(e)}")
     finally:
         # 清理资源
+        pipeline.stop()
         recorder.close()
         player.close()
+        if stream_player:
+            stream_player.close()
+        sink.close()
         cleanup_temp_files()
         logger.info("程序已退出")
 
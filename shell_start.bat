@@ -7,9 +7,6 @@ echo [INFO] Voice Recognition Backend Service Startup Script (Windows)
 if not exist temp_audio (
     mkdir temp_audio
 )
-if not exist diyvoice\llmanswer (
-    mkdir diyvoice\llmanswer
-)
 
 :: Delete existing log file if it exists to avoid permission issues
 if exist shell_service.log (
@@ -2,7 +2,6 @@
 
 # 创建必要的目录
 mkdir -p temp_audio
-mkdir -p diyvoice/llmanswer
 
 # 启动语音识别后端服务
 echo "启动语音识别后端服务..."
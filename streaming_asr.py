@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+增量语音识别
+用户说话过程中在后台反复解码未提交部分的音频，提交稳定的前缀，
+录音结束时只需解码剩余的一小段，最终结果几乎可以立即得到
+"""
+
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger("StreamingASR")
+
+
+class IncrementalTranscriber:
+    """增量识别器
+
+    - feed() 追加录音，后台线程每隔 interval 秒解码一次从提交点到当前的窗口
+    - 连续两次解码中相同且不贴近窗口末尾的前导片段视为稳定，提交并前移窗口起点
+    - 窗口超过 max_window 仍无稳定片段时，强制提交除最后一段外的结果
+    - 已提交文本作为后续窗口的 initial_prompt
+    - 每次解码后调用 on_partial(已提交文本, 未提交的假设文本)
+
+    transcribe_fn(audio, initial_prompt) 返回带 text/start/end 属性的片段列表；
+    final_transcribe_fn 用于 finalize() 时解码剩余部分，默认与 transcribe_fn 相同。
+    """
+
+    def __init__(self, transcribe_fn, final_transcribe_fn=None, rate=16000, interval=0.5,
+                 min_new_audio=0.3, min_window=0.5, max_window=10.0, stable_guard=1.0,
+                 prompt_chars=200, on_partial=None):
+        self.transcribe_fn = transcribe_fn
+        self.final_transcribe_fn = final_transcribe_fn or transcribe_fn
+        self.rate = rate
+        self.interval = interval
+        self.min_new_audio = int(rate * min_new_audio)
+        self.min_window = int(rate * min_window)
+        self.max_window = max_window
+        self.stable_guard = stable_guard
+        self.prompt_chars = prompt_chars
+        self.on_partial = on_partial
+
+        self.committed_text = ""
+        self.tentative_text = ""
+        self.decodes = 0
+        self._audio = np.zeros(rate * 4, dtype=np.float32)
+        self._size = 0
+        self._commit_pos = 0
+        self._decoded_size = 0
+        self._previous = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动后台解码线程"""
+        self._thread = threading.Thread(target=self._loop, name="IncrementalASR", daemon=True)
+        self._thread.start()
+        return self
+
+    def feed(self, samples):
+        """追加录音，int16 采样会被转换为 float32"""
+        if samples.dtype == np.int16:
+            samples = samples.astype(np.float32) * (1.0 / 32768.0)
+        with self._lock:
+            end = self._size + len(samples)
+            if end > len(self._audio):
+                grown = np.zeros(max(end, len(self._audio) * 2), dtype=np.float32)
+                grown[:self._size] = self._audio[:self._size]
+                self._audio = grown
+            self._audio[self._size:end] = samples
+            self._size = end
+
+    def cancel(self):
+        """放弃本段识别"""
+        self._stop_event.set()
+
+    def finalize(self, end=None):
+        """停止后台解码，解码剩余的未提交部分并返回完整文本
+
+        end 为有效音频的结束采样点（例如裁剪掉尾部静音后的位置）
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        with self._lock:
+            end = self._size if end is None else min(end, self._size)
+            window = self._audio[self._commit_pos:end].copy()
+        tail = ""
+        if len(window) >= self.rate // 10:
+            segments = self.final_transcribe_fn(window, self._prompt())
+            tail = "".join(segment.text for segment in segments)
+        logger.info(f"增量识别完成: 后台解码 {self.decodes} 次，最终解码 {len(window) / self.rate:.2f}秒")
+        return self.committed_text + tail
+
+    def _prompt(self):
+        return self.committed_text[-self.prompt_chars:] or None
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval):
+            if self._size - self._decoded_size < self.min_new_audio:
+                continue
+            try:
+                self._decode_step()
+            except Exception as e:
+                logger.error(f"增量识别出错: {str(e)}")
+
+    def _decode_step(self):
+        with self._lock:
+            offset = self._commit_pos
+            size = self._size
+            window = self._audio[offset:size].copy()
+        if len(window) < self.min_window:
+            return
+
+        segments = self.transcribe_fn(window, self._prompt())
+        self.decodes += 1
+        self._decoded_size = size
+        hypothesis = [(segment.text, segment.start, segment.end) for segment in segments]
+        window_sec = len(window) / self.rate
+
+        stable = 0
+        for current, previous in zip(hypothesis, self._previous):
+            if current[0] != previous[0] or current[2] > window_sec - self.stable_guard:
+                break
+            stable += 1
+        if stable == 0 and window_sec > self.max_window and len(hypothesis) > 1:
+            stable = len(hypothesis) - 1
+
+        if stable:
+            commit_end = hypothesis[stable - 1][2]
+            self.committed_text += "".join(text for text, _, _ in hypothesis[:stable])
+            with self._lock:
+                self._commit_pos = offset + int(commit_end * self.rate)
+            hypothesis = [(text, start - commit_end, end - commit_end)
+                          for text, start, end in hypothesis[stable:]]
+
+        self._previous = hypothesis
+        self.tentative_text = "".join(text for text, _, _ in hypothesis)
+        if self.on_partial:
+            self.on_partial(self.committed_text, self.tentative_text)
@@ -0,0 +1,96 @@
+import os
+import asyncio
+import base64
+from types import SimpleNamespace
+
+import numpy as np
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+os.environ.setdefault("ASR_LOAD_MODE", "lazy")
+
+import app  # noqa: E402
+
+
+def audio_chunk(samples=2400):
+    data = base64.b64encode(np.zeros(samples, dtype=np.int16).tobytes()).decode()
+    delta = SimpleNamespace(audio={"data": data}, content=None)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class FakeStream:
+    """每隔 interval 秒产出一个音频块的流式响应，记录是否被关闭"""
+
+    def __init__(self, chunks=100, interval=0.01):
+        self.remaining = chunks
+        self.interval = interval
+        self.produced = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed or not self.remaining:
+            raise StopAsyncIteration
+        await asyncio.sleep(self.interval)
+        self.remaining -= 1
+        self.produced += 1
+        return audio_chunk()
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self):
+        self.streams = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        stream = FakeStream()
+        self.streams.append(stream)
+        return stream
+
+
+def test_cancelled_reply_closes_stream(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(app, "llm_client", client)
+
+    async def run():
+        task = asyncio.create_task(app.request_omni_audio("你好"))
+        while not client.streams or client.streams[0].produced < 3:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+    stream = client.streams[0]
+    assert stream.closed
+    assert stream.remaining > 0
+
+
+def test_abandoned_iteration_closes_stream(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(app, "llm_client", client)
+
+    async def run():
+        events = app.iter_omni_events("你好")
+        async for kind, _ in events:
+            if kind == "audio":
+                break
+        await events.aclose()
+
+    asyncio.run(run())
+    assert client.streams[0].closed
+
+
+def test_completed_reply_closes_stream(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(app, "llm_client", client)
+
+    audio = asyncio.run(app.request_omni_audio("你好"))
+    assert client.streams[0].closed
+    assert len(audio) == 100 * 2400 * 2
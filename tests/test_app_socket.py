@@ -0,0 +1,18 @@
+import os
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+os.environ.setdefault("ASR_LOAD_MODE", "lazy")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import app  # noqa: E402
+
+
+def test_malformed_control_frame_keeps_session():
+    with TestClient(app.app) as client:
+        with client.websocket_connect("/diyvoice/ws") as ws:
+            for frame in ("{not json", "[1, 2]", '{"format": "pcm"}', "null"):
+                ws.send_text(frame)
+                assert ws.receive_json()["type"] == "error"
+            ws.send_json({"type": "start", "format": "pcm", "sample_rate": 16000})
+            assert ws.receive_json() == {"type": "ready"}
@@ -0,0 +1,35 @@
+import os
+import time
+
+from asr_pool import ASRWorkerPool
+
+LOAD_DIR_ENV = "ASR_POOL_TEST_DIR"
+
+
+class FakeModel:
+    pass
+
+
+def slow_factory():
+    """第一个子进程立即加载完成，其余子进程加载较慢；每个完成加载的子进程留下一个文件"""
+    directory = os.environ[LOAD_DIR_ENV]
+    try:
+        os.close(os.open(os.path.join(directory, "first"), os.O_CREAT | os.O_EXCL))
+    except FileExistsError:
+        time.sleep(1.5)
+    open(os.path.join(directory, f"loaded-{os.getpid()}"), "w").close()
+    return FakeModel()
+
+
+def test_process_pool_ready_after_every_process_loaded(tmp_path, monkeypatch):
+    monkeypatch.setenv(LOAD_DIR_ENV, str(tmp_path))
+    replicas = 3
+    pool = ASRWorkerPool(slow_factory, replicas=replicas, mode="process", load_timeout=30)
+    pool.start()
+    try:
+        assert pool.wait_ready(timeout=30)
+        loaded = [name for name in os.listdir(tmp_path) if name.startswith("loaded-")]
+        assert len(loaded) == replicas
+        assert pool.stats()["loaded_replicas"] == replicas
+    finally:
+        pool.shutdown()
@@ -0,0 +1,60 @@
+import os
+import time
+import wave
+
+import numpy as np
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+
+import shell_service  # noqa: E402
+from audio_io import NullSink, WavDirectorySource  # noqa: E402
+
+REPLY_SAMPLES = 2400
+
+
+class SlowServices(shell_service.PipelineServices):
+    """识别立即返回，LLM 较慢：采集和识别阶段会先于 LLM 和播放阶段结束"""
+
+    def __init__(self):
+        self.count = 0
+
+    def transcribe(self, audio):
+        self.count += 1
+        return f"第{self.count}句"
+
+    def respond(self, text, on_audio=None, cancel_event=None):
+        time.sleep(0.3)
+        return np.zeros(REPLY_SAMPLES, dtype=np.int16)
+
+
+def write_utterance(path, rate=16000):
+    t = np.arange(rate) / rate
+    tone = (8000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+    samples = np.concatenate((np.zeros(rate // 2, dtype=np.int16), tone))
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(samples.tobytes())
+
+
+def test_directory_replay_plays_every_turn(tmp_path):
+    for index in range(4):
+        write_utterance(str(tmp_path / f"{index}.wav"))
+    recorder = shell_service.AudioRecorder(WavDirectorySource(str(tmp_path), gap=shell_service.SILENCE_DURATION + 1))
+    sink = NullSink()
+    player = shell_service.AudioPlayer(sink)
+    pipeline = shell_service.VoicePipeline(recorder, player, services=SlowServices())
+    pipeline.start()
+    try:
+        # 与 main 相同的等待方式：有阶段先结束时不能被当作异常退出
+        deadline = time.monotonic() + 30
+        while pipeline.is_alive() and not pipeline.finished.wait(0.1):
+            assert time.monotonic() < deadline
+        assert pipeline.finished.is_set()
+    finally:
+        pipeline.stop()
+        recorder.close()
+        player.close()
+    assert pipeline.conversation_count == 4
+    assert sink.samples == 4 * REPLY_SAMPLES
@@ -0,0 +1,35 @@
+import io
+import os
+
+import numpy as np
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+
+import shell_service  # noqa: E402
+from audio_io import RawPCMSource  # noqa: E402
+from vad import create_vad  # noqa: E402
+
+RATE = shell_service.RATE
+
+
+def test_continuous_speech_is_cut_at_max_duration():
+    """一直被判为语音的输入也要在最大录音时间切断，且录音开头不能被环形缓冲区覆盖"""
+    seconds = shell_service.MAX_RECORD_DURATION + 10
+    rng = np.random.default_rng(0)
+    lead = np.zeros(RATE, dtype=np.int16)
+    noise = rng.normal(0, 2000, RATE * seconds).clip(-32768, 32767).astype(np.int16)
+    marker = np.full(RATE // 10, 20000, dtype=np.int16)  # 录音开头的标记，回绕后会丢失
+    samples = np.concatenate((lead, marker, noise))
+
+    recorder = shell_service.AudioRecorder(RawPCMSource(stream=io.BytesIO(samples.tobytes())))
+    recorder.vad = create_vad("energy", rate=RATE)
+    audio = None
+    while audio is None and not recorder.exhausted:
+        audio = recorder.process_audio()
+    recorder.close()
+
+    assert audio is not None
+    assert not recorder.exhausted
+    assert recorder.clock / RATE <= 1 + shell_service.MAX_RECORD_DURATION + 1
+    assert len(recorder.samples) < recorder.samples.capacity
+    assert np.abs(audio[:RATE // 2]).max() * 32768 >= 19000
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+TTS响应缓存
+以规范化文本 + 模型 + 音色 + 格式为键缓存 qwen-omni 返回的 PCM 音频。
+内存 LRU 层之下是内存映射读取的磁盘层，两层都有容量和过期时间限制，
+命中时完全跳过网络请求
+
+预热（生成缺失的条目并载入内存）:
+    python tts_cache.py warmup phrases.txt
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import hashlib
+import logging
+import argparse
+import threading
+import unicodedata
+from collections import OrderedDict
+from omni_decoder import OmniDecoder, OmniResponseError
+
+logger = logging.getLogger("TTSCache")
+
+TTS_MODEL = "qwen-omni-turbo"
+TTS_VOICE = "Cherry"
+TTS_FORMAT = "wav"
+
+DEFAULT_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+DEFAULT_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_MB", "64")) * 1024 * 1024
+DEFAULT_DISK_BYTES = int(os.getenv("TTS_CACHE_DISK_MB", "1024")) * 1024 * 1024
+DEFAULT_TTL = float(os.getenv("TTS_CACHE_TTL_HOURS", "168")) * 3600
+
+
+def normalize_text(text):
+    """规范化文本：全角转半角、合并空白、转小写"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def cache_key(text, model=TTS_MODEL, voice=TTS_VOICE, fmt=TTS_FORMAT):
+    """计算缓存键"""
+    raw = "\x1f".join((normalize_text(text), model, voice, fmt))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """两级 TTS 音频缓存
+
+    - 内存层：OrderedDict 实现的 LRU，按字节数限制容量
+    - 磁盘层：每个条目一个文件，通过 mmap 读取，按字节数限制容量，超出时淘汰最久未访问的条目
+    - 两层都按写入时间判断过期
+    多个进程可以共用同一个磁盘目录，未在本进程索引中的条目会按文件查找。
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, memory_bytes=DEFAULT_MEMORY_BYTES,
+                 disk_bytes=DEFAULT_DISK_BYTES, ttl=DEFAULT_TTL):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (写入时间, 数据)
+        self._memory_size = 0
+        self._disk = OrderedDict()  # key -> (写入时间, 字节数)
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0, "evictions": 0, "expired": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pcm")
+
+    def _load_index(self):
+        """扫描磁盘目录，按访问时间重建索引"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".pcm"):
+                    st = os.stat(os.path.join(root, name))
+                    entries.append((st.st_atime, name[:-4], st.st_mtime, st.st_size))
+        for _, key, created, size in sorted(entries):
+            self._disk[key] = (created, size)
+            self._disk_size += size
+
+    def _expired(self, created):
+        return self.ttl and time.time() - created > self.ttl
+
+    def get(self, key):
+        """查找缓存，未命中返回 None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[1]
+                self._drop_memory(key)
+                self.counters["expired"] += 1
+
+            path = self._path(key)
+            try:
+                created = os.path.getmtime(path)
+            except OSError:
+                self.counters["misses"] += 1
+                return None
+            if self._expired(created):
+                self._drop_disk(key)
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            try:
+                with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    data = mm[:]
+            except (OSError, ValueError):
+                self.counters["misses"] += 1
+                return None
+            if key not in self._disk:
+                self._disk_size += len(data)
+            self._disk[key] = (created, len(data))
+            self._disk.move_to_end(key)
+            self._put_memory(key, created, data)
+            self.counters["disk_hits"] += 1
+            return data
+
+    def put(self, key, data):
+        """写入缓存（内存层和磁盘层）"""
+        data = bytes(data)
+        created = time.time()
+        path = self._path(key)
+        with self._lock:
+            self._put_memory(key, created, data)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.error(f"写入TTS缓存出错: {str(e)}")
+                return
+            if key in self._disk:
+                self._disk_size -= self._disk[key][1]
+            self._disk[key] = (created, len(data))
+            self._disk.move_to_end(key)
+            self._disk_size += len(data)
+            self.counters["puts"] += 1
+            while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+                oldest = next(iter(self._disk))
+                self._drop_disk(oldest)
+                self.counters["evictions"] += 1
+
+    def _put_memory(self, key, created, data):
+        if len(data) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._drop_memory(key)
+        self._memory[key] = (created, data)
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            oldest = next(iter(self._memory))
+            self._drop_memory(oldest)
+            self.counters["evictions"] += 1
+
+    def _drop_memory(self, key):
+        _, data = self._memory.pop(key)
+        self._memory_size -= len(data)
+
+    def _drop_disk(self, key):
+        if key in self._memory:
+            self._drop_memory(key)
+        entry = self._disk.pop(key, None)
+        if entry:
+            self._disk_size -= entry[1]
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        """命中率和容量统计"""
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_size,
+            }
+
+
+def fetch_audio(client, text):
+    """同步请求 qwen-omni，返回 PCM 字节；超过大小或时间上限时抛出 OmniResponseError"""
+    completion = client.chat.completions.create(
+        model=TTS_MODEL,
+        messages=[{"role": "user", "content": text}],
+        modalities=["text", "audio"],
+        audio={"voice": TTS_VOICE, "format": TTS_FORMAT},
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    decoder = OmniDecoder()
+    try:
+        for chunk in completion:
+            decoder.feed(chunk)
+    finally:
+        completion.close()
+    decoder.finish()
+    return decoder.audio()
+
+
+def warmup(cache, phrases, client):
+    """预热：缓存中缺失的短语请求生成，已有的载入内存"""
+    generated = loaded = 0
+    for phrase in phrases:
+        key = cache_key(phrase)
+        if cache.get(key) is not None:
+            loaded += 1
+            continue
+        try:
+            data = fetch_audio(client, phrase)
+        except OmniResponseError as e:
+            logger.warning(f"跳过 {phrase}: {str(e)}")
+            continue
+        if data:
+            cache.put(key, data)
+            generated += 1
+            logger.info(f"已生成: {phrase}")
+    return {"phrases": len(phrases), "generated": generated, "loaded": loaded}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TTS缓存工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    warm = sub.add_parser("warmup", help="按短语列表（每行一个）预热缓存")
+    warm.add_argument("phrases")
+    warm.add_argument("--dir", default=DEFAULT_CACHE_DIR)
+    sub.add_parser("stats", help="查看磁盘缓存统计").add_argument("--dir", default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    cache = TTSCache(args.dir)
+    if args.command == "warmup":
+        from openai import OpenAI
+        client = OpenAI(
+            api_key=os.getenv("DASHSCOPE_API_KEY"),
+            base_url=os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
+        )
+        with open(args.phrases, "r", encoding="utf-8") as f:
+            phrases = [line.strip() for line in f if line.strip()]
+        result = warmup(cache, phrases, client)
+    else:
+        result = cache.stats()
+    json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
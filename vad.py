@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+语音活动检测（VAD）
+提供固定阈值和自适应噪声底两种检测器，以及基于标注WAV文件的评测工具
+
+评测用法:
+    python vad.py score <标注目录> [--engine adaptive] [--spectral]
+    python vad.py check [--engine adaptive]     # 合成的平稳噪声突增回归检查
+
+标注目录中每个 xxx.wav 需要一个同名的 xxx.json:
+    {"speech": [[开始秒, 结束秒], ...]}
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import argparse
+import threading
+from collections import deque
+import numpy as np
+
+DEFAULT_RATE = 16000
+DEFAULT_FRAME_MS = 20
+
+
+def frame_energy(samples, frame_len):
+    """按帧计算平均绝对幅度，返回每帧一个值（不足一帧的尾部丢弃）"""
+    n_frames = len(samples) // frame_len
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len)
+    return np.abs(frames, dtype=np.float32).mean(axis=1)
+
+
+def spectral_flatness(samples, frame_len):
+    """按帧计算谱平坦度，语音通常明显低于宽带噪声"""
+    n_frames = len(samples) // frame_len
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len).astype(np.float32)
+    power = np.abs(np.fft.rfft(frames * np.hanning(frame_len).astype(np.float32), axis=1)) ** 2 + 1e-10
+    return np.exp(np.log(power).mean(axis=1)) / power.mean(axis=1)
+
+
+class VoiceActivityDetector:
+    """VAD基类
+
+    子类实现 _update(energy, flatness)，按帧更新内部状态并返回该帧是否为语音。
+    特征按帧向量化计算，状态机逐帧推进。
+    """
+
+    use_spectral = False
+
+    def __init__(self, rate=DEFAULT_RATE, frame_ms=DEFAULT_FRAME_MS):
+        self.rate = rate
+        self.frame_len = int(rate * frame_ms / 1000)
+        self.last_energy = 0.0
+        self.triggers = 0
+        self._speaking = False
+
+    @property
+    def threshold(self):
+        """当前判定为语音的能量阈值"""
+        raise NotImplementedError
+
+    def reset(self):
+        """重置状态"""
+        self.last_energy = 0.0
+        self._speaking = False
+
+    def reseed(self):
+        """录音被强制切断后结束当前语音状态，自适应检测器同时按近期能量重新估计噪声底"""
+        self._speaking = False
+
+    def process(self, samples):
+        """处理一段音频，返回每帧的语音判定数组"""
+        energy = frame_energy(samples, self.frame_len)
+        if self.use_spectral:
+            flatness = spectral_flatness(samples, self.frame_len)
+        else:
+            flatness = np.zeros_like(energy)
+        decisions = np.zeros(len(energy), dtype=bool)
+        for i in range(len(energy)):
+            speaking = self._update(float(energy[i]), float(flatness[i]))
+            if speaking and not self._speaking:
+                self.triggers += 1
+            self._speaking = speaking
+            decisions[i] = speaking
+        if len(energy):
+            self.last_energy = float(energy[-1])
+        return decisions
+
+    def is_speech(self, samples):
+        """判断一个音频块中是否有语音"""
+        return bool(self.process(samples).any())
+
+    def _update(self, energy, flatness):
+        raise NotImplementedError
+
+
+class EnergyVAD(VoiceActivityDetector):
+    """固定能量阈值检测器（原有行为）"""
+
+    def __init__(self, threshold=1000, **kwargs):
+        super().__init__(**kwargs)
+        self._threshold = threshold
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    def _update(self, energy, flatness):
+        return energy > self._threshold
+
+
+class AdaptiveVAD(VoiceActivityDetector):
+    """自适应噪声底检测器
+
+    - 噪声底在非语音帧上更新：下降快、上升慢，避免被持续说话抬高
+    - 语音期间和超过起始阈值时按最近 min_window 秒的最小帧能量（最小统计量）缓慢抬高噪声底，
+      环境噪声突然变大时检测器不会一直停在语音状态；说话中的停顿会把最小值拉回真实噪声底
+    - 起始阈值和结束阈值分别为噪声底的 onset_ratio / offset_ratio 倍（迟滞）
+    - 连续 onset_frames 帧超过起始阈值才触发，过滤瞬时噪声
+    - 低于结束阈值后保持 hangover_frames 帧再判为结束
+    - use_spectral 为真时额外要求谱平坦度低于 flatness_max
+    """
+
+    def __init__(self, initial_floor=200.0, min_threshold=300.0, onset_ratio=3.0,
+                 offset_ratio=1.8, onset_frames=2, hangover_frames=8,
+                 floor_rise=0.01, floor_fall=0.2, min_window=1.5, floor_track=0.02,
+                 use_spectral=False, flatness_max=0.45, **kwargs):
+        super().__init__(**kwargs)
+        self.initial_floor = initial_floor
+        self.min_threshold = min_threshold
+        self.onset_ratio = onset_ratio
+        self.offset_ratio = offset_ratio
+        self.onset_frames = onset_frames
+        self.hangover_frames = hangover_frames
+        self.floor_rise = floor_rise
+        self.floor_fall = floor_fall
+        self.min_window_frames = max(int(min_window * 1000 / (self.frame_len * 1000 / self.rate)), 1)
+        self.floor_track = floor_track
+        self.use_spectral = use_spectral
+        self.flatness_max = flatness_max
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        self.noise_floor = self.initial_floor
+        self._above = 0
+        self._hangover = 0
+        self._frame_index = 0
+        self._minima = deque()  # (帧序号, 能量)，能量单调递增，队首为窗口内最小值
+
+    def reseed(self):
+        super().reseed()
+        self._above = 0
+        self._hangover = 0
+        if len(self._minima) and self._frame_index >= self.min_window_frames:
+            self.noise_floor = max(self.noise_floor, self._minima[0][1])
+
+    def _track_minimum(self, energy):
+        """维护最近 min_window_frames 帧的最小能量"""
+        while self._minima and self._minima[-1][1] >= energy:
+            self._minima.pop()
+        self._minima.append((self._frame_index, energy))
+        self._frame_index += 1
+        while self._minima[0][0] <= self._frame_index - 1 - self.min_window_frames:
+            self._minima.popleft()
+
+    def _track_floor(self):
+        """语音期间按窗口最小能量缓慢抬高噪声底（窗口填满后才生效）"""
+        if self._frame_index < self.min_window_frames:
+            return
+        minimum = self._minima[0][1]
+        if minimum > self.noise_floor:
+            self.noise_floor += self.floor_track * (minimum - self.noise_floor)
+
+    @property
+    def onset_threshold(self):
+        return max(self.min_threshold, self.noise_floor * self.onset_ratio)
+
+    @property
+    def threshold(self):
+        return max(self.min_threshold, self.noise_floor * self.offset_ratio)
+
+    def _update(self, energy, flatness):
+        voiced_like = not self.use_spectral or flatness < self.flatness_max
+        self._track_minimum(energy)
+
+        if self._speaking:
+            self._track_floor()
+            if energy > self.threshold and voiced_like:
+                self._hangover = self.hangover_frames
+                return True
+            if self._hangover > 0:
+                self._hangover -= 1
+                return True
+            self._above = 0
+            return False
+
+        if energy > self.onset_threshold and voiced_like:
+            self._track_floor()
+            self._above += 1
+            if self._above >= self.onset_frames:
+                self._hangover = self.hangover_frames
+                return True
+            return False
+
+        self._above = 0
+        rate = self.floor_fall if energy < self.noise_floor else self.floor_rise
+        self.noise_floor += rate * (energy - self.noise_floor)
+        return False
+
+
+class EchoGate:
+    """播放期间的回声门限
+
+    播放端每写出一段音频调用 note_playback()，记录该段的最大帧能量和预计播放结束时间；
+    采集端用 is_echo() 判断麦克风能量是否可能只是扬声器的回声：
+    只有超过近期播放能量的 ratio 倍才视为用户说话，tail 覆盖输出延迟和房间混响。
+    """
+
+    def __init__(self, ratio=0.5, tail=0.3, frame_ms=DEFAULT_FRAME_MS):
+        self.ratio = ratio
+        self.tail = tail
+        self.frame_ms = frame_ms
+        self.suppressed = 0
+        self._entries = deque()  # (预计播放结束时间, 能量)
+        self._lock = threading.Lock()
+
+    def note_playback(self, samples, rate):
+        """记录刚写入输出端的一段音频"""
+        if not len(samples):
+            return
+        energy = frame_energy(samples, max(int(rate * self.frame_ms / 1000), 1))
+        peak = float(energy.max()) if len(energy) else float(np.abs(samples, dtype=np.float32).mean())
+        now = time.monotonic()
+        with self._lock:
+            start = max(now, self._entries[-1][0]) if self._entries else now
+            self._entries.append((start + len(samples) / rate, peak))
+
+    def cut(self):
+        """播放被中止，尚未播放的部分不再计入回声参考"""
+        now = time.monotonic()
+        with self._lock:
+            self._entries = deque((min(end, now), energy) for end, energy in self._entries)
+
+    def reference(self):
+        """近期播放的最大能量，没有播放时为0"""
+        expired = time.monotonic() - self.tail
+        with self._lock:
+            while self._entries and self._entries[0][0] < expired:
+                self._entries.popleft()
+            return max((energy for _, energy in self._entries), default=0.0)
+
+    def is_echo(self, energy):
+        """麦克风能量是否可能只是回声"""
+        reference = self.reference()
+        if reference and energy < reference * self.ratio:
+            self.suppressed += 1
+            return True
+        return False
+
+
+class Endpointer:
+    """基于VAD的流式端点检测
+
+    按采样点计时，与实时时钟无关，可以处理任意速度送入的音频。
+    feed() 返回事件列表：
+    - ("start", 预录音频+触发帧)：检测到语音开始
+    - ("audio", 音频)：录音中的后续音频
+    - ("end", {"reason": 原因, "trailing_silence": 尾部静音采样数})：一段语音结束
+    """
+
+    def __init__(self, vad, silence_duration=1.0, max_duration=20.0, pre_roll=0.3):
+        self.vad = vad
+        self.rate = vad.rate
+        self.frame_len = vad.frame_len
+        self.silence_samples = int(self.rate * silence_duration)
+        self.max_samples = int(self.rate * max_duration)
+        self.pre_roll_frames = max(int(self.rate * pre_roll) // self.frame_len, 0)
+        self.active = False
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._pre_roll = []
+        self._silence = 0
+        self._length = 0
+
+    def reset(self):
+        self.vad.reset()
+        self.active = False
+        self._pending = np.zeros(0, dtype=np.int16)
+        self._pre_roll = []
+        self._silence = 0
+        self._length = 0
+
+    def feed(self, samples):
+        """送入 int16 音频，返回事件列表"""
+        if len(self._pending):
+            samples = np.concatenate((self._pending, samples))
+        usable = len(samples) // self.frame_len * self.frame_len
+        self._pending = samples[usable:].copy()
+        if not usable:
+            return []
+        frames = samples[:usable].reshape(-1, self.frame_len)
+        decisions = self.vad.process(samples[:usable])
+
+        events = []
+        collected = []
+        for index, frame in enumerate(frames):
+            speaking = decisions[index]
+            if not self.active:
+                if not speaking:
+                    self._pre_roll.append(frame.copy())
+                    if len(self._pre_roll) > self.pre_roll_frames:
+                        self._pre_roll.pop(0)
+                    continue
+                self.active = True
+                self._silence = 0
+                collected = self._pre_roll + [frame]
+                self._length = len(collected) * self.frame_len
+                self._pre_roll = []
+                events.append(("start", np.concatenate(collected)))
+                collected = []
+                continue
+
+            collected.append(frame)
+            self._length += self.frame_len
+            self._silence = 0 if speaking else self._silence + self.frame_len
+            reason = None
+            if self._silence >= self.silence_samples:
+                reason = "silence"
+            elif self._length >= self.max_samples:
+                reason = "max_duration"
+            if reason:
+                events.append(("audio", np.concatenate(collected)))
+                collected = []
+                events.append(("end", {"reason": reason, "trailing_silence": self._silence}))
+                self.active = False
+                self._silence = 0
+                if reason == "max_duration":
+                    # 可能是持续的环境噪声而不是语音，按近期能量重新估计噪声底，避免立即再次触发；
+                    # 本块剩余帧的判决是切断前得出的，按新的噪声底重新判断
+                    self.vad.reseed()
+                    decisions[index + 1:] = self.vad.process(samples[(index + 1) * self.frame_len:usable])
+
+        if collected:
+            events.append(("audio", np.concatenate(collected)))
+        return events
+
+
+VAD_ENGINES = {
+    "energy": EnergyVAD,
+    "adaptive": AdaptiveVAD,
+}
+
+
+def create_vad(engine="adaptive", **kwargs):
+    """按名称创建VAD检测器"""
+    try:
+        return VAD_ENGINES[engine](**kwargs)
+    except KeyError:
+        raise ValueError(f"未知的VAD引擎: {engine}，可选: {', '.join(VAD_ENGINES)}")
+
+
+def read_wav_int16(path):
+    """读取单声道16位WAV文件，返回 (采样数组, 采样率)"""
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"只支持16位WAV: {path}")
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        if wf.getnchannels() > 1:
+            samples = samples.reshape(-1, wf.getnchannels())[:, 0]
+        return samples, wf.getframerate()
+
+
+def _transitions(decisions):
+    """返回判定由非语音变为语音、由语音变为非语音的帧下标"""
+    padded = np.concatenate(([False], decisions, [False])).astype(np.int8)
+    diff = np.diff(padded)
+    return np.flatnonzero(diff == 1), np.flatnonzero(diff == -1)
+
+
+def score_file(vad, samples, rate, speech, tolerance=0.2):
+    """评测单个文件
+
+    speech 为标注的语音区间列表（秒）。触发点不落在任何语音区间（含容差）内记为误触发；
+    每个语音区间结束后第一个判定结束的时刻与标注结束之差记为端点延迟。
+    """
+    vad.reset()
+    decisions = vad.process(samples)
+    frame_sec = vad.frame_len / rate
+    onsets, offsets = _transitions(decisions)
+    onset_times = onsets * frame_sec
+    offset_times = offsets * frame_sec
+
+    false_triggers = 0
+    for t in onset_times:
+        if not any(start - tolerance <= t <= end + tolerance for start, end in speech):
+            false_triggers += 1
+
+    latencies = []
+    missed = 0
+    for start, end in speech:
+        first = int(start / frame_sec)
+        last = int(np.ceil(end / frame_sec))
+        if not decisions[first:last].any():
+            missed += 1
+            continue
+        later = offset_times[offset_times >= end - tolerance]
+        latencies.append(float((later[0] if len(later) else len(decisions) * frame_sec) - end))
+
+    speech_sec = sum(end - start for start, end in speech)
+    return {
+        "duration": len(samples) / rate,
+        "non_speech_duration": max(len(samples) / rate - speech_sec, 0.0),
+        "triggers": len(onset_times),
+        "false_triggers": false_triggers,
+        "segments": len(speech),
+        "missed_segments": missed,
+        "endpoint_latencies": latencies,
+    }
+
+
+def score_directory(directory, engine="adaptive", tolerance=0.2, **vad_kwargs):
+    """评测目录下所有带标注的WAV文件，返回汇总指标"""
+    files = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(".wav"):
+            continue
+        label_path = os.path.join(directory, os.path.splitext(name)[0] + ".json")
+        if not os.path.exists(label_path):
+            continue
+        samples, rate = read_wav_int16(os.path.join(directory, name))
+        with open(label_path, "r", encoding="utf-8") as f:
+            speech = json.load(f)["speech"]
+        vad = create_vad(engine, rate=rate, **vad_kwargs)
+        result = score_file(vad, samples, rate, speech, tolerance)
+        result["file"] = name
+        files.append(result)
+
+    triggers = sum(r["triggers"] for r in files)
+    false_triggers = sum(r["false_triggers"] for r in files)
+    non_speech_min = sum(r["non_speech_duration"] for r in files) / 60
+    latencies = np.array([l for r in files for l in r["endpoint_latencies"]])
+    summary = {
+        "engine": engine,
+        "files": len(files),
+        "triggers": triggers,
+        "false_triggers": false_triggers,
+        "false_trigger_rate": false_triggers / triggers if triggers else 0.0,
+        "false_triggers_per_min": false_triggers / non_speech_min if non_speech_min else 0.0,
+        "missed_segments": sum(r["missed_segments"] for r in files),
+        "endpoint_latency_mean": float(latencies.mean()) if len(latencies) else None,
+        "endpoint_latency_p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "endpoint_latency_p95": float(np.percentile(latencies, 95)) if len(latencies) else None,
+    }
+    return {"summary": summary, "files": files}
+
+
+def noise_step_check(engine="adaptive", rate=DEFAULT_RATE, quiet=60.0, loud=2000.0, before=4.0, after=30.0,
+                     settle=5.0, max_duration=20.0, seed=0, **vad_kwargs):
+    """回归检查：平稳噪声突然变大（例如开了空调或风扇）后检测器应在 settle 秒内恢复
+
+    返回突增 settle 秒后仍判为语音的帧比例，以及按 max_duration 切分出的录音段数
+    """
+    rng = np.random.default_rng(seed)
+    samples = np.concatenate((
+        rng.normal(0, quiet, int(rate * before)),
+        rng.normal(0, loud, int(rate * after)),
+    )).clip(-32768, 32767).astype(np.int16)
+    vad = create_vad(engine, rate=rate, **vad_kwargs)
+    decisions = vad.process(samples)
+    frame_sec = vad.frame_len / rate
+    settled = decisions[int((before + settle) / frame_sec):]
+    endpointer = Endpointer(create_vad(engine, rate=rate, **vad_kwargs), max_duration=max_duration)
+    ends = [event for event in endpointer.feed(samples) if event[0] == "end"]
+    return {
+        "engine": engine,
+        "speech_ratio_after_settle": float(settled.mean()) if len(settled) else 0.0,
+        "utterances": len(ends) + int(endpointer.active),
+        "noise_floor": round(float(getattr(vad, "noise_floor", 0.0)), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VAD评测工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    score = sub.add_parser("score", help="在标注WAV目录上评测误触发率和端点延迟")
+    score.add_argument("directory")
+    score.add_argument("--engine", default="adaptive", choices=sorted(VAD_ENGINES))
+    score.add_argument("--spectral", action="store_true", help="启用谱平坦度特征（仅adaptive）")
+    score.add_argument("--tolerance", type=float, default=0.2, help="标注边界容差（秒）")
+    score.add_argument("--details", action="store_true", help="输出每个文件的结果")
+    check = sub.add_parser("check", help="合成的平稳噪声突增回归检查")
+    check.add_argument("--engine", default="adaptive", choices=sorted(VAD_ENGINES))
+    check.add_argument("--max-speech-ratio", type=float, default=0.01, help="恢复后允许判为语音的帧比例")
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        result = noise_step_check(args.engine)
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        if result["speech_ratio_after_settle"] > args.max_speech_ratio:
+            print(f"失败: 噪声突增后仍有 {result['speech_ratio_after_settle']:.1%} 的帧判为语音")
+            sys.exit(1)
+        return
+
+    vad_kwargs = {"use_spectral": True} if args.spectral and args.engine == "adaptive" else {}
+    report = score_directory(args.directory, args.engine, args.tolerance, **vad_kwargs)
+    if not args.details:
+        report = report["summary"]
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()